@@ -0,0 +1,102 @@
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from serialization import dump
+
+
+class RunAccounting:
+    """
+    Per research run ledger of LLM calls and scrapes.
+    Every record is tagged with stage, vertical and ResearchNode id, `summary()` aggregates them per stage.
+    """
+
+    def __init__(self, run_id: Optional[str] = None):
+        self.run_id = run_id
+        self.started_at = datetime.now().isoformat()
+        self._t0 = time.monotonic()
+        self.records: List[Dict[str, Any]] = []
+
+    def record_llm(
+        self,
+        stage: str,
+        input_tokens: int,
+        output_tokens: int,
+        latency: float,
+        retries: int = 0,
+        queued: float = 0.0,
+        vertical: Optional[str] = None,
+        node_id: Optional[str] = None,
+    ):
+        self.records.append(
+            {
+                "kind": "llm",
+                "stage": stage,
+                "vertical": vertical,
+                "node_id": node_id,
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "latency": round(latency, 3),
+                "queued": round(queued, 3),
+                "retries": retries,
+                "t": round(time.monotonic() - self._t0, 3),
+            }
+        )
+
+    def record_scrape(
+        self,
+        latency: float,
+        pages: int,
+        text_bytes: int,
+        retries: int = 0,
+        stage: str = "scrape",
+        vertical: Optional[str] = None,
+        node_id: Optional[str] = None,
+    ):
+        self.records.append(
+            {
+                "kind": "scrape",
+                "stage": stage,
+                "vertical": vertical,
+                "node_id": node_id,
+                "pages": pages,
+                "text_bytes": text_bytes,
+                "latency": round(latency, 3),
+                "retries": retries,
+                "t": round(time.monotonic() - self._t0, 3),
+            }
+        )
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(r.get("input_tokens", 0) + r.get("output_tokens", 0) for r in self.records)
+
+    def summary(self) -> Dict[str, Any]:
+        stages: Dict[str, Dict[str, Any]] = {}
+        for r in self.records:
+            stage = stages.setdefault(
+                r["stage"], {"calls": 0, "input_tokens": 0, "output_tokens": 0, "latency": 0.0, "retries": 0, "pages": 0, "text_bytes": 0}
+            )
+            stage["calls"] += 1
+            stage["latency"] += r["latency"]
+            stage["retries"] += r["retries"]
+            for key in ("input_tokens", "output_tokens", "pages", "text_bytes"):
+                stage[key] += r.get(key, 0)
+        for stage in stages.values():
+            stage["latency"] = round(stage["latency"], 3)
+
+        return {
+            "wall_time": round(time.monotonic() - self._t0, 3),
+            "llm_calls": sum(1 for r in self.records if r["kind"] == "llm"),
+            "scrapes": sum(1 for r in self.records if r["kind"] == "scrape"),
+            "input_tokens": sum(r.get("input_tokens", 0) for r in self.records),
+            "output_tokens": sum(r.get("output_tokens", 0) for r in self.records),
+            "retries": sum(r["retries"] for r in self.records),
+            "stages": stages,
+        }
+
+    def to_trace(self) -> Dict[str, Any]:
+        return {"run_id": self.run_id, "started_at": self.started_at, "summary": self.summary(), "records": self.records}
+
+    def export_json(self, path: str):
+        dump(self.to_trace(), path)
@@ -1,17 +1,27 @@
 import asyncio
-import json
 import logging
 import os
 import time
-from typing import Dict
+import uuid
+from typing import Any, Dict, Optional
 
 import socketio
 from dotenv import load_dotenv
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-
+from fastapi.responses import StreamingResponse
+
+from artifact_store import get_artifact_store
+from budget import RunBudget
+from cancellation import AbortStats, cancel_and_wait
+from compression import frame, negotiate_codec
+from event_queue import OutboundQueue
+from job_store import CANCELLED, DONE, FAILED, FINISHED, QUEUED, get_job_store
 from knet import KNet
+from research_cache import Flight, ResultCache, Singleflight, request_key
+from scheduler import SchedulerFull, get_scheduler
 from scraper import CrawlForAIScraper
+from serialization import JSON, SocketJSON, dumpb, dumps, encode, loads, negotiate
 
 load_dotenv()
 
@@ -34,14 +44,71 @@ sio = socketio.AsyncServer(
     ping_timeout=1200,
     ping_interval=10,
     async_mode="asgi",
+    json=SocketJSON,  # orjson for every packet
 )
+
+
+@app.get("/artifacts/{job_id}/{name}")
+async def get_artifact(job_id: str, name: str, request: Request):
+    """
+    Streams a run's report, findings or tree.
+    Sent as stored (Content-Encoding) when the client accepts the codec, decompressed on the fly otherwise.
+    """
+    artifacts = get_artifact_store()
+    media_type = "text/plain; charset=utf-8" if name == "findings" else "application/json"
+    try:
+        codec, chunks = await artifacts.stream_raw(job_id, name)
+        if codec in request.headers.get("accept-encoding", ""):
+            return StreamingResponse(chunks, media_type=media_type, headers={"Content-Encoding": codec})
+        await chunks.aclose()
+        return StreamingResponse(artifacts.stream(job_id, name), media_type=media_type)
+    except (FileNotFoundError, ValueError):
+        raise HTTPException(status_code=404, detail=f"No artifact '{name}' for job {job_id}")
+
+
+# Registered last, it takes every path not matched above
 app.mount("/", socketio.ASGIApp(sio))
 
 
+# Events that carry the full report and tree
+COMPRESSED_EVENTS = {"research_complete"}
+
+# Set (KNET_JOB_STORE): research runs in worker.py processes, this process only enqueues and relays events
+job_store = get_job_store()
+JOB_KIND = "knet"
+
+# Identical requests share a running research, completed reports are served from the cache for a while
+flights = Singleflight()
+result_cache = ResultCache()
+# Time from abort (or disconnect) until the run stopped
+abort_stats = AbortStats()
+
+
 class SessionManager:
     def __init__(self):
         self.sessions: Dict[str, tuple[KNet, CrawlForAIScraper]] = {}
         self.tasks: Dict[str, asyncio.Task] = {}  # Track research tasks for each session
+        self.queues: Dict[str, OutboundQueue] = {}  # Outbound events for each session
+        self.encodings: Dict[str, str] = {}  # Negotiated payload encoding for each session
+        self.codecs: Dict[str, str] = {}  # Negotiated compression for each session
+        self.users: Dict[str, str] = {}  # Client address for each session, the scheduler's fairness key
+
+    def get_queue(self, sid: str) -> OutboundQueue:
+        if sid not in self.queues:
+            self.queues[sid] = OutboundQueue(lambda event, data: sio.emit(event, self.pack(sid, event, data), room=sid))
+        return self.queues[sid]
+
+    def pack(self, sid: str, event: str, data: Any) -> Any:
+        # Negotiated encoding, plus compression for large results
+        encoding = self.encodings.get(sid, JSON)
+        payload = encode(data, encoding)
+        if event in COMPRESSED_EVENTS and self.codecs.get(sid):
+            raw = payload if isinstance(payload, bytes) else dumpb(payload)
+            framed = frame(raw, self.codecs[sid], encoding)
+            if framed:
+                logger.info(f"'{event}' for {sid}: {len(raw)} -> {len(framed['data'])} bytes on the wire ({framed['codec']})")
+                return framed
+        return payload
 
     async def get_or_create_session(self, sid: str) -> tuple[KNet, CrawlForAIScraper]:
         if sid not in self.sessions:
@@ -51,24 +118,55 @@ class SessionManager:
             self.sessions[sid] = (knet, scraper)
         return self.sessions[sid]
 
+    async def stop_research(self, sid: str):
+        """
+        Cancels the session's research and waits until the run stopped, at most KNET_ABORT_TIMEOUT seconds.
+        A run stuck past that in the browser gets its browser closed under it.
+        """
+        task = self.tasks.pop(sid, None)
+        if task is None or task.done():
+            return
+        started = time.monotonic()
+        flight = flights.find(sid)
+        stopped = await cancel_and_wait(task)  # Leaves the flight, which is cancelled too when no other session follows it
+        if flight is not None:
+            if flight.subscribers:
+                logger.info(f"Session {sid} left research {flight.key}, other sessions still follow it")
+                return
+            stopped = await cancel_and_wait(flight.task, force=(lambda: self.release_browser(flight.owner)) if job_store is None else None)
+        elapsed = abort_stats.record(started, stopped)
+        if stopped:
+            logger.info(f"Research of session {sid} stopped {elapsed:.2f}s after the abort")
+        else:
+            logger.error(f"Research of session {sid} still running {elapsed:.2f}s after the abort")
+
+    async def release_browser(self, sid: str):
+        # Next research of the session starts with a fresh browser
+        if sid in self.sessions:
+            _, scraper = self.sessions.pop(sid)
+            await scraper.close()
+
     async def cleanup_session(self, sid: str):
-        # Cancel running task if it exists
-        if sid in self.tasks and not self.tasks[sid].done():
-            self.tasks[sid].cancel()
-            try:
-                await self.tasks[sid]
-            except asyncio.CancelledError:
-                logger.info(f"Research task for session {sid} was cancelled")
-            except Exception as e:
-                logger.error(f"Error while cancelling task for {sid}: {str(e)}")
-            finally:
-                del self.tasks[sid]
+        await self.stop_research(sid)
+
+        # Drop undelivered events
+        if sid in self.queues:
+            logger.info(f"Outbound queue for session {sid}: {self.queues[sid].stats()}")
+            await self.queues.pop(sid).close()
+
+        self.encodings.pop(sid, None)
+        self.codecs.pop(sid, None)
+        self.users.pop(sid, None)
 
         # Clean up session resources
         if sid in self.sessions:
-            _, scraper = self.sessions[sid]
-            await scraper.close()
-            del self.sessions[sid]
+            _, scraper = self.sessions.pop(sid)
+            flight = next((f for f in flights.flights.values() if f.owner == sid and not f.task.done()), None)
+            if flight is not None:
+                # Other sessions still follow the run on this browser, close it once the run ends
+                flight.task.add_done_callback(lambda _: asyncio.create_task(scraper.close()))
+            else:
+                await scraper.close()
 
     def register_task(self, sid: str, task: asyncio.Task):
         self.tasks[sid] = task
@@ -80,7 +178,9 @@ session_manager = SessionManager()
 @sio.event
 async def connect(sid, environ, auth):
     logger.info(f"Client connected: {sid}")
-    await session_manager.get_or_create_session(sid)
+    session_manager.users[sid] = (environ.get("HTTP_X_FORWARDED_FOR") or environ.get("REMOTE_ADDR") or sid).split(",")[0].strip()
+    if job_store is None:  # Workers own the browsers otherwise
+        await session_manager.get_or_create_session(sid)
 
 
 @sio.event
@@ -98,51 +198,187 @@ async def health_check(sid, data):
 @sio.event
 async def start_research(sid, data):
     try:
-        data = json.loads(data) if type(data) is not dict else data
+        data = loads(data) if type(data) is not dict else data
         topic = data.get("topic").strip()
         max_depth: int = data.get("max_depth")
         num_sites_per_query: int = data.get("num_sites_per_query")
-
-        knet, _ = await session_manager.get_or_create_session(sid)
+        fused_planner: bool | None = data.get("fused_planner")  # A/B switch, defaults to KNET_FUSED_PLANNER
+        force_refresh = bool(data.get("force_refresh"))  # Run again even if a cached report exists
+        # Optional budget: seconds of research and/or LLM tokens, the run adapts its breadth and depth to finish within it
+        budget = {"deadline": data.get("deadline"), "max_tokens": data.get("max_tokens")} if data.get("deadline") or data.get("max_tokens") else None
 
         session_id = sid
+        # Optional binary payloads: client lists the encodings and codecs it can decode, e.g. ["msgpack", "json"], ["zstd", "deflate"]
+        session_manager.encodings[sid] = negotiate(data.get("encoding"))
+        session_manager.codecs[sid] = negotiate_codec(data.get("compression"))
+        await sio.emit("encoding", {"encoding": session_manager.encodings[sid], "compression": session_manager.codecs[sid]}, room=sid)
+        queue = session_manager.get_queue(session_id)
         logger.info(f"Starting research for client {session_id}.\nTopic '{topic}'")
 
-        async def progress_callback(status: dict):
-            await sio.emit("status", status, room=session_id)
-
-        task = asyncio.create_task(knet.conduct_research(topic, progress_callback, max_depth, num_sites_per_query))
+        key = request_key(topic, max_depth, num_sites_per_query, fused_planner, budget)
+        if not force_refresh and (cached := await result_cache.get(key)) is not None:
+            logger.info(f"Serving cached research for client {session_id}")
+            queue.put("status", {"progress": 100, "message": "Research complete!", "cached": True})
+            queue.put("research_complete", cached)
+            return
+
+        priority = max(1, int(data.get("priority", 1)))  # Clients may only lower their own priority, 0 is reserved
+        params = {
+            "topic": topic,
+            "max_depth": max_depth,
+            "num_sites_per_query": num_sites_per_query,
+            "fused_planner": fused_planner,
+            "budget": budget,
+        }
+
+        async def run(flight: Flight):
+            if job_store is not None:
+                result = await run_job(sid, params, priority, flight)
+            else:
+                result = await run_inline(sid, params, priority, flight)
+            if result and result.get("job_id"):
+                result_cache.put(key, result["job_id"])
+            return result
+
+        # Concurrent identical requests share one run, each session gets its progress
+        flight = flights.join(key, sid, lambda status: queue.put("status", status), run)
+        if flight.owner != sid and flight.snapshot is not None:
+            await flight.snapshot()  # Full tree for the session that just joined
+
+        task = asyncio.create_task(flights.wait(flight, sid))
         session_manager.register_task(sid, task)
-        research_results = await task
+        try:
+            research_results = await task
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                raise  # This handler itself is being cancelled, not just the research
+            research_results = None
+        if sid not in session_manager.queues:
+            return  # Disconnected meanwhile
 
         if not research_results:
-            sio.emit("research_aborted", room=session_id)
+            queue.put("research_aborted")
+            return
 
         logger.info(f"Research completed for topic: {topic}")
-        await sio.emit("research_complete", research_results, room=session_id)
+        queue.put("research_complete", research_results)
 
+    except SchedulerFull as e:
+        logger.warning(f"Rejected research for {sid}: {str(e)}")
+        session_manager.get_queue(sid).put("error", {"message": str(e), "code": e.reason})
     except Exception as e:
         logger.error(f"Research error: {str(e)}")
-        await sio.emit("error", {"message": str(e)}, room=session_id)
+        session_manager.get_queue(sid).put("error", {"message": str(e)})
+
+
+async def run_inline(sid: str, params: dict, priority: int, flight: Flight) -> dict:
+    """Runs the research in this process on the session's KNet, progress goes to every session of the flight"""
+    knet, _ = await session_manager.get_or_create_session(sid)
+
+    async def snapshot():
+        if knet.progress:
+            await knet.progress.snapshot()
+
+    flight.snapshot = snapshot
+
+    # Admission control, raises SchedulerFull when over capacity
+    scheduler = get_scheduler()
+    ticket = scheduler.submit(session_manager.users.get(sid, sid), priority)
+    try:
+        async for position in ticket.positions():
+            await flight.broadcast({"progress": 0, "message": f"Waiting in queue: position {position}", "queue_position": position})
+        # Never waits on the clients, see OutboundQueue
+        return await knet.conduct_research(
+            params["topic"],
+            flight.broadcast,
+            params["max_depth"],
+            params["num_sites_per_query"],
+            params["fused_planner"],
+            budget=RunBudget.from_params(params["budget"]),
+        )
+    finally:
+        scheduler.release(ticket)
+
+
+async def run_job(sid: str, params: dict, priority: int, flight: Flight) -> Optional[dict]:
+    """Enqueues a run in the job store and relays its progress until it finishes, returns the report (None if cancelled)"""
+    user_id = session_manager.users.get(sid, sid)
+    # Admission control across every API process, the store is the shared queue
+    if await job_store.count(QUEUED) >= int(os.getenv("KNET_MAX_QUEUED_RUNS", 10)):
+        raise SchedulerFull("Server is at capacity, try again later", "queue_full")
+    max_per_user = int(os.getenv("KNET_MAX_QUEUED_PER_USER", 2))
+    if await job_store.count(QUEUED, user_id) >= max_per_user:
+        raise SchedulerFull(f"You already have {max_per_user} research runs waiting", "user_limit")
+
+    job_id = uuid.uuid4().hex
+    await job_store.submit(job_id, JOB_KIND, params, user_id, priority)
+    flight.snapshot = lambda: job_store.request_snapshot(job_id)
+    logger.info(f"Queued job {job_id} for client {sid}")
+
+    poll_interval = float(os.getenv("KNET_JOB_POLL_INTERVAL", 0.25))
+    after, last_position = 0, None
+    try:
+        while True:
+            # Status before events, so every event written before the job finished is read
+            job = await job_store.get(job_id)
+            position = await job_store.position(job_id)
+            if position is not None and position != last_position:
+                last_position = position
+                await flight.broadcast({"progress": 0, "message": f"Waiting in queue: position {position}", "queue_position": position})
+            events = await job_store.events(job_id, after, limit=500)
+            for after, event, data in events:
+                if event == "status":
+                    await flight.broadcast(data)
+            if (job is None or job["status"] in FINISHED) and len(events) < 500:
+                break
+            await asyncio.sleep(poll_interval)
+    except asyncio.CancelledError:
+        # Every session left, stop the run on its worker as well
+        await job_store.request_cancel(job_id)
+        raise
+
+    job = await job_store.get(job_id, with_result=True) or {"status": CANCELLED}
+    if job["status"] == FAILED:
+        raise RuntimeError(job.get("error") or "Research failed")
+    return job["result"] if job["status"] == DONE else None
+
+
+@sio.event
+async def tree_snapshot(sid):
+    # Client asks for the full tree outline, e.g. after missing a research_tree_delta
+    flight = flights.find(sid)
+    if flight is not None and flight.snapshot is not None:
+        await flight.snapshot()
+        return
+    knet, _ = await session_manager.get_or_create_session(sid)
+    if knet.progress:
+        await knet.progress.snapshot()
+
+
+@sio.event
+async def queue_stats(sid):
+    stats = {**session_manager.get_queue(sid).stats(), "scheduler": get_scheduler().stats(), "aborts": abort_stats.stats()}
+    await sio.emit("queue_stats", {**stats, "result_cache": result_cache.stats(), "joined_runs": flights.joined}, room=sid)
 
 
 @sio.event
 async def abort_research(sid):
+    # Only the research stops, the session keeps its queue and browser for the next one
     logger.info(f"Aborting research for client {sid}")
-    await session_manager.cleanup_session(sid)
+    await session_manager.stop_research(sid)
 
 
 @sio.event
 async def test(sid, data):
-    data = json.loads(data) if type(data) is not dict else data
+    data = loads(data) if type(data) is not dict else data
     topic = data.get("topic").strip().replace("\n", "")
-    logger.info(json.dumps(data, indent=2))
+    logger.info(dumps(data, indent=True))
 
     knet, _ = await session_manager.get_or_create_session(sid)
-    time.sleep(1)
+    queue = session_manager.get_queue(sid)
 
     async def progress_callback(status: dict):
-        await sio.emit("status", status, room=sid)
+        queue.put("status", status)
 
     # Create a task and register it for proper cancellation
     task = asyncio.create_task(knet.test(topic, progress_callback))
@@ -151,10 +387,13 @@ async def test(sid, data):
     try:
         await task
 
-        with open("output.log.json", "r") as f:
-            data = json.load(f)
-        await sio.emit("research_complete", data, room=sid)
+        # Replays this session's last report
+        if not knet.job_id:
+            raise ValueError("No research in this session yet, the test event replays the last report")
+        queue.put("research_complete", await get_artifact_store().get_json(knet.job_id, "report"))
     except asyncio.CancelledError:
+        if asyncio.current_task().cancelling():
+            raise
         logger.info(f"Test task for '{topic}' was cancelled")
         await sio.emit("research_aborted", room=sid)
     except Exception as e:
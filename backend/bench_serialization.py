@@ -0,0 +1,76 @@
+"""
+Microbenchmark: stdlib json vs orjson (and msgpack when installed) on a research result shaped payload.
+Usage: python bench_serialization.py [n_pages] [page_kib]
+"""
+
+import json
+import random
+import string
+import sys
+import timeit
+
+import serialization
+
+
+def make_payload(n_pages: int = 40, page_kib: int = 32) -> dict:
+    rng = random.Random(0)
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 10))) for _ in range(2000)]
+
+    def text(n_bytes: int) -> str:
+        out, size = [], 0
+        while size < n_bytes:
+            word = rng.choice(words)
+            out.append(word)
+            size += len(word) + 1
+        return " ".join(out)
+
+    def node(depth: int, n: int) -> dict:
+        return {
+            "query": text(60),
+            "depth": depth,
+            "sources": {f"https://example.com/{depth}/{i}": text(page_kib * 1024) for i in range(n)},
+            "children": [node(depth + 1, n) for _ in range(2)] if depth < 2 else [],
+        }
+
+    per_node = max(1, n_pages // 7)  # 1 + 2 + 4 nodes
+    return {
+        "topic": text(80),
+        "content": text(20 * 1024),
+        "media": {
+            "images": [f"https://img.example.com/{i}.png" for i in range(300)],
+            "videos": [f"https://video.example.com/{i}" for i in range(20)],
+            "links": [{"url": f"https://example.com/link/{i}", "text": text(40)} for i in range(500)],
+        },
+        "research_tree": node(0, per_node),
+        "metadata": {"total_queries": 6, "total_sources": per_node * 7, "max_depth_reached": 2},
+    }
+
+
+def bench(name: str, fn, number: int) -> float:
+    seconds = min(timeit.repeat(fn, number=number, repeat=5)) / number
+    print(f"{name:<28} {seconds * 1000:8.2f} ms")
+    return seconds
+
+
+if __name__ == "__main__":
+    n_pages = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    page_kib = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    payload = make_payload(n_pages, page_kib)
+    encoded = json.dumps(payload)
+    number = 10
+    print(f"payload: {len(encoded) / 1024 / 1024:.2f} MiB JSON")
+
+    base = bench("json.dumps(indent=2)", lambda: json.dumps(payload, indent=2), number)
+    bench("json.dumps", lambda: json.dumps(payload), number)
+    fast = bench("orjson dumps(indent)", lambda: serialization.dumpb(payload, indent=True), number)
+    bench("orjson dumps", lambda: serialization.dumpb(payload), number)
+    print(f"-> orjson (indented) is {base / fast:.1f}x faster than json (indented)")
+
+    bench("json.loads", lambda: json.loads(encoded), number)
+    bench("orjson loads", lambda: serialization.loads(encoded), number)
+
+    if serialization.msgpack:
+        packed = serialization.encode(payload, serialization.MSGPACK)
+        print(f"msgpack: {len(packed) / 1024 / 1024:.2f} MiB")
+        bench("msgpack packb", lambda: serialization.encode(payload, serialization.MSGPACK), number)
+        bench("msgpack unpackb", lambda: serialization.msgpack.unpackb(packed), number)
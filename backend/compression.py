@@ -0,0 +1,54 @@
+import base64
+import os
+import zlib
+from typing import Iterable, Optional
+
+try:
+    import zstandard
+except ImportError:  # Optional, deflate is always available
+    zstandard = None
+
+ZSTD = "zstd"
+DEFLATE = "deflate"
+CODECS = (ZSTD, DEFLATE) if zstandard else (DEFLATE,)
+
+
+def negotiate_codec(accepted: Optional[str | Iterable[str]]) -> Optional[str]:
+    """First codec the client accepts that we support, None for no compression"""
+    if not accepted:
+        return None
+    if isinstance(accepted, str):
+        accepted = [part.strip() for part in accepted.split(",")]
+    for codec in accepted:
+        if codec in CODECS:
+            return codec
+    return None
+
+
+def compress(data: bytes, codec: str) -> bytes:
+    if codec == ZSTD and zstandard:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    if codec == DEFLATE:
+        # zlib container, what the browser's DecompressionStream("deflate") reads
+        return zlib.compress(data, 6)
+    raise ValueError(f"Unsupported codec '{codec}'")
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == ZSTD and zstandard:
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == DEFLATE:
+        return zlib.decompress(data)
+    raise ValueError(f"Unsupported codec '{codec}'")
+
+
+def frame(data: bytes, codec: Optional[str], encoding: str = "json", text: bool = False, min_bytes: Optional[int] = None) -> Optional[dict]:
+    """
+    Compressed frame for an already serialized payload, None if it's under `min_bytes` (KNET_COMPRESS_MIN_BYTES) or no codec was negotiated.
+    {"codec", "encoding", "data"}: `encoding` is the serialization inside, `data` is bytes (base64 str when `text`, for SSE).
+    """
+    min_bytes = min_bytes if min_bytes is not None else int(os.getenv("KNET_COMPRESS_MIN_BYTES", 64 * 1024))
+    if not codec or len(data) < min_bytes:
+        return None
+    compressed = compress(data, codec)
+    return {"codec": codec, "encoding": encoding, "data": base64.b64encode(compressed).decode("ascii") if text else compressed}
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import os
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+
+def merge_status(old: Dict[str, Any], new: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Fold a newer `status` payload into a pending one.
+    Returns None when they can't be merged without losing data (report sections or a tree snapshot followed by a delta).
+    """
+    old_report, new_report = old.get("report_delta"), new.get("report_delta")
+    if old_report and new_report and old_report["index"] != new_report["index"]:
+        return None
+    if "research_tree" in old and "research_tree_delta" in new:
+        return None
+
+    merged = {**old, **new}  # Latest progress and message win
+    if "research_tree" in new:
+        merged.pop("research_tree_delta", None)  # Superseded by the snapshot
+    elif "research_tree_delta" in old and "research_tree_delta" in new:
+        old_delta, new_delta = old["research_tree_delta"], new["research_tree_delta"]
+        merged["research_tree_delta"] = {"base": old_delta["base"], "version": new_delta["version"], "ops": old_delta["ops"] + new_delta["ops"]}
+    if old_report and new_report:
+        merged["report_delta"] = {**new_report, "delta": old_report["delta"] + new_report["delta"]}
+    return merged
+
+
+class OutboundQueue:
+    """
+    Per session queue between the research pipeline and the socket.
+    - put() never blocks or awaits the client, a background task does the emitting
+    - `status` events still waiting are coalesced into one (tree deltas and report text are concatenated)
+    - `status` events go out at most `max_rate` per second
+    - Past `max_pending` the oldest waiting `status` events are dropped, other events are always delivered.
+      A dropped tree delta shows up as a version gap on the client, which then asks for a snapshot.
+    """
+
+    def __init__(self, emit: Callable[[str, Any], Awaitable[Any]], max_rate: Optional[float] = None, max_pending: Optional[int] = None):
+        self.logger = logging.getLogger(__name__)
+        self.emit = emit
+        self.max_rate = max_rate or float(os.getenv("KNET_EMIT_RATE", 10))
+        self.max_pending = max_pending or int(os.getenv("KNET_EMIT_MAX_PENDING", 200))
+        self._events: Deque[List[Any]] = deque()  # [event, data]
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._emitting = False
+
+        # Counters
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    def put(self, event: str, data: Any = None):
+        if event == "status" and self._events and self._events[-1][0] == "status":
+            merged = merge_status(self._events[-1][1], data)
+            if merged is not None:
+                self._events[-1][1] = merged
+                self.coalesced += 1
+                return
+
+        self._events.append([event, data])
+        while len(self._events) > self.max_pending and self._drop_oldest_status():
+            self.dropped += 1
+
+        self._ready.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stats(self) -> dict:
+        return {"pending": len(self._events), "sent": self.sent, "coalesced": self.coalesced, "dropped": self.dropped}
+
+    async def flush(self, timeout: float = 30):
+        """Waits until everything put so far was emitted, or `timeout` seconds passed"""
+        deadline = asyncio.get_running_loop().time() + timeout
+        while (self._events or self._emitting) and asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(0.05)
+
+    async def close(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._events.clear()
+
+    def _drop_oldest_status(self) -> bool:
+        for i, (event, _) in enumerate(self._events):
+            if event == "status":
+                del self._events[i]
+                return True
+        return False
+
+    async def _run(self):
+        while True:
+            await self._ready.wait()
+            while self._events:
+                event, data = self._events.popleft()
+                self._emitting = True
+                try:
+                    await self.emit(event, data)
+                    self.sent += 1
+                except Exception as e:
+                    self.logger.error(f"Emit '{event}' failed: {str(e)}")
+                finally:
+                    self._emitting = False
+                if event == "status":
+                    # Rate limit, statuses put meanwhile are coalesced into the next one
+                    await asyncio.sleep(1 / self.max_rate)
+            self._ready.clear()
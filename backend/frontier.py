@@ -0,0 +1,98 @@
+import heapq
+import itertools
+import os
+from collections import Counter
+from typing import FrozenSet, List, Optional, Set, Tuple
+
+from query_registry import query_terms as terms
+from research_node import ResearchNode
+
+
+class Coverage:
+    """
+    What a run has explored so far, across every vertical: the queries, the terms of the pages found and their URLs.
+    Scores how much a new query is likely to add on top of it.
+    """
+
+    def __init__(self):
+        self.queries: List[FrozenSet[str]] = []
+        self.found = Counter()  # Term -> pages whose title contained it
+        self.urls: Set[str] = set()
+        self.scrapes = 0
+        self.overlap_total = 0.0
+        self.dropped = 0  # Candidates never expanded, past a frontier's node limit or the budget
+
+    def observe(self, node: ResearchNode) -> float:
+        """Records an explored node, returns the share of its pages an earlier query had already found (SERP overlap)"""
+        self.queries.append(terms(node.query))
+        pages = list(node.pages(fields=("url", "title")))
+        urls = [page["url"] for page in pages if page["url"]]
+        overlap = sum(url in self.urls for url in urls) / len(urls) if urls else 1.0
+        for page in pages:
+            self.found.update(terms(page["title"] or ""))
+        self.urls.update(urls)
+        self.scrapes += 1
+        self.overlap_total += overlap
+        return overlap
+
+    def novelty(self, query: str) -> float:
+        """1 for a query on ground nothing covered yet, 0 for one already asked"""
+        words = terms(query)
+        if not words:
+            return 0.0
+        asked = max((len(words & seen) / len(words | seen) for seen in self.queries), default=0.0)
+        covered = sum(1 for word in words if self.found[word] >= 2) / len(words)
+        return 1 - (0.6 * asked + 0.4 * covered)
+
+    def stats(self) -> dict:
+        return {
+            "scrapes": self.scrapes,
+            "unique_sources": len(self.urls),
+            "serp_overlap": round(self.overlap_total / self.scrapes, 3) if self.scrapes else 0.0,
+            "dropped": self.dropped,
+        }
+
+
+class Frontier:
+    """
+    Best-first frontier of one vertical: the candidate with the highest expected gain is expanded first.
+    gain = novelty against the run's coverage - SERP overlap of the parent - `depth_penalty` per level below the root.
+    Scores go stale as coverage grows, a candidate is re-scored when it reaches the top and put back if it lost its place.
+    At most `max_nodes` candidates are expanded (0 for no limit), the rest are dropped.
+    """
+
+    def __init__(self, coverage: Coverage, depth_penalty: Optional[float] = None, max_nodes: int = 0):
+        self.coverage = coverage
+        self.depth_penalty = depth_penalty if depth_penalty is not None else float(os.getenv("KNET_FRONTIER_DEPTH_PENALTY", 0.15))
+        self.max_nodes = max_nodes
+        self._heap: List[Tuple[float, int, ResearchNode, int, float]] = []  # (-gain, -seq, node, depth, parent overlap)
+        self._seq = itertools.count()
+        self.expanded = 0
+
+    def __len__(self) -> int:
+        return 0 if self.exhausted() else len(self._heap)
+
+    def exhausted(self) -> bool:
+        return bool(self.max_nodes) and self.expanded >= self.max_nodes
+
+    def close(self):
+        """Counts the candidates left unexpanded as dropped"""
+        self.coverage.dropped += len(self._heap)
+        self._heap.clear()
+
+    def gain(self, node: ResearchNode, depth: int, overlap: float) -> float:
+        return self.coverage.novelty(node.query) - 0.5 * overlap - self.depth_penalty * (depth - 1)
+
+    def push(self, node: ResearchNode, depth: int, overlap: float = 0.0):
+        # Newest first among equal gains, the old depth first order
+        heapq.heappush(self._heap, (-self.gain(node, depth, overlap), -next(self._seq), node, depth, overlap))
+
+    def pop(self) -> Tuple[ResearchNode, int, float]:
+        """(node, depth, gain) of the best candidate"""
+        while True:
+            _, seq, node, depth, overlap = heapq.heappop(self._heap)
+            gain = self.gain(node, depth, overlap)
+            if not self._heap or gain >= -self._heap[0][0]:
+                self.expanded += 1
+                return node, depth, gain
+            heapq.heappush(self._heap, (-gain, seq, node, depth, overlap))
@@ -1,19 +1,27 @@
 import asyncio
-import json
 import logging
 import os
 import time
-from collections import deque
+import uuid
+from contextlib import aclosing
 from datetime import datetime
 from textwrap import dedent
-from typing import Any, Dict, List
+from typing import Any, AsyncIterator, Dict, List, Optional, Set
 
 from dotenv import load_dotenv
 from google import genai
-from google.genai import types
 
+from accounting import RunAccounting
+from artifact_store import get_artifact_store
+from budget import RunBudget
+from frontier import Coverage, Frontier
+from llm_gateway import PRIORITY_BRANCH, PRIORITY_PLAN, PRIORITY_REPORT, PRIORITY_SUMMARY, estimate_tokens, get_gateway
+from link_index import LinkIndex, crawl_mode
+from llm_provider import LLMProvider, get_provider
+from query_registry import QueryRegistry
 from research_node import ResearchNode
 from scraper import CrawlForAIScraper
+from serialization import dumps
 
 load_dotenv()
 
@@ -92,6 +100,43 @@ class Prompt:
         Return as JSON array of objects with properties:
         - query (string)""")
 
+        self.next_action = dedent("""Given the current state of research on topic {vertical}, decide whether to continue exploring the current branch or not.
+        If you continue, also create the next google search queries.
+        <Original user query>
+        {topic}
+        </Original user query>
+
+        <Global Research Plan>
+        {research_plan}
+        </Global Research Plan>
+
+        Current Topic: {query}
+
+        <Past Searched Queries>
+        {past_queries}
+        </Past Searched Queries>
+
+        <Findings under current topic>
+        {ctx_manager}
+        </Findings under current topic>
+
+        For the decision consider:
+        - Information saturation
+        - Information duplication
+        - Coverage of current topic
+        - Potential for new insights
+
+        If the decision is true, suggest {n} specific google search queries that:
+        - Covers what has not been covered yet
+        - Builds upon these findings
+        - Explores different aspects
+        - Goes deeper into important details
+
+        - Do not do quote searches
+        - Queries should be generic and short
+        - Do not presume any knowledge about the topic
+        Return the decision (true/false) and the queries as branches (empty when the decision is false)""")
+
         self.report_outline = dedent("""Generate a outline for a report based on the findings:
         <Original user query>
         {topic}
@@ -152,6 +197,15 @@ class Schema:
             properties={"branches": genai.types.Schema(type=genai.types.Type.ARRAY, items=genai.types.Schema(type=genai.types.Type.STRING))},
         )
 
+        self.next_action = genai.types.Schema(
+            type=genai.types.Type.OBJECT,
+            required=["decision", "branches"],
+            properties={
+                "decision": genai.types.Schema(type=genai.types.Type.BOOLEAN),
+                "branches": genai.types.Schema(type=genai.types.Type.ARRAY, items=genai.types.Schema(type=genai.types.Type.STRING)),
+            },
+        )
+
         self.report_outline = genai.types.Schema(
             type=genai.types.Type.OBJECT,
             required=["title", "headings"],
@@ -173,185 +227,311 @@ class ResearchProgress:
         self.progress = 0
         self.callback = callback
         self.master_node = master_node
+        self.message = ""
+        self.tree_version: Optional[int] = None  # Last tree version sent to the client, None -> snapshot next
 
     async def update(self, progress: int, message: str):
         self.progress = int(min(100, self.progress + progress))  # max 100
-        await self.callback({"progress": self.progress, "message": message, "research_tree": self.master_node.build_tree_structure()})
+        self.message = message
+        await self.callback({"progress": self.progress, "message": message, **self.tree_changes()})
 
     async def setter(self, progress: int, message: str):
         self.progress = int(min(100, progress))  # max 100
-        await self.callback({"progress": self.progress, "message": message, "research_tree": self.master_node.build_tree_structure()})
+        self.message = message
+        await self.callback({"progress": self.progress, "message": message, **self.tree_changes()})
+
+    async def snapshot(self):
+        # Client (re)connected or lost track of the tree version
+        self.tree_version = None
+        await self.callback({"progress": self.progress, "message": self.message, **self.tree_changes()})
+
+    def tree_changes(self) -> dict:
+        """Full outline on the first event, only the changes since the last sent version afterwards"""
+        log = self.master_node.log
+        if self.tree_version is None:
+            self.tree_version = log.version
+            return {"research_tree": self.master_node.build_tree_outline(), "tree_version": log.version}
+        if log.version == self.tree_version:
+            return {}
+        base, self.tree_version = self.tree_version, log.version
+        return {"research_tree_delta": {"base": base, "version": log.version, "ops": log.since(base)}}
+
+    async def report_delta(self, index: int, heading: str, delta: str):
+        # Partial report text, no tree snapshot so each event stays small
+        await self.callback(
+            {"progress": self.progress, "message": "Generating report...", "report_delta": {"index": index, "heading": heading, "delta": delta}}
+        )
 
 
 class KNet:
-    def __init__(self, scraper_instance: CrawlForAIScraper, max_depth: int = 1, num_sites_per_query: int = 5):
-        self.api_key = os.getenv("GOOGLE_API_KEY")
-        assert self.api_key, "Google API key is required"
+    def __init__(
+        self,
+        scraper_instance: CrawlForAIScraper,
+        max_depth: int = 1,
+        num_sites_per_query: int = 5,
+        provider: Optional[LLMProvider] = None,
+        fused_planner: Optional[bool] = None,
+        crawl: Optional[bool] = None,
+    ):
         self.scraper = scraper_instance
         self.logger = logging.getLogger(__name__)
         self.prompt = Prompt()
         self.schema = Schema()
         self.progress = None
 
-        # Init Google GenAI client
-        self.genai_client = genai.Client(api_key=self.api_key)
+        # LLM provider (Gemini by default, stub for load tests)
+        self.provider = provider or get_provider()
 
         # Parameters
         self.max_depth = max_depth
         self.num_sites_per_query = num_sites_per_query
+        # One "next action" call (decision + queries) per node instead of continue_branch then search_query
+        self.fused_planner = fused_planner if fused_planner is not None else os.getenv("KNET_FUSED_PLANNER", "false").lower() in ("1", "true")
+        # Best-first exploration: each expansion proposes `branching` candidate queries, the frontier expands the
+        # `frontier_nodes` best of a vertical (KNET_FRONTIER_NODES, 0: max_depth, as many scrapes as one chain)
+        self.branching = int(os.getenv("KNET_FRONTIER_BRANCHING", 3))
+        self.frontier_nodes = int(os.getenv("KNET_FRONTIER_NODES", 0))
+        # Follow outbound links of scraped pages instead of searching again for follow-up queries
+        self.crawl_mode = crawl if crawl is not None else crawl_mode()
 
         # Global State
+        self.job_id: Optional[str] = None  # Key of the current (or last) run's artifacts
         self.master_node = ResearchNode()
         self.research_plan: list[str] = []
         self.idx_research_plan: int = 0
         self.ctx_researcher: list[str] = []
         self.ctx_manager: list[str] = []
         self.token_count: int = 0
-
-    async def conduct_research(self, topic: str, progress_callback, max_depth: int, num_sites_per_query: int) -> dict | bool:
+        self.accounting = RunAccounting()
+        self.budget: Optional[RunBudget] = None  # Deadline and/or token budget of the current run
+        self.frontier_stats: Dict[str, Any] = {}  # Scrapes, unique sources and SERP overlap of the current run
+        self.queries = QueryRegistry()  # Every query of the current run, near-duplicates are skipped
+        self.summarized: Set[str] = set()  # Nodes already in the manager's context
+        self.links = LinkIndex()  # Outbound links of the current run's pages, for crawl mode
+
+    async def conduct_research(
+        self,
+        topic: str,
+        progress_callback,
+        max_depth: int,
+        num_sites_per_query: int,
+        fused_planner: Optional[bool] = None,
+        job_id: Optional[str] = None,
+        budget: Optional[RunBudget] = None,
+    ) -> dict:
         # Local Runtime State
-        self.progress = ResearchProgress(progress_callback, self.master_node)
+        self.job_id = job_id or uuid.uuid4().hex
+        self.budget = budget
         self.max_depth = max_depth
         self.num_sites_per_query = num_sites_per_query
+        if fused_planner is not None:
+            self.fused_planner = fused_planner
 
         # Reset global state
+        self.master_node.store.close()
+        self.master_node = ResearchNode()  # Fresh tree and content store per run
+        self.progress = ResearchProgress(progress_callback, self.master_node)
         self.research_plan = []
         self.idx_research_plan = 0
         self.ctx_researcher = []
         self.ctx_manager = []
         self.token_count = 0
+        self.accounting = RunAccounting()
+        self.queries = QueryRegistry()
+        self.summarized = set()
+        self.links = LinkIndex()
 
         try:
             # Generate research plan
             await self.progress.update(0, "Generating research plan...")
             self._check_cancelled()
 
-            self.research_plan = self.generate_content(self.prompt.research_plan.format(topic=topic), schema=self.schema.research_plan, temp=1.5)[
-                "steps"
-            ]
-            self.logger.info(f"Research plan:\n{json.dumps(self.research_plan, indent=2)}")
+            self.research_plan = (
+                await self.generate_content(
+                    self.prompt.research_plan.format(topic=topic), schema=self.schema.research_plan, temp=1.5, priority=PRIORITY_PLAN, stage="plan"
+                )
+            )["steps"]
+            self.logger.info(f"Research plan:\n{dumps(self.research_plan, indent=True)}")
+            if self.budget:
+                self.budget.verticals = len(self.research_plan)
 
             await self.progress.update(0, "Starting research...")
 
             # Iterate on research plan
+            coverage = Coverage()  # Run wide, a vertical's frontier also knows what the others found
             for self.idx_research_plan, _ in enumerate(self.research_plan):
                 self._check_cancelled()
+                if self.budget and self.budget.explore_done(self.token_count):
+                    self.budget.skipped["verticals"] += len(self.research_plan) - self.idx_research_plan
+                    self.logger.info(f"Budget for exploration used up ({self.budget.stopped}), skipping to the report")
+                    break
 
                 # Generate initial search query
-                query = self.generate_content(
-                    self.prompt.search_query.format(
-                        vertical=self.research_plan[self.idx_research_plan], topic=topic, research_plan="None", past_queries="None", ctx_manager="None", n=1
-                    ),
-                    schema=self.schema.search_query,
-                    temp=1.5,
+                query = (
+                    await self.generate_content(
+                        self.prompt.search_query.format(
+                            vertical=self.research_plan[self.idx_research_plan], topic=topic, research_plan="None", past_queries="None", ctx_manager="None", n=1
+                        ),
+                        schema=self.schema.search_query,
+                        temp=1.5,
+                        priority=PRIORITY_PLAN,
+                        stage="query",
+                    )
                 )["branches"][0]
 
-                root_node = ResearchNode(query)
-                self.master_node.add_child(root_node.query, node=root_node)
-                to_explore = deque([(root_node, 1)])  # (node, depth) pairs
-                explored_queries = set()  # {string, string, ...}
+                # A vertical starting where an earlier one already searched continues from that node and its data
+                root_node = self.queries.match(query)
+                merged = root_node is not None
+                if merged:
+                    self.queries.skip(query, root_node)
+                    self.logger.info(f"Vertical query '{query}' duplicates '{root_node.query}', continuing from it")
+                else:
+                    root_node = ResearchNode(query)
+                    self.master_node.add_child(root_node.query, node=root_node)
+                    self.queries.add(root_node)
+                to_explore = Frontier(coverage, max_nodes=self.frontier_nodes or self.max_depth)  # Best expected gain first
+                to_explore.push(root_node, root_node.depth)  # A merged root keeps its depth in the tree
 
                 await self.progress.update(100 / (len(self.research_plan) + 1), f"{self.research_plan[self.idx_research_plan]}")
 
                 while to_explore:
                     self._check_cancelled()
 
-                    current_node, current_depth = to_explore.popleft()
+                    current_node, current_depth, gain = to_explore.pop()
+                    # Every vertical gets its first query, the rest only while the vertical's share of the budget lasts
+                    if self.budget and current_node is not root_node and self.budget.vertical_done(self.token_count, self.idx_research_plan):
+                        self.budget.skipped["queries"] += len(to_explore) + 1
+                        break
                     if current_depth > self.max_depth:
                         continue
 
-                    self.logger.info(f"Exploring: {current_node.query} (depth: {current_depth})")
+                    self.logger.info(f"Exploring: {current_node.query} (depth: {current_depth}, gain: {gain:.2f})")
                     await self.progress.update(0, f"s_{current_node.query}")
 
-                    # Search and scrape
-                    current_node.data = await self.scraper.search_and_scrape(
-                        current_node.query, self.num_sites_per_query
-                    )  # node -> data = [{url:...}, {url:...}, ...]
-                    self.ctx_researcher.append(json.dumps(current_node.data, indent=2))
-                    explored_queries.add(current_node.query)
-
-                    # Only branch if we have data and haven't reached max depth
-                    if self._should_continue_branch(current_node, topic):
+                    # Search and scrape, unless the node was merged from an earlier vertical and already has its data
+                    if merged and current_node is root_node:
+                        overlap = 1.0
+                    else:
+                        current_node.data = await self._search_and_scrape(current_node)  # node -> data = [{url:...}, {url:...}, ...]
+                        self.ctx_researcher.append(current_node.id)  # Page bodies stay in the content store, referenced by node
+                        if self.crawl_mode:
+                            self.links.add(current_node)
+                        overlap = coverage.observe(current_node)
+
+                    # Only branch if we have data and haven't reached max depth (or the vertical's budget)
+                    can_branch = current_depth < self.max_depth
+                    out_of_budget = self.budget and can_branch and not self.budget.can_branch(self.token_count, self.idx_research_plan)
+                    if self.fused_planner:
+                        new_branches = await self._next_action(current_node, topic, can_branch=can_branch and not out_of_budget)
+                        for branch in new_branches:
+                            to_explore.push(branch, current_depth + 1, overlap)
+                    elif out_of_budget:
+                        await self._summarize_node(current_node)  # The scraped pages still make it into the report
+                    elif await self._should_continue_branch(current_node, topic):
                         if current_node.data and current_depth < self.max_depth:
-                            new_branches = self._gen_queries(current_node, topic)
+                            new_branches = await self._gen_queries(current_node, topic)
                             for branch in new_branches:
-                                to_explore.appendleft((branch, current_depth + 1))
+                                to_explore.push(branch, current_depth + 1, overlap)
+                to_explore.close()
 
             self._check_cancelled()
+            self.frontier_stats = coverage.stats()
 
             # Generate final report
+            if self.budget:
+                self.budget.start_phase("report", self.token_count)
             await self.progress.update(100 / (len(self.research_plan) + 1), "Generating final report...")
             final_report = await self._generate_final_report(topic)
 
-            self.logger.info(f"Research completed. Explored {len(explored_queries)} queries across {self.master_node.max_depth()} levels")
+            self.logger.info(f"Research completed. Explored {coverage.scrapes} queries across {self.master_node.max_depth()} levels")
             await self.progress.update(100, "Research complete!")
 
-            with open("output.log.json", "w", encoding="utf-8") as f:
-                json.dump(final_report, f, indent=2)
+            # Optional JSON trace of every LLM call and scrape
+            if os.getenv("KNET_TRACE_DIR"):
+                trace_path = os.path.join(os.getenv("KNET_TRACE_DIR"), f"trace-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+                await asyncio.to_thread(self.accounting.export_json, trace_path)
+
+            artifacts = get_artifact_store()
+            await artifacts.put(self.job_id, "report", final_report)
+            await artifacts.put(self.job_id, "tree", final_report["research_tree"])
             return final_report
 
         except asyncio.CancelledError:
+            # Propagates, so callers (and the worker's job status) see a cancelled run rather than a result
             self.logger.info(f"Research task for topic '{topic}' was cancelled")
-            return {"status": False}
+            raise
         except Exception:
             self.logger.error("Research failed", exc_info=True)
             raise
+        finally:
+            self.scraper.prefetcher.clear()  # Candidates of this run, already cached pages may still serve the next one
 
-    async def _generate_final_report(self, topic: str, retry_count: int = 1) -> Dict[str, Any]:
+    async def _generate_final_report(self, topic: str) -> Dict[str, Any]:
         try:
             self._check_cancelled()
 
             await self.progress.setter(0, "Generating report...")
             findings = "\n\n------\n\n".join(self.ctx_manager)
-            with open("ctx_manager.log.txt", "w", encoding="utf-8") as f:
-                f.write(findings)
+            await get_artifact_store().put(self.job_id, "findings", findings)
 
             # Generate report outline
             self._check_cancelled()
-            outline = self.generate_content(self.prompt.report_outline.format(topic=topic, ctx_manager=findings), schema=self.schema.report_outline)
-            self.logger.info(f"Report outline:\n{json.dumps(outline, indent=2)}")
+            started = time.monotonic()
+            outline = await self.generate_content(
+                self.prompt.report_outline.format(topic=topic, ctx_manager=findings),
+                schema=self.schema.report_outline,
+                priority=PRIORITY_REPORT,
+                stage="outline",
+            )
+            self.logger.info(f"Report outline:\n{dumps(outline, indent=True)}")
+            if self.budget:
+                # A section costs about what the outline did (same findings in the prompt), plus its longer output
+                sections = self.budget.report_sections(
+                    len(outline["headings"]), self.token_count, estimate_tokens(findings) + 1000, time.monotonic() - started
+                )
+                outline["headings"] = outline["headings"][:sections]
             report = []
             raster_report = f"# {outline['title']}\n\n"
+            await self.progress.report_delta(-1, outline["title"], "")  # index -1: title, (re)starts the streamed report
 
             # Fill in report outline
             for i, heading in enumerate(outline["headings"]):
                 self._check_cancelled()
+                if self.budget and i and self.budget.exhausted(self.token_count):
+                    self.budget.skipped["sections"] += len(outline["headings"]) - i
+                    break
 
                 await self.progress.update(100 / (len(outline["headings"]) + 1), "Generating report...")
-                content = self.generate_content(
-                    self.prompt.report_fillin.format(
-                        topic=topic,
-                        ctx_manager=findings,
-                        report_progress=raster_report,
-                        report_outline=["[done] " + outline["title"]] + [f"[done] {h}" for _, h in enumerate(outline["headings"]) if i < _],
-                        slot=heading,
-                    ),
-                    schema=self.schema.report_fillin,
-                )["content"]
-                # Remove heading if LLM put it there regardless
-                idx_heading = content.find(heading)
-                if idx_heading != -1:
-                    content = content[idx_heading + len(heading) :].strip()
+                prompt = self.prompt.report_fillin.format(
+                    topic=topic,
+                    ctx_manager=findings,
+                    report_progress=raster_report,
+                    report_outline=["[done] " + outline["title"]] + [f"[done] {h}" for _, h in enumerate(outline["headings"]) if i < _],
+                    slot=heading,
+                )
+                # Stream the section to the client as it is generated
+                content = ""
+                async with aclosing(self._strip_heading(self.stream_content(prompt, priority=PRIORITY_REPORT, stage="report"), heading)) as deltas:
+                    async for delta in deltas:
+                        content += delta
+                        await self.progress.report_delta(i, heading, delta)
+                content = content.strip()
                 report.append({"heading": heading, "content": content})
                 raster_report += f"\n\n## {heading}\n\n{content}"
 
-            # Collate multimedia content
-            media_content = {"images": [], "videos": [], "links": []}
-            all_sources_data = self.master_node.get_all_data()
-            for data in all_sources_data:
-                if data.get("images"):
-                    media_content["images"].extend(data["images"])
-                if data.get("videos"):
-                    media_content["videos"].extend(data["videos"])
-                if data.get("links"):
-                    media_content["links"].extend([{"url": link["href"], "text": link["text"]} for link in data["links"]])
-            # Dedupe
-            media_content["images"] = list(set(media_content["images"]))
-            media_content["videos"] = list(set(media_content["videos"]))
-            media_content["links"] = list({json.dumps(d, sort_keys=True) for d in media_content["links"]})
-            media_content["links"] = [json.loads(d) for d in media_content["links"]]
+            # Collate multimedia content in a single read-only pass, deduped (in order) as it goes
+            images, videos, links = {}, {}, {}
+            total_sources = 0
+            for data in self.master_node.iter_data(fields=("images", "videos", "links")):
+                total_sources += 1
+                images.update(dict.fromkeys(data["images"] or []))
+                videos.update(dict.fromkeys(data["videos"] or []))
+                for link in data["links"] or []:
+                    links.setdefault((link["href"], link["text"]), None)
+            media_content = {"images": list(images), "videos": list(videos), "links": [{"url": url, "text": text} for url, text in links]}
 
             return {
+                "job_id": self.job_id,
                 "topic": topic,
                 "timestamp": datetime.now().isoformat(),
                 "content": raster_report,
@@ -359,24 +539,26 @@ class KNet:
                 "research_tree": self.master_node.build_tree_structure(),
                 "metadata": {
                     "total_queries": self.master_node.total_children(),
-                    "total_sources": len(all_sources_data),
+                    "total_sources": total_sources,
                     "max_depth_reached": self.master_node.max_depth(),
                     "total_tokens": self.token_count,
+                    "accounting": self.accounting.summary(),
+                    "planner": "fused" if self.fused_planner else "split",
+                    "budget": self.budget.summary(self.token_count) if self.budget else None,
+                    "frontier": self.frontier_stats,
+                    "dedup": self.queries.stats(),
+                    "crawl": self.links.stats() if self.crawl_mode else None,
+                    "prefetch": self.scraper.prefetcher.stats(),  # Since the browser started, it may have served earlier runs
                 },
             }
 
         except asyncio.CancelledError:
             raise
-        except Exception as e:
-            if e in ["GEMINI_RECITATION", "NO_RESPONSE"]:
-                self.logger.error("GEMINI_RECITATION or NO_RESPONSE")
-            if retry_count < 3:
-                self.logger.error(f"Retrying final report:C:{retry_count} / 3", exc_info=True)
-                return await self._generate_final_report(topic, retry_count + 1)
+        except Exception:
             self.logger.error("Error generating final report", exc_info=True)
             raise
 
-    def _gen_queries(self, node: ResearchNode, topic: str, retry_count: int = 1) -> List[ResearchNode]:
+    async def _gen_queries(self, node: ResearchNode, topic: str) -> List[ResearchNode]:
         try:
             if not node.data or node.depth > self.max_depth:
                 return []
@@ -387,44 +569,30 @@ class KNet:
                 research_plan="\n".join([f"[done] {step}" for i, step in enumerate(self.research_plan) if i < self.idx_research_plan]),
                 past_queries="\n".join([f"[done] {query}" for query in node.get_path_to_root()[1:]]),
                 ctx_manager="\n\n---\n\n".join(self.ctx_manager),
-                n=1,
+                n=self.branching,
             )
-            response = self.generate_content(prompt, schema=self.schema.search_query, temp=1.5)
-            self.logger.info(f"Spawn branches '{node.query}':\n{json.dumps(response['branches'], indent=2)}")
+            response = await self.generate_content(prompt, schema=self.schema.search_query, temp=1.5, priority=PRIORITY_BRANCH, stage="query", node=node)
+            self.logger.info(f"Spawn branches '{node.query}':\n{dumps(response['branches'], indent=True)}")
 
             # Add children to current node
             #       |-> child
             # node -|-> child
             #       |-> child
-            new_nodes = []
-            for branch in response.get("branches", [])[:1]:
-                child_node = node.add_child(branch)
-                new_nodes.append(child_node)
+            new_nodes = self._add_branches(node, response.get("branches", [])[: self.branching])
 
             self.logger.info(f"Spawned {len(new_nodes)} new branch(es)")
             return new_nodes
 
-        except Exception as e:
-            if e in ["GEMINI_RECITATION", "NO_RESPONSE"]:
-                self.logger.error("GEMINI_RECITATION or NO_RESPONSE")
-            if retry_count < 3:
-                self.logger.error(f"Retrying _gen_queries | C:{retry_count} / 3", exc_info=True)
-                return self._gen_queries(node, topic, retry_count + 1)
+        except Exception:
             self.logger.error("_gen_queries failed", exc_info=True)
             raise
 
-    def _should_continue_branch(self, node: ResearchNode, topic: str, retry_count: int = 1) -> bool:
+    async def _should_continue_branch(self, node: ResearchNode, topic: str) -> bool:
         try:
             if node.depth > self.max_depth:
                 return False
 
-            # Generate summary of key findings into the manager's context
-            if node.data:
-                for idx in range(0, len(node.data), 3):
-                    data = node.data[idx : idx + 3]
-                    findings = ("\n" + "-" * 10 + "Next data" + "-" * 10 + "\n").join([json.dumps(d, indent=2) for d in data])
-                    response = self.generate_content(self.prompt.site_summary.format(query=node.query, findings=findings), temp=0.2)
-                    self.ctx_manager.append(response) if isinstance(response, str) else None
+            await self._summarize_node(node)
 
             # Research manager takes decision to proceed or not
             prompt = self.prompt.continue_branch.format(
@@ -433,51 +601,197 @@ class KNet:
                 past_queries="\n".join([f"[done] {query}" for query in node.get_path_to_root()[1:]]),
                 ctx_manager="\n\n---\n\n".join(self.ctx_manager),
             )
-            response = self.generate_content(prompt, schema=self.schema.continue_branch)
+            response = await self.generate_content(prompt, schema=self.schema.continue_branch, priority=PRIORITY_BRANCH, stage="decision", node=node)
             self.logger.info(f"Branch decision '{node.query}': {response['decision']}")
 
             return response["decision"]
 
-        except Exception as e:
-            if e in ["GEMINI_RECITATION", "NO_RESPONSE"]:
-                self.logger.error("GEMINI_RECITATION or NO_RESPONSE")
-            if retry_count < 3:
-                self.logger.error(f"Retrying branch decision:C:{retry_count} / 3", exc_info=True)
-                return self._should_continue_branch(node, topic, retry_count + 1)
+        except Exception:
             self.logger.error("Branch decision failed:", exc_info=True)
             raise
 
-    def generate_content(self, prompt: str, schema: Dict[str, Any] = {}, temp: float = 1) -> Dict[str, Any] | str:
-        safe = [
-            types.SafetySetting(category=types.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT, threshold=types.HarmBlockThreshold.BLOCK_NONE),
-            types.SafetySetting(category=types.HarmCategory.HARM_CATEGORY_HARASSMENT, threshold=types.HarmBlockThreshold.BLOCK_NONE),
-            types.SafetySetting(category=types.HarmCategory.HARM_CATEGORY_HATE_SPEECH, threshold=types.HarmBlockThreshold.BLOCK_NONE),
-            types.SafetySetting(category=types.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT, threshold=types.HarmBlockThreshold.BLOCK_NONE),
-            types.SafetySetting(category=types.HarmCategory.HARM_CATEGORY_CIVIC_INTEGRITY, threshold=types.HarmBlockThreshold.BLOCK_NONE),
-        ]
-        if schema:
-            generate_content_config = types.GenerateContentConfig(
-                temperature=temp, response_mime_type="application/json", safety_settings=safe, response_schema=schema
-            )
-        else:
-            generate_content_config = types.GenerateContentConfig(temperature=temp, response_mime_type="text/plain", safety_settings=safe)
-
+    async def _next_action(self, node: ResearchNode, topic: str, can_branch: bool) -> List[ResearchNode]:
+        """Fused planner: branch decision and follow-up queries in a single structured call"""
         try:
-            response = self.genai_client.models.generate_content(model="gemini-2.0-flash", contents=prompt, config=generate_content_config)
-            if not response:
-                raise Exception("NO_RESPONSE")
+            await self._summarize_node(node)
+            if not node.data or not can_branch or node.depth > self.max_depth:
+                return []
+
+            prompt = self.prompt.next_action.format(
+                vertical=self.research_plan[self.idx_research_plan],
+                topic=topic,
+                research_plan="\n".join([f"[done] {step}" for i, step in enumerate(self.research_plan) if i < self.idx_research_plan]),
+                query=node.query,
+                past_queries="\n".join([f"[done] {query}" for query in node.get_path_to_root()[1:]]),
+                ctx_manager="\n\n---\n\n".join(self.ctx_manager),
+                n=self.branching,
+            )
+            response = await self.generate_content(
+                prompt, schema=self.schema.next_action, temp=1.5, priority=PRIORITY_BRANCH, stage="next_action", node=node
+            )
+            self.logger.info(f"Next action '{node.query}': {response['decision']} {dumps(response.get('branches', []))}")
+            if not response["decision"]:
+                return []
 
-            self.token_count += response.usage_metadata.total_token_count
-            return json.loads(response.text) if schema else response.text
+            new_nodes = self._add_branches(node, response.get("branches", [])[: self.branching])
+            self.logger.info(f"Spawned {len(new_nodes)} new branch(es)")
+            return new_nodes
 
         except Exception:
-            if response.candidates[0].finish_reason == types.FinishReason.RECITATION:
-                raise Exception("GEMINI_RECITATION")
+            self.logger.error("Next action failed:", exc_info=True)
             raise
 
+    def _add_branches(self, node: ResearchNode, branches: List[str]) -> List[ResearchNode]:
+        """Children of `node` for the queries that aren't near-duplicates of one already in the run"""
+        new_nodes = []
+        for branch in branches:
+            duplicate = self.queries.match(branch)
+            if duplicate is not None:
+                self.queries.skip(branch, duplicate)
+                self.logger.info(f"Skipping '{branch}', near-duplicate of '{duplicate.query}'")
+                continue
+            child_node = node.add_child(branch)
+            self.queries.add(child_node)
+            new_nodes.append(child_node)
+        return new_nodes
+
+    async def _summarize_node(self, node: ResearchNode):
+        # Generate summary of key findings into the manager's context, once per node
+        if node.id in self.summarized:
+            return
+        self.summarized.add(node.id)
+        if node.data:
+            pages = list(node.pages(fields=("url", "text", "images", "videos", "links")))
+            for idx in range(0, len(pages), 3):
+                data = pages[idx : idx + 3]
+                findings = ("\n" + "-" * 10 + "Next data" + "-" * 10 + "\n").join([dumps(d, indent=True) for d in data])
+                response = await self.generate_content(
+                    self.prompt.site_summary.format(query=node.query, findings=findings), temp=0.2, priority=PRIORITY_SUMMARY, stage="summary", node=node
+                )
+                self.ctx_manager.append(response) if isinstance(response, str) else None
+
+    async def generate_content(
+        self,
+        prompt: str,
+        schema: Optional[genai.types.Schema] = None,
+        temp: float = 1,
+        priority: int = PRIORITY_SUMMARY,
+        stage: str = "llm",
+        node: Optional[ResearchNode] = None,
+    ) -> Dict[str, Any] | str:
+        # Rate limited, prioritized and retried on 429/5xx by the shared gateway. The only retry on top of it:
+        # a structured answer that doesn't parse or misses required fields is asked for once more.
+        for attempt in range(2):
+            trace = {"retries": 0, "queued": 0.0}
+            started = time.monotonic()
+            try:
+                response = await get_gateway().submit(
+                    lambda: self.provider.generate(prompt, schema=schema, temp=temp),
+                    priority=priority,
+                    est_tokens=estimate_tokens(prompt),
+                    count_tokens=lambda r: r.total_tokens,
+                    trace=trace,
+                )
+            except Exception as e:
+                if schema is None or attempt or not (isinstance(e, ValueError) or str(e) == "NO_RESPONSE"):
+                    raise
+                self.logger.warning(f"Malformed {stage} answer ({e}), asking once more")
+                continue
+            self.token_count += response.total_tokens
+            self.accounting.record_llm(
+                stage,
+                response.input_tokens,
+                response.output_tokens,
+                latency=time.monotonic() - started - trace["queued"],
+                retries=trace["retries"] + attempt,
+                queued=trace["queued"],
+                vertical=self._vertical(),
+                node_id=node.id if node else None,
+            )
+            content = response.content
+            if schema is not None and not attempt and (not isinstance(content, dict) or any(key not in content for key in schema.required or [])):
+                self.logger.warning(f"{stage} answer misses required fields, asking once more")
+                continue
+            return content
+
+    async def _search_and_scrape(self, node: ResearchNode) -> List[Dict[str, Any]]:
+        sites = self.num_sites_per_query
+        if self.budget:
+            sites = self.budget.sites(sites, self.token_count, self.idx_research_plan)
+        started = time.monotonic()
+        data, stage = [], "scrape"
+        # Crawl mode: a follow-up query first tries the links of the pages scraped so far
+        if self.crawl_mode and node.depth > 1:
+            data, stage = await self.links.follow(self.scraper, node.query, sites), "crawl"
+        if not data:
+            data, stage = await self.scraper.search_and_scrape(node.query, sites), "scrape"
+        self.accounting.record_scrape(
+            latency=time.monotonic() - started,
+            pages=len(data),
+            text_bytes=sum(len(d.get("text") or "") for d in data),
+            retries=self.scraper.last_stats.get("retries", 0),
+            stage=stage,
+            vertical=self._vertical(),
+            node_id=node.id,
+        )
+        return data
+
+    def _vertical(self) -> Optional[str]:
+        return self.research_plan[self.idx_research_plan] if self.idx_research_plan < len(self.research_plan) else None
+
+    async def _strip_heading(self, chunks: AsyncIterator[str], heading: str) -> AsyncIterator[str]:
+        """Remove heading if LLM put it there regardless, only the start of the stream is held back"""
+        head, buffering = "", True
+        async with aclosing(chunks):  # Closing this closes the LLM stream too
+            async for chunk in chunks:
+                if not buffering:
+                    yield chunk
+                    continue
+                head += chunk
+                if len(head) > len(heading) + 16:
+                    buffering = False
+                    yield self._after_heading(head, heading)
+        if buffering and head:
+            yield self._after_heading(head, heading)
+
+    def _after_heading(self, text: str, heading: str) -> str:
+        idx_heading = text.find(heading)
+        return text[idx_heading + len(heading) :].lstrip("# \n") if idx_heading != -1 else text.lstrip()
+
+    async def stream_content(self, prompt: str, temp: float = 1, priority: int = PRIORITY_REPORT, stage: str = "llm") -> AsyncIterator[str]:
+        """Plain text generation yielded chunk by chunk"""
+        trace = {"retries": 0, "queued": 0.0}
+        started = time.monotonic()
+        input_tokens, output_tokens = 0, 0
+        chunks = get_gateway().stream(
+            lambda: self.provider.stream(prompt, temp=temp), priority=priority, est_tokens=estimate_tokens(prompt), trace=trace
+        )
+        try:
+            async with aclosing(chunks):
+                async for chunk in chunks:
+                    self.token_count += chunk.total_tokens
+                    input_tokens += chunk.input_tokens
+                    output_tokens += chunk.output_tokens
+                    if chunk.content:
+                        yield chunk.content
+        finally:
+            self.accounting.record_llm(
+                stage,
+                input_tokens,
+                output_tokens,
+                latency=time.monotonic() - started - trace["queued"],
+                retries=trace["retries"],
+                queued=trace["queued"],
+                vertical=self._vertical(),
+            )
+
     def _check_cancelled(self):
-        """Check if the current task has been cancelled and raise CancelledError if so"""
-        if asyncio.current_task() and asyncio.current_task().cancelled():
+        """
+        Raise CancelledError if the current task was asked to cancel.
+        Cancellation normally interrupts whatever the run awaits, this catches a request some library swallowed.
+        """
+        task = asyncio.current_task()
+        if task is not None and task.cancelling():
             raise asyncio.CancelledError("Research task was cancelled")
 
     async def test(self, topic: str, progress_callback):
@@ -487,18 +801,18 @@ class KNet:
                 self._check_cancelled()
 
                 await self.progress.setter(i * 10, f"Researching {topic} {i * 10}%")
-                time.sleep(1)
+                await asyncio.sleep(1)
                 for j in range(5):
                     self._check_cancelled()
 
                     await self.progress.setter(i * 10, f"s_ example google search {str(j)}")
-                    time.sleep(1)
+                    await asyncio.sleep(1)
 
             for i in range(10):
                 self._check_cancelled()
 
                 await self.progress.setter(i * 10, "Generating report...")
-                time.sleep(1)
+                await asyncio.sleep(1)
 
         except asyncio.CancelledError:
             self.logger.info(f"Test task for '{topic}' was cancelled")
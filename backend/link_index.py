@@ -0,0 +1,107 @@
+import heapq
+import os
+import re
+from typing import Any, Dict, List, Optional, Set
+
+from query_registry import query_terms as terms
+from research_node import ResearchNode
+
+_MARKDOWN = re.compile(r"[\[\]()*_#>`|]+|https?://\S+")
+
+
+def crawl_mode() -> bool:
+    """Follow-up queries crawl outbound links of scraped pages before falling back to a web search (KNET_CRAWL_MODE)"""
+    return os.getenv("KNET_CRAWL_MODE", "false").lower() in ("1", "true")
+
+
+def _canonical(url: str) -> str:
+    return url.split("#", 1)[0].rstrip("/")
+
+
+def _context(text: str, href: str, window: int) -> str:
+    """Text around the first mention of `href` in a page's markdown, without the markup"""
+    at = text.find(href)
+    if at < 0:
+        return ""
+    return _MARKDOWN.sub(" ", text[max(0, at - window) : at + len(href) + window])
+
+
+class LinkIndex:
+    """
+    Outbound links of every page scraped in a run, to follow instead of searching the web again.
+    A link is scored against a branch query by its anchor text and the text around it on the page.
+    Links are followed at most `max_hops` links away from a search result (KNET_CRAWL_MAX_HOPS),
+    only from `min_score` up (KNET_CRAWL_MIN_SCORE, share of the query's terms found).
+    """
+
+    def __init__(self, max_hops: Optional[int] = None, min_score: Optional[float] = None, window: int = 200):
+        self.max_hops = max_hops if max_hops is not None else int(os.getenv("KNET_CRAWL_MAX_HOPS", 2))
+        self.min_score = min_score if min_score is not None else float(os.getenv("KNET_CRAWL_MIN_SCORE", 0.5))
+        self.window = window
+        self.links: Dict[str, Dict[str, Any]] = {}  # url -> {"url", "anchor", "context", "hop"}, anchor and context as terms
+        self.seen: Set[str] = set()  # Scraped or already followed, never offered again
+        self.crawls = 0  # Queries answered from links instead of a search
+        self.fallbacks = 0  # Queries with too few relevant links, searched instead
+
+    @classmethod
+    def from_tree(cls, master_node: ResearchNode, saved: Optional[Dict[str, int]] = None) -> "LinkIndex":
+        """Index of every page already in a research tree, for a resumed run"""
+        index = cls()
+        for node in master_node.iter_nodes():
+            index.add(node)
+        index.crawls, index.fallbacks = (saved or {}).get("crawls", 0), (saved or {}).get("fallbacks", 0)
+        return index
+
+    def add(self, node: ResearchNode):
+        """Indexes the outbound links of `node`'s pages"""
+        pages = list(node.pages(fields=("url", "text", "links", "hop")))
+        scraped = {_canonical(page["url"]) for page in pages if page["url"]}
+        self.seen.update(scraped)
+        for url in scraped:
+            self.links.pop(url, None)
+        for page in pages:
+            hop = (page["hop"] or 0) + 1
+            if hop > self.max_hops:
+                continue
+            for link in page["links"] or []:
+                url = _canonical(link["href"])
+                if url in self.seen or url in self.links:
+                    continue
+                anchor = terms(" ".join(filter(None, (link.get("text"), link.get("title")))))
+                context = terms(_context(page["text"], link["href"], self.window))
+                self.links[url] = {"url": link["href"], "anchor": anchor, "context": anchor | context, "hop": hop}
+
+    def score(self, query_terms: Set[str], link: Dict[str, Any]) -> float:
+        """Share of the query's terms in the anchor text, the context around the link counts for less"""
+        return (0.6 * len(query_terms & link["anchor"]) + 0.4 * len(query_terms & link["context"])) / len(query_terms)
+
+    def pick(self, query: str, n: int, at_least: int = 1) -> List[Dict[str, Any]]:
+        """Up to `n` best links for `query` from `min_score` up, none unless `at_least` qualify. Picked links are not offered again."""
+        query_terms = terms(query)
+        if not query_terms or n <= 0:
+            return []
+        scored = ((self.score(query_terms, link), url) for url, link in self.links.items())
+        best = heapq.nlargest(n, (item for item in scored if item[0] >= self.min_score))
+        if len(best) < at_least:
+            return []
+        self.seen.update(url for _, url in best)
+        return [self.links.pop(url) for _, url in best]
+
+    async def follow(self, scraper, query: str, sites: int) -> List[Dict[str, Any]]:
+        """
+        Pages of the best links for `query`, tagged with their hop from a search result.
+        [] when fewer than half of `sites` links are relevant (or none could be scraped), the query needs a search then.
+        """
+        links = self.pick(query, sites, at_least=max(1, sites // 2))
+        pages = await scraper.crawl([link["url"] for link in links], sites, query) if links else []
+        if not pages:
+            self.fallbacks += 1
+            return []
+        hops = {_canonical(link["url"]): link["hop"] for link in links}
+        for page in pages:  # Redirected pages don't match their link, they count as the furthest one
+            page["hop"] = hops.get(_canonical(page["url"]), max(hops.values()))
+        self.crawls += 1
+        return pages
+
+    def stats(self) -> Dict[str, int]:
+        return {"links": len(self.links), "crawls": self.crawls, "fallbacks": self.fallbacks}
@@ -0,0 +1,302 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import random
+import re
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+# Call priorities, lower is served first
+PRIORITY_REPORT = 0
+PRIORITY_PLAN = 1
+PRIORITY_SUMMARY = 2
+PRIORITY_BRANCH = 3
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    def __init__(self, rate_per_min: float, capacity: Optional[float] = None):
+        self.rate = rate_per_min / 60.0  # refill per second
+        self.capacity = capacity or rate_per_min
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` can be consumed (0 if available now)"""
+        self._refill()
+        amount = min(amount, self.capacity)  # Oversized calls only wait for a full bucket
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, delta: float):
+        """Correct an earlier estimate once the real usage is known, may leave the bucket in debt"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - delta)
+
+
+# Provider status names, and "code: 429" / "status=503" in messages of errors that only carry text
+STATUS_NAMES = {"RESOURCE_EXHAUSTED": 429, "UNAVAILABLE": 503, "INTERNAL": 500}
+_STATUS_NAME = re.compile(r"\b(" + "|".join(STATUS_NAMES) + r")\b")
+_STATUS_FIELD = re.compile(r"\b(?:code|status)\b[\"']?\s*[:=]?\s*(\d{3})\b", re.IGNORECASE)
+
+
+def status_code(exc: BaseException) -> Optional[int]:
+    """
+    Best effort HTTP status of a provider error (google-genai, google-api-core, langchain wrappers).
+    Structured fields first, the message only counts a status name or a number labelled as code / status,
+    so a token count or a request id with "429" in it isn't taken for one.
+    """
+    while exc is not None:
+        for attr in ("code", "status_code"):
+            value = getattr(exc, attr, None)
+            if isinstance(value, int):
+                return int(value)
+        status = getattr(exc, "status", None)
+        if isinstance(status, str) and status in STATUS_NAMES:
+            return STATUS_NAMES[status]
+        text = str(exc)
+        match = _STATUS_NAME.search(text)
+        if match:
+            return STATUS_NAMES[match.group(1)]
+        match = _STATUS_FIELD.search(text)
+        if match:
+            return int(match.group(1))
+        exc = exc.__cause__
+    return None
+
+
+class LLMGateway:
+    """
+    Process wide gate in front of the LLM provider.
+    - Token buckets on requests/min and tokens/min
+    - AIMD concurrency limit: +1 per window on success, halved on 429/5xx
+    - Exponential backoff with full jitter on retryable errors
+    - Waiting calls are served by priority, then FIFO
+    """
+
+    def __init__(
+        self,
+        requests_per_min: float = 60,
+        tokens_per_min: float = 1_000_000,
+        max_concurrency: int = 8,
+        min_concurrency: int = 1,
+        max_retries: int = 5,
+        backoff_base: float = 1.0,
+        backoff_cap: float = 60.0,
+        decrease_cooldown: float = 5.0,
+    ):
+        self.logger = logging.getLogger(__name__)
+        self.request_bucket = TokenBucket(requests_per_min)
+        self.token_bucket = TokenBucket(tokens_per_min)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency_limit = float(max_concurrency)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.decrease_cooldown = decrease_cooldown
+
+        self.in_flight = 0
+        self._waiters: List[Tuple[int, int, float, asyncio.Future]] = []  # heap of (priority, seq, tokens, future)
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+        self._last_decrease = 0.0
+
+    async def submit(
+        self,
+        call: Callable[[], Awaitable[T]],
+        priority: int = PRIORITY_SUMMARY,
+        est_tokens: int = 0,
+        count_tokens: Optional[Callable[[T], int]] = None,
+        trace: Optional[Dict[str, Any]] = None,
+    ) -> T:
+        """
+        Run `call` once a slot is free, retrying transient provider errors.
+        `call` must create a fresh awaitable on every invocation.
+        `trace`, when given, receives the retry count and the time spent queued.
+        """
+        attempt = 0
+        while True:
+            await self._acquire(priority, est_tokens, trace)
+            try:
+                result = await call()
+            except Exception as e:
+                status = status_code(e)
+                if status not in RETRYABLE_STATUS:
+                    raise
+                self._on_overload()
+                if attempt >= self.max_retries:
+                    self.logger.error(f"LLM call failed after {attempt + 1} attempts (status {status})")
+                    raise
+                delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2**attempt))
+                attempt += 1
+                self.logger.warning(f"LLM call got {status}, retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                if trace is not None:
+                    trace["retries"] = attempt
+            else:
+                delay = None
+            finally:
+                self._release()  # Never hold a slot while backing off
+
+            if delay is not None:
+                await asyncio.sleep(delay)
+                continue
+
+            self._on_success()
+            if count_tokens:
+                try:
+                    self.token_bucket.adjust(count_tokens(result) - est_tokens)
+                except Exception:
+                    pass
+            return result
+
+    async def stream(
+        self,
+        call: Callable[[], AsyncIterator[T]],
+        priority: int = PRIORITY_SUMMARY,
+        est_tokens: int = 0,
+        trace: Optional[Dict[str, Any]] = None,
+    ) -> AsyncIterator[T]:
+        """
+        Streaming variant of `submit`, the slot is held until the stream is exhausted or closed.
+        Callers that may stop early should close it (contextlib.aclosing), which also closes the provider's stream.
+        Only failures before the first chunk are retried, chunks already yielded are never replayed.
+        """
+        attempt = 0
+        while True:
+            await self._acquire(priority, est_tokens, trace)
+            started = False
+            chunks = call()
+            try:
+                async for chunk in chunks:
+                    started = True
+                    yield chunk
+            except Exception as e:
+                status = status_code(e)
+                if started or status not in RETRYABLE_STATUS:
+                    raise
+                self._on_overload()
+                if attempt >= self.max_retries:
+                    self.logger.error(f"LLM stream failed after {attempt + 1} attempts (status {status})")
+                    raise
+                delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2**attempt))
+                attempt += 1
+                self.logger.warning(f"LLM stream got {status}, retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                if trace is not None:
+                    trace["retries"] = attempt
+            else:
+                delay = None
+            finally:
+                # Closed right away when the caller stops early (cancelled run), not whenever it is garbage collected
+                if hasattr(chunks, "aclose"):
+                    await chunks.aclose()
+                self._release()
+
+            if delay is not None:
+                await asyncio.sleep(delay)
+                continue
+
+            self._on_success()
+            return
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queued": sum(1 for *_, future in self._waiters if not future.done()),
+            "concurrency_limit": round(self.concurrency_limit, 2),
+        }
+
+    async def _acquire(self, priority: int, tokens: float, trace: Optional[Dict[str, Any]] = None):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), tokens, future))
+        queued_at = time.monotonic()
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Slot was granted right before the caller got cancelled
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+        if trace is not None:
+            trace["queued"] = trace.get("queued", 0.0) + time.monotonic() - queued_at
+
+    def _release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._waiters:
+            _, _, tokens, future = self._waiters[0]
+            if future.done():  # Cancelled while queued
+                heapq.heappop(self._waiters)
+                continue
+            if self.in_flight >= int(self.concurrency_limit):
+                return
+            wait = max(self.request_bucket.wait_time(1), self.token_bucket.wait_time(tokens))
+            if wait > 0:
+                self._schedule_dispatch(wait)
+                return
+            heapq.heappop(self._waiters)
+            self.request_bucket.consume(1)
+            self.token_bucket.consume(tokens)
+            self.in_flight += 1
+            future.set_result(None)
+
+    def _schedule_dispatch(self, delay: float):
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+        self._wakeup = asyncio.get_running_loop().call_later(delay, self._on_wakeup)
+
+    def _on_wakeup(self):
+        self._wakeup = None
+        self._dispatch()
+
+    def _on_success(self):
+        # Additive increase: about +1 per full window of successful calls
+        self.concurrency_limit = min(self.max_concurrency, self.concurrency_limit + 1 / self.concurrency_limit)
+
+    def _on_overload(self):
+        # Multiplicative decrease, once per cooldown so a burst of 429s counts as one signal
+        now = time.monotonic()
+        if now - self._last_decrease < self.decrease_cooldown:
+            return
+        self._last_decrease = now
+        self.concurrency_limit = max(self.min_concurrency, self.concurrency_limit / 2)
+        self.logger.warning(f"LLM overloaded, concurrency limit -> {int(self.concurrency_limit)}")
+
+
+_gateway: Optional[LLMGateway] = None
+
+
+def get_gateway() -> LLMGateway:
+    """Shared gateway for every session in this process, configured from the environment"""
+    global _gateway
+    if _gateway is None:
+        _gateway = LLMGateway(
+            requests_per_min=float(os.getenv("LLM_REQUESTS_PER_MIN", 60)),
+            tokens_per_min=float(os.getenv("LLM_TOKENS_PER_MIN", 1_000_000)),
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", 8)),
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", 5)),
+        )
+    return _gateway
+
+
+def estimate_tokens(text: Any) -> int:
+    # ~4 characters per token, good enough for rate limiting
+    return len(str(text)) // 4
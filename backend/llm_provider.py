@@ -0,0 +1,203 @@
+import asyncio
+import hashlib
+import inspect
+import os
+import random
+import re
+from abc import ABC, abstractmethod
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from google import genai
+from google.genai import types
+
+from llm_gateway import estimate_tokens
+from serialization import loads
+
+
+class LLMResponse:
+    def __init__(self, content: Dict[str, Any] | str, input_tokens: int = 0, output_tokens: int = 0):
+        self.content = content
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+
+    @property
+    def total_tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+
+class LLMProvider(ABC):
+    """Backend agnostic LLM interface used by KNet"""
+
+    name = "base"
+
+    @abstractmethod
+    async def generate(self, prompt: str, schema: Optional[types.Schema] = None, temp: float = 1) -> LLMResponse:
+        """Returns parsed JSON when `schema` is given, plain text otherwise"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def stream(self, prompt: str, temp: float = 1) -> AsyncIterator[LLMResponse]:
+        """Plain text generation as it is produced, token counts on each chunk are increments"""
+        raise NotImplementedError
+
+
+class GeminiProvider(LLMProvider):
+    name = "gemini"
+
+    def __init__(self, model: str = "gemini-2.0-flash", api_key: Optional[str] = None):
+        self.api_key = api_key or os.getenv("GOOGLE_API_KEY")
+        assert self.api_key, "Google API key is required"
+        self.model = model
+        self.client = genai.Client(api_key=self.api_key)
+        self.safety_settings = [
+            types.SafetySetting(category=types.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT, threshold=types.HarmBlockThreshold.BLOCK_NONE),
+            types.SafetySetting(category=types.HarmCategory.HARM_CATEGORY_HARASSMENT, threshold=types.HarmBlockThreshold.BLOCK_NONE),
+            types.SafetySetting(category=types.HarmCategory.HARM_CATEGORY_HATE_SPEECH, threshold=types.HarmBlockThreshold.BLOCK_NONE),
+            types.SafetySetting(category=types.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT, threshold=types.HarmBlockThreshold.BLOCK_NONE),
+            types.SafetySetting(category=types.HarmCategory.HARM_CATEGORY_CIVIC_INTEGRITY, threshold=types.HarmBlockThreshold.BLOCK_NONE),
+        ]
+
+    async def generate(self, prompt: str, schema: Optional[types.Schema] = None, temp: float = 1) -> LLMResponse:
+        if schema:
+            config = types.GenerateContentConfig(
+                temperature=temp, response_mime_type="application/json", safety_settings=self.safety_settings, response_schema=schema
+            )
+        else:
+            config = types.GenerateContentConfig(temperature=temp, response_mime_type="text/plain", safety_settings=self.safety_settings)
+
+        response = None
+        try:
+            response = await self.client.aio.models.generate_content(model=self.model, contents=prompt, config=config)
+            if not response:
+                raise Exception("NO_RESPONSE")
+
+            usage = response.usage_metadata
+            return LLMResponse(
+                loads(response.text) if schema else response.text,
+                input_tokens=usage.prompt_token_count or 0,
+                output_tokens=(usage.total_token_count or 0) - (usage.prompt_token_count or 0),
+            )
+
+        except Exception:
+            if response and response.candidates and response.candidates[0].finish_reason == types.FinishReason.RECITATION:
+                raise Exception("GEMINI_RECITATION")
+            raise
+
+    async def stream(self, prompt: str, temp: float = 1) -> AsyncIterator[LLMResponse]:
+        config = types.GenerateContentConfig(temperature=temp, response_mime_type="text/plain", safety_settings=self.safety_settings)
+        chunks = self.client.aio.models.generate_content_stream(model=self.model, contents=prompt, config=config)
+        if inspect.isawaitable(chunks):
+            chunks = await chunks
+
+        # Usage metadata on chunks is cumulative, convert to increments
+        seen_input, seen_total = 0, 0
+        try:
+            async for chunk in chunks:
+                if chunk.candidates and chunk.candidates[0].finish_reason == types.FinishReason.RECITATION:
+                    raise Exception("GEMINI_RECITATION")
+                usage = chunk.usage_metadata
+                input_tokens, total_tokens = (usage.prompt_token_count or 0, usage.total_token_count or 0) if usage else (seen_input, seen_total)
+                yield LLMResponse(
+                    chunk.text or "",
+                    input_tokens=max(0, input_tokens - seen_input),
+                    output_tokens=max(0, (total_tokens - input_tokens) - (seen_total - seen_input)),
+                )
+                seen_input, seen_total = max(seen_input, input_tokens), max(seen_total, total_tokens)
+        finally:
+            # Ends the HTTP response when the stream is abandoned (aborted run)
+            if hasattr(chunks, "aclose"):
+                await chunks.aclose()
+
+
+class StubProvider(LLMProvider):
+    """
+    Deterministic local provider for load tests, no network and no quota.
+    Responses are schema valid and depend only on (seed, prompt).
+    Latency and output token counts follow gaussians: (mean, stddev).
+    """
+
+    name = "stub"
+
+    def __init__(
+        self,
+        latency: tuple[float, float] = (1.0, 0.3),
+        output_tokens: tuple[float, float] = (400, 150),
+        continue_probability: float = 0.6,
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.output_tokens = output_tokens
+        self.continue_probability = continue_probability
+        self.seed = seed
+
+    async def generate(self, prompt: str, schema: Optional[types.Schema] = None, temp: float = 1) -> LLMResponse:
+        rng = random.Random(hashlib.sha256(f"{self.seed}:{prompt}".encode()).digest())
+        n_tokens = max(1, int(rng.gauss(*self.output_tokens)))
+        await asyncio.sleep(max(0.0, rng.gauss(*self.latency)))
+
+        words = re.findall(r"[A-Za-z][A-Za-z0-9-]{2,}", prompt) or ["lorem", "ipsum", "dolor"]
+        content = self._fake(schema, rng, words, n_tokens) if schema else self._text(rng, words, n_tokens)
+        return LLMResponse(content, input_tokens=estimate_tokens(prompt), output_tokens=n_tokens)
+
+    async def stream(self, prompt: str, temp: float = 1) -> AsyncIterator[LLMResponse]:
+        rng = random.Random(hashlib.sha256(f"{self.seed}:{prompt}".encode()).digest())
+        n_tokens = max(1, int(rng.gauss(*self.output_tokens)))
+        latency = max(0.0, rng.gauss(*self.latency))
+
+        words = re.findall(r"[A-Za-z][A-Za-z0-9-]{2,}", prompt) or ["lorem", "ipsum", "dolor"]
+        text = self._text(rng, words, n_tokens)
+        pieces = [text[i : i + 80] for i in range(0, len(text), 80)]
+        # First token after ~20% of the latency, the rest spread evenly
+        await asyncio.sleep(latency * 0.2)
+        for i, piece in enumerate(pieces):
+            if i:
+                await asyncio.sleep(latency * 0.8 / len(pieces))
+            yield LLMResponse(
+                piece,
+                input_tokens=estimate_tokens(prompt) if i == 0 else 0,
+                output_tokens=n_tokens // len(pieces) + (n_tokens % len(pieces) if i == 0 else 0),
+            )
+
+    def _fake(self, schema: types.Schema, rng: random.Random, words: List[str], n_tokens: int) -> Any:
+        kind = schema.type
+        if kind == types.Type.OBJECT:
+            properties = schema.properties or {}
+            if len(properties) == 1 and next(iter(properties.values())).type == types.Type.STRING:
+                # Single text field (e.g. report_fillin) carries the whole output
+                return {key: self._text(rng, words, n_tokens) for key in properties}
+            return {key: self._fake(prop, rng, words, n_tokens) for key, prop in properties.items()}
+        if kind == types.Type.ARRAY:
+            return [self._fake(schema.items, rng, words, n_tokens) for _ in range(rng.randint(2, 5))]
+        if kind == types.Type.BOOLEAN:
+            return rng.random() < self.continue_probability
+        if kind == types.Type.INTEGER:
+            return rng.randint(0, 100)
+        if kind == types.Type.NUMBER:
+            return rng.random()
+        return " ".join(rng.choices(words, k=rng.randint(3, 6)))
+
+    def _text(self, rng: random.Random, words: List[str], n_tokens: int) -> str:
+        # ~0.75 words per token, split into paragraphs
+        body = rng.choices(words, k=max(1, int(n_tokens * 0.75)))
+        return "\n\n".join(" ".join(body[i : i + 60]) for i in range(0, len(body), 60))
+
+
+def _pair(value: Optional[str], default: tuple[float, float]) -> tuple[float, float]:
+    if not value:
+        return default
+    mean, _, stddev = value.partition(",")
+    return float(mean), float(stddev or 0)
+
+
+def get_provider() -> LLMProvider:
+    """Provider selected by LLM_PROVIDER (gemini | stub)"""
+    name = os.getenv("LLM_PROVIDER", "gemini").lower()
+    if name == "stub":
+        return StubProvider(
+            latency=_pair(os.getenv("LLM_STUB_LATENCY"), (1.0, 0.3)),
+            output_tokens=_pair(os.getenv("LLM_STUB_OUTPUT_TOKENS"), (400, 150)),
+            seed=int(os.getenv("LLM_STUB_SEED", 0)),
+        )
+    if name == "gemini":
+        return GeminiProvider(model=os.getenv("LLM_MODEL", "gemini-2.0-flash"))
+    raise ValueError(f"Unknown LLM_PROVIDER '{name}'")
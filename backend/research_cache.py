@@ -0,0 +1,140 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from artifact_store import get_artifact_store
+from serialization import dumpb
+
+
+def normalize_topic(topic: str) -> str:
+    """Case, unicode form, whitespace and surrounding punctuation don't make a different request"""
+    topic = unicodedata.normalize("NFKC", topic).casefold()
+    return " ".join(topic.split()).strip(" .,;:!?\"'`")
+
+
+def request_key(
+    topic: str, max_depth: int, num_sites_per_query: int, fused_planner: Optional[bool] = None, budget: Optional[Dict[str, Any]] = None
+) -> str:
+    """Identity of a research request, equal keys produce the same kind of report. A budgeted run is a different request."""
+    if fused_planner is None:
+        fused_planner = os.getenv("KNET_FUSED_PLANNER", "false").lower() in ("1", "true")
+    raw = dumpb([normalize_topic(topic), int(max_depth), int(num_sites_per_query), bool(fused_planner), budget or None])
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+class ResultCache:
+    """
+    Completed runs by request key for `ttl` seconds (KNET_RESULT_CACHE_TTL, 0 disables), least recently used dropped
+    past `max_entries`. Only the job id is kept here, the report is read back from the artifact store.
+    """
+
+    def __init__(self, ttl: Optional[float] = None, max_entries: Optional[int] = None):
+        self.logger = logging.getLogger(__name__)
+        self.ttl = ttl if ttl is not None else float(os.getenv("KNET_RESULT_CACHE_TTL", 3600))
+        self.max_entries = max_entries or int(os.getenv("KNET_RESULT_CACHE_SIZE", 256))
+        self._entries: OrderedDict[str, Tuple[float, str]] = OrderedDict()  # key -> (expires, job id)
+        self.hits = 0
+        self.misses = 0
+
+    def put(self, key: str, job_id: str):
+        if self.ttl <= 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, job_id)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def job_id(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self._entries.pop(key, None)
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Cached report, None on a miss or when its artifacts were already cleaned up"""
+        job_id = self.job_id(key)
+        if job_id is not None:
+            try:
+                report = await get_artifact_store().get_json(job_id, "report")
+                self.hits += 1
+                return report
+            except FileNotFoundError:
+                self._entries.pop(key, None)
+        self.misses += 1
+        return None
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses, "ttl": self.ttl}
+
+
+class Flight:
+    """One run shared by every session that asked for the same request while it was going"""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.task: Optional[asyncio.Task] = None
+        self.subscribers: Dict[str, Callable[[dict], Any]] = {}  # session -> status callback
+        self.owner: Optional[str] = None  # Session whose resources the run uses
+        self.snapshot: Optional[Callable[[], Awaitable[Any]]] = None  # Sends the full tree again, set by the run
+        self.last_status: Optional[dict] = None
+
+    async def broadcast(self, status: dict):
+        self.last_status = status
+        for callback in list(self.subscribers.values()):
+            callback(status)
+
+
+class Singleflight:
+    """
+    Deduplicates concurrent identical requests: the first one starts the run, later ones subscribe to its progress
+    and get the same result. The run is cancelled only when every subscriber has left.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.flights: Dict[str, Flight] = {}
+        self.joined = 0  # Requests served by an already running flight
+
+    def join(self, key: str, session_id: str, callback: Callable[[dict], Any], start: Callable[[Flight], Awaitable[Any]]) -> Flight:
+        """Subscribes `session_id` to the run of `key`, `start(flight)` runs it if none is going"""
+        flight = self.flights.get(key)
+        if flight is None or flight.task.done():
+            flight = Flight(key)
+            flight.owner = session_id
+            flight.task = asyncio.create_task(start(flight))
+            flight.task.add_done_callback(lambda _: self._forget(flight))
+            self.flights[key] = flight
+        else:
+            self.joined += 1
+            self.logger.info(f"Session {session_id} joined the running research of {flight.owner}")
+            if flight.last_status is not None:
+                callback({key: value for key, value in flight.last_status.items() if key not in ("research_tree", "research_tree_delta")})
+        flight.subscribers[session_id] = callback
+        return flight
+
+    async def wait(self, flight: Flight, session_id: str) -> Any:
+        """Result of the run, leaving the flight when done or cancelled"""
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            self.leave(flight, session_id)
+
+    def leave(self, flight: Flight, session_id: str):
+        flight.subscribers.pop(session_id, None)
+        if not flight.subscribers and not flight.task.done():
+            self.logger.info(f"Last subscriber left, cancelling research {flight.key}")
+            flight.task.cancel()
+
+    def find(self, session_id: str) -> Optional[Flight]:
+        return next((flight for flight in self.flights.values() if session_id in flight.subscribers), None)
+
+    def _forget(self, flight: Flight):
+        if self.flights.get(flight.key) is flight:
+            del self.flights[flight.key]
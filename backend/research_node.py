@@ -1,14 +1,119 @@
 import copy
-from typing import Any, Dict, List, Optional, Self
+import uuid
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Self
+
+from content_store import ContentStore
+
+
+class TreeLog:
+    """
+    Append only change log shared by every node of a research tree.
+    `version` is the number of changes so far, `since(version)` returns what a client with that version is missing.
+    Also keeps the id -> node index of the tree.
+    """
+
+    def __init__(self):
+        self.ops: List[Dict[str, Any]] = []
+        self.nodes: Dict[str, "ResearchNode"] = {}
+
+    @property
+    def version(self) -> int:
+        return len(self.ops)
+
+    def append(self, op: Dict[str, Any]):
+        self.ops.append(op)
+
+    def since(self, version: int) -> List[Dict[str, Any]]:
+        return self.ops[version:]
 
 
 class ResearchNode:
-    def __init__(self, query: str = "_", parent: Optional[Self] = None, depth: int = 0):
+    # Many nodes per run, no per-instance __dict__
+    __slots__ = ("id", "query", "parent", "depth", "children", "log", "store", "_data", "_max_depth", "_descendants", "_sources", "_text_bytes")
+
+    def __init__(
+        self,
+        query: str = "_",
+        parent: Optional[Self] = None,
+        depth: int = 0,
+        log: Optional[TreeLog] = None,
+        store: Optional[ContentStore] = None,
+    ):
+        self.id = str(uuid.uuid4())
         self.query = query
         self.parent = parent
         self.depth = depth
         self.children: List[ResearchNode] = []
-        self.data: List[Dict[str, Any]] = []
+        self.log = log or (parent.log if parent else TreeLog())
+        self.log.nodes[self.id] = self
+        # Page bodies live once in the per run content store, pages keep a "text_ref" to them
+        self.store = store if store is not None else (parent.store if parent else ContentStore())
+        self._data: List[Dict[str, Any]] = []
+        # Subtree aggregates, kept up to date on add_child and data assignment
+        self._max_depth = depth
+        self._descendants = 0
+        self._sources = 0
+        self._text_bytes = 0
+
+    @property
+    def data(self) -> List[Dict[str, Any]]:
+        return self._data
+
+    @data.setter
+    def data(self, value: List[Dict[str, Any]]):
+        old_sources, old_bytes = self._own_stats()
+        self._data = [self._store_page(page) for page in value]
+        sources, text_bytes = self._own_stats()
+        self._propagate(sources=sources - old_sources, text_bytes=text_bytes - old_bytes)
+        if value:
+            self.log.append({"op": "sources", "id": self.id, "sources": self._source_titles()})
+
+    def _own_stats(self) -> tuple[int, int]:
+        return sum(1 for d in self._data if d.get("text_ref")), sum(d.get("text_bytes", 0) for d in self._data)
+
+    def _propagate(self, descendants: int = 0, sources: int = 0, text_bytes: int = 0, max_depth: int = 0):
+        # Apply a subtree change to this node and every ancestor, O(depth)
+        node = self
+        while node is not None:
+            node._descendants += descendants
+            node._sources += sources
+            node._text_bytes += text_bytes
+            node._max_depth = max(node._max_depth, max_depth)
+            node = node.parent
+
+    def _store_page(self, page: Dict[str, Any]) -> Dict[str, Any]:
+        # Swap the page text for a reference into the content store
+        stored = {key: value for key, value in page.items() if key != "text"}
+        if page.get("text"):
+            stored["text_ref"] = self.store.put(page["text"])
+            stored["text_bytes"] = len(page["text"].encode("utf-8"))
+        return stored
+
+    def page_text(self, page: Dict[str, Any]) -> str:
+        return self.store.get(page["text_ref"]) if page.get("text_ref") else ""
+
+    def pages(self, fields: Optional[Iterable[str]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        This node's pages. Stored dicts (text as "text_ref") when `fields` is None,
+        otherwise dicts of only `fields`, where "text" is read back from the content store.
+        """
+        fields = tuple(fields) if fields is not None else None
+        for d in self._data:
+            if fields is None:
+                yield d
+            else:
+                yield {key: self.page_text(d) if key == "text" else d.get(key) for key in fields}
+
+    def _source_titles(self) -> Dict[str, str]:
+        # Sources as url -> title, the page text stays on the server
+        return {d["url"]: d.get("title") or d["url"] for d in self._data if d.get("url") and d.get("text_ref")}
+
+    def find_node(self, node_id: str) -> Optional[Self]:
+        """
+        Returns the node with the given id from the tree's index, O(1).
+        If not found, returns None.
+        """
+        return self.log.nodes.get(node_id)
 
     def add_child(self, query: str, node: Optional[Self] = None) -> Self:
         if node:
@@ -18,8 +123,26 @@ class ResearchNode:
         else:
             child = ResearchNode(query, parent=self, depth=self.depth + 1)
         self.children.append(child)
+        child._attach(self.log)
+        self._propagate(descendants=1 + child._descendants, sources=child._sources, text_bytes=child._text_bytes, max_depth=child._max_depth)
         return child
 
+    def _attach(self, log: TreeLog):
+        # Move this subtree onto the parent's log and store, replaying it as changes
+        self.log = log
+        log.nodes[self.id] = self
+        if self.store is not self.parent.store:
+            for d in self._data:
+                if d.get("text_ref"):
+                    self.parent.store.put(self.store.get(d["text_ref"]))  # Same hash, same text_ref
+            self.store = self.parent.store
+        log.append({"op": "node", "id": self.id, "parent": self.parent.id, "query": self.query, "depth": self.depth})
+        if self._data:
+            log.append({"op": "sources", "id": self.id, "sources": self._source_titles()})
+        for child in self.children:
+            child._attach(log)
+        self._max_depth = max([self.depth] + [child._max_depth for child in self.children])
+
     def get_path_to_root(self) -> List[str]:
         """
         Returns the path from this node to the root node.
@@ -32,30 +155,68 @@ class ResearchNode:
             path.append(current.query)
         return list(reversed(path))
 
+    # O(1) aggregate accessors, safe to call from progress and monitoring code
     def max_depth(self) -> int:
-        if not self.children:
-            return self.depth
-        return max([child.max_depth() for child in self.children])
+        return self._max_depth
 
     def total_children(self) -> int:
-        if not self.children:
-            return 0
-        return len(self.children) + sum([child.total_children() for child in self.children])
+        return self._descendants
+
+    def source_count(self) -> int:
+        return self._sources
+
+    def text_bytes(self) -> int:
+        return self._text_bytes
+
+    def iter_nodes(self) -> Iterator[Self]:
+        """Pre-order traversal of this subtree, iterative so deep trees don't hit the recursion limit"""
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
+
+    def iter_data(self, fields: Optional[Iterable[str]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Read-only walk over every scraped page in this subtree, nothing is copied.
+        Yields what `pages(fields)` yields for each node. Callers must not mutate the stored dicts.
+        """
+        fields = tuple(fields) if fields is not None else None
+        for node in self.iter_nodes():
+            yield from node.pages(fields)
 
     def get_all_data(self) -> List[Dict[str, Any]]:
-        data = copy.deepcopy(self.data)
-        for child in self.children:
-            data.extend(child.get_all_data())
+        # Owned copy with the page text, prefer iter_data() for read-only access
+        data = []
+        for node in self.iter_nodes():
+            for d in node._data:
+                page = copy.deepcopy({key: value for key, value in d.items() if key not in ("text_ref", "text_bytes")})
+                if d.get("text_ref"):
+                    page["text"] = node.page_text(d)
+                data.append(page)
         return data
 
     # Build research tree structure
     def build_tree_structure(self) -> Dict:
         if not self:
             return {}
-        sources = {d["url"]: d["text"] for d in self.data if d.get("url") and d.get("text")}
+        sources = {d["url"]: self.page_text(d) for d in self._data if d.get("url") and d.get("text_ref")}
         return {
             "query": self.query,
             "depth": self.depth,
             "sources": sources,
             "children": [child.build_tree_structure() for child in self.children],
         }
+
+    def build_tree_outline(self) -> Dict:
+        """
+        Same shape as `build_tree_structure` with node ids and sources as url -> title.
+        Sent as the snapshot that `TreeLog` changes are applied on.
+        """
+        return {
+            "id": self.id,
+            "query": self.query,
+            "depth": self.depth,
+            "sources": self._source_titles(),
+            "children": [child.build_tree_outline() for child in self.children],
+        }
@@ -0,0 +1,123 @@
+import asyncio
+import itertools
+import logging
+import os
+from typing import AsyncIterator, Dict, List, Optional
+
+
+class SchedulerFull(Exception):
+    """Raised by `ResearchScheduler.submit` when a run can't be admitted"""
+
+    def __init__(self, message: str, reason: str):
+        super().__init__(message)
+        self.reason = reason  # "queue_full" | "user_limit"
+
+
+class Ticket:
+    def __init__(self, user_id: str, priority: int, seq: int):
+        self.user_id = user_id
+        self.priority = priority
+        self.seq = seq
+        self.position: Optional[int] = None  # 1-based place in the queue, None once running
+        self.granted = asyncio.get_running_loop().create_future()
+        self._changed = asyncio.Event()
+
+    async def positions(self) -> AsyncIterator[int]:
+        """Yields the queue position every time it changes, returns once the run may start"""
+        while not self.granted.done():
+            if self.position is not None:
+                yield self.position
+            self._changed.clear()
+            waiter = asyncio.ensure_future(self._changed.wait())
+            try:
+                await asyncio.wait([waiter, self.granted], return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                waiter.cancel()
+
+
+class ResearchScheduler:
+    """
+    Admission control for research runs.
+    - At most `max_concurrency` runs at once, up to `max_queued` more wait, past that `submit` raises SchedulerFull
+    - A user can have at most `max_per_user` runs waiting
+    - Waiting runs start by priority (lower first), then round robin across users, then FIFO
+    """
+
+    def __init__(self, max_concurrency: int = 2, max_queued: int = 10, max_per_user: int = 2):
+        self.logger = logging.getLogger(__name__)
+        self.max_concurrency = max_concurrency
+        self.max_queued = max_queued
+        self.max_per_user = max_per_user
+
+        self.running: Dict[int, Ticket] = {}
+        self.waiting: List[Ticket] = []
+        self._seq = itertools.count()
+        self._served: Dict[str, int] = {}  # user -> runs started, to rotate between users
+
+    def submit(self, user_id: str, priority: int = 1) -> Ticket:
+        """Queues a run or raises SchedulerFull, await `ticket.positions()` (or `ticket.granted`) before starting"""
+        if len(self.running) < self.max_concurrency and not self.waiting:
+            ticket = Ticket(user_id, priority, next(self._seq))
+            self._start(ticket)
+            return ticket
+        if len(self.waiting) >= self.max_queued:
+            raise SchedulerFull(f"Server is at capacity ({len(self.running)} running, {len(self.waiting)} queued), try again later", "queue_full")
+        if sum(1 for t in self.waiting if t.user_id == user_id) >= self.max_per_user:
+            raise SchedulerFull(f"You already have {self.max_per_user} research runs waiting", "user_limit")
+
+        ticket = Ticket(user_id, priority, next(self._seq))
+        self.waiting.append(ticket)
+        self._dispatch()
+        return ticket
+
+    def release(self, ticket: Ticket):
+        """Frees the slot of a finished run, or drops a run that is still waiting (cancelled)"""
+        if self.running.pop(ticket.seq, None) is None and ticket in self.waiting:
+            self.waiting.remove(ticket)
+        if not ticket.granted.done():
+            ticket.granted.cancel()
+        self._dispatch()
+
+    def stats(self) -> dict:
+        return {"running": len(self.running), "queued": len(self.waiting), "max_concurrency": self.max_concurrency, "max_queued": self.max_queued}
+
+    def _order(self) -> List[Ticket]:
+        # A user's n-th waiting run is in round n, users that were served less go first within a round
+        rounds: Dict[str, int] = {}
+        keyed = []
+        for ticket in sorted(self.waiting, key=lambda t: t.seq):
+            rounds[ticket.user_id] = rounds.get(ticket.user_id, 0) + 1
+            keyed.append(((ticket.priority, rounds[ticket.user_id], self._served.get(ticket.user_id, 0), ticket.seq), ticket))
+        return [ticket for _, ticket in sorted(keyed, key=lambda k: k[0])]
+
+    def _start(self, ticket: Ticket):
+        self.running[ticket.seq] = ticket
+        self._served[ticket.user_id] = self._served.get(ticket.user_id, 0) + 1
+        ticket.position = None
+        ticket.granted.set_result(None)
+
+    def _dispatch(self):
+        order = self._order()
+        while order and len(self.running) < self.max_concurrency:
+            ticket = order.pop(0)
+            self.waiting.remove(ticket)
+            self._start(ticket)
+        for position, ticket in enumerate(order, start=1):
+            if ticket.position != position:
+                ticket.position = position
+                ticket._changed.set()
+
+
+_scheduler: Optional[ResearchScheduler] = None
+
+
+def get_scheduler() -> ResearchScheduler:
+    """Shared scheduler for every session in this process, configured from the environment"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = ResearchScheduler(
+            max_concurrency=int(os.getenv("KNET_MAX_CONCURRENT_RUNS", 2)),
+            max_queued=int(os.getenv("KNET_MAX_QUEUED_RUNS", 10)),
+            max_per_user=int(os.getenv("KNET_MAX_QUEUED_PER_USER", 2)),
+        )
+    return _scheduler
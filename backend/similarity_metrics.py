@@ -6,12 +6,12 @@ import numpy as np
 import csv # For CSV output
 import os # To get filename for report
 
+from serialization import load
+
 # --- 1. Load Data --- (No changes from previous version)
 def load_data(filepath="output.log.json"):
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        return data
+        return load(filepath)
     except FileNotFoundError:
         print(f"Error: File '{filepath}' not found.")
         return None
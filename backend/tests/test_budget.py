@@ -0,0 +1,96 @@
+import pytest
+
+from budget import RunBudget
+from serialization import dumpb, loads
+
+
+def token_budget(verticals: int = 3) -> RunBudget:
+    # Exploration gets 750 tokens, 250 per vertical
+    budget = RunBudget(max_tokens=1000, report_reserve=0.25)
+    budget.verticals = verticals
+    return budget
+
+
+def test_from_params():
+    assert RunBudget.from_params(None) is None
+    assert RunBudget.from_params({"deadline": None, "max_tokens": 0}) is None
+    budget = RunBudget.from_params({"deadline": "90", "max_tokens": "5000"})
+    assert (budget.deadline, budget.max_tokens) == (90.0, 5000)
+
+
+def test_token_budget_stops_branching_then_the_vertical():
+    budget = token_budget()
+    assert budget.can_branch(0, vertical=0)
+    assert budget.can_branch(120, vertical=0)
+    assert not budget.can_branch(130, vertical=0)  # Past half of the vertical's share
+    assert budget.skipped["branches"] == 1
+
+    assert not budget.vertical_done(249, vertical=0)
+    assert budget.vertical_done(250, vertical=0)
+    assert not budget.vertical_done(250, vertical=1)  # The next vertical has its own share
+
+
+def test_sites_shrink_past_half_the_share():
+    budget = token_budget()
+    assert budget.sites(6, 0, vertical=0) == 6
+    assert budget.sites(6, 125, vertical=0) == 6
+    assert budget.sites(6, 190, vertical=0) == 3
+    assert budget.sites(6, 400, vertical=0) == 1
+
+
+def test_token_exhaustion_ends_exploration():
+    budget = token_budget()
+    assert not budget.explore_done(749)
+    assert budget.stopped is None
+    assert budget.explore_done(750)
+    assert budget.stopped == "tokens"
+    assert not budget.exhausted(999)
+    assert budget.exhausted(1000)
+
+
+def test_deadline_ends_exploration():
+    budget = RunBudget(deadline=100, report_reserve=0.25)
+    assert not budget.explore_done(0)
+    budget.elapsed_before = 80  # 80 of 100 seconds spent
+    assert not budget.can_branch(0, vertical=0)
+    assert budget.explore_done(0)
+    assert budget.stopped == "deadline"
+    seconds, tokens = budget.remaining(0)
+    assert seconds == pytest.approx(20, abs=1) and tokens is None
+
+
+def test_the_closer_limit_counts():
+    budget = RunBudget(deadline=1000, max_tokens=1000)
+    assert budget.used(500) == pytest.approx(0.5)
+    budget.elapsed_before = 900
+    assert budget.used(500) == pytest.approx(0.9, abs=0.01)
+    assert budget.explore_done(500)
+    assert budget.stopped == "deadline"
+
+
+def test_report_sections_fit_what_is_left():
+    budget = token_budget()
+    assert budget.report_sections(5, tokens=0, section_tokens=100, section_seconds=10) == 5
+    assert budget.report_sections(5, tokens=900, section_tokens=30, section_seconds=10) == 3
+    assert budget.report_sections(5, tokens=1000, section_tokens=30, section_seconds=10) == 1  # Always at least one
+    assert budget.skipped["sections"] == 2 + 4
+
+    timed = RunBudget(deadline=100)
+    timed.elapsed_before = 70
+    assert timed.report_sections(8, tokens=0, section_tokens=1, section_seconds=10) == 2
+
+
+def test_round_trip_keeps_the_spent_budget():
+    budget = token_budget()
+    budget.elapsed_before = 12.5
+    budget.start_phase("report", 400)
+    budget.can_branch(200, vertical=0)
+    budget.explore_done(800)
+
+    saved = budget.to_dict()
+    restored = RunBudget.from_dict(loads(dumpb(saved)))
+    for key in ("deadline", "max_tokens", "report_reserve", "verticals", "phases", "phase", "skipped", "stopped"):
+        assert restored.to_dict()[key] == saved[key]
+    assert restored.phase_started == budget.phase_started
+    assert restored.elapsed() >= saved["elapsed"]
+    assert restored.summary(800)["stopped_early"] == "tokens"
@@ -0,0 +1,44 @@
+from content_store import ContentStore
+from research_node import ResearchNode
+
+
+def test_large_bodies_spill_and_read_back(tmp_path):
+    store = ContentStore(spill_threshold=100, spill_dir=str(tmp_path))
+    small = store.put("short page")
+    first = store.put("é" * 60)  # 120 bytes, at the threshold by bytes not characters
+    second = store.put("battery recycling " * 20)
+
+    assert store.get(small) == "short page"
+    assert store.get(first) == "é" * 60
+    store.put("x" * 200)  # Spilled after the first read, the file is mapped again
+    assert store.get(second) == "battery recycling " * 20
+    assert store.stats() == {"bodies": 4, "bytes_in_memory": len("short page"), "bytes_spilled": 120 + 360 + 200}
+    store.close()
+    assert len(store) == 0 and store.stats()["bytes_spilled"] == 0
+
+
+def test_same_text_is_kept_once():
+    store = ContentStore(spill_threshold=10)
+    assert store.put("solar panel efficiency") == store.put("solar panel efficiency")
+    assert store.stats()["bytes_spilled"] == len("solar panel efficiency")
+    store.close()
+
+
+def test_no_threshold_keeps_everything_in_memory():
+    store = ContentStore(spill_threshold=0)
+    key = store.put("x" * 100_000)
+    assert store.get(key) == "x" * 100_000
+    assert store.stats()["bytes_spilled"] == 0
+
+
+def test_pages_keep_a_text_ref_to_the_spilled_body():
+    master = ResearchNode("topic", store=ContentStore(spill_threshold=50))
+    child = master.add_child("solar panels")
+    text = "Solar panel efficiency rose again this year. " * 4
+    child.data = [{"url": "https://a", "title": "A", "text": text}, {"url": "https://b", "title": "B", "text": "short"}]
+
+    spilled, short = child.data
+    assert "text" not in spilled and spilled["text_ref"] in master.store
+    assert child.page_text(spilled) == text and child.page_text(short) == "short"
+    assert master.store.stats()["bytes_spilled"] == len(text)
+    master.store.close()
@@ -0,0 +1,108 @@
+import asyncio
+
+from event_queue import OutboundQueue, merge_status
+
+
+def tree_delta(base: int, version: int, *ops) -> dict:
+    return {"base": base, "version": version, "ops": list(ops)}
+
+
+def test_tree_deltas_are_concatenated():
+    merged = merge_status(
+        {"progress": 10, "research_tree_delta": tree_delta(1, 2, "a")},
+        {"progress": 12, "message": "Searching", "research_tree_delta": tree_delta(2, 4, "b", "c")},
+    )
+    assert merged == {"progress": 12, "message": "Searching", "research_tree_delta": tree_delta(1, 4, "a", "b", "c")}
+
+
+def test_snapshot_supersedes_earlier_deltas():
+    merged = merge_status({"research_tree_delta": tree_delta(1, 2, "a")}, {"research_tree": {"id": "root"}, "tree_version": 5})
+    assert merged == {"research_tree": {"id": "root"}, "tree_version": 5}
+
+
+def test_report_text_of_one_section_is_concatenated():
+    merged = merge_status(
+        {"progress": 90, "report_delta": {"index": 1, "heading": "Costs", "delta": "Battery "}},
+        {"progress": 91, "report_delta": {"index": 1, "heading": "Costs", "delta": "prices fell."}},
+    )
+    assert merged == {"progress": 91, "report_delta": {"index": 1, "heading": "Costs", "delta": "Battery prices fell."}}
+
+
+def test_what_would_lose_data_is_not_merged():
+    # Another report section, or a delta that only applies on top of a snapshot the client hasn't got yet
+    assert merge_status({"report_delta": {"index": 0, "delta": "a"}}, {"report_delta": {"index": 1, "delta": "b"}}) is None
+    assert merge_status({"research_tree": {"id": "root"}}, {"research_tree_delta": tree_delta(1, 2, "a")}) is None
+
+
+class Recorder:
+    """emit() that records events, held back until `gate` is set"""
+
+    def __init__(self):
+        self.events = []
+        self.times = []
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def emit(self, event, data):
+        await self.gate.wait()
+        self.events.append((event, data))
+        self.times.append(asyncio.get_running_loop().time())
+
+
+def test_waiting_statuses_are_coalesced():
+    async def main():
+        recorder = Recorder()
+        queue = OutboundQueue(recorder.emit, max_rate=1000)
+        recorder.gate.clear()
+        queue.put("status", {"progress": 1, "research_tree_delta": tree_delta(0, 1, "a")})
+        await asyncio.sleep(0.01)  # The first one is being emitted, the next ones wait
+        for i in range(2, 6):
+            queue.put("status", {"progress": i, "research_tree_delta": tree_delta(i - 1, i, chr(ord("a") + i - 1))})
+        recorder.gate.set()
+        await queue.flush(timeout=1)
+        await queue.close()
+        return recorder.events, queue.stats()
+
+    events, stats = asyncio.run(main())
+    assert [data["progress"] for _, data in events] == [1, 5]
+    assert events[1][1]["research_tree_delta"] == tree_delta(1, 5, "b", "c", "d", "e")
+    assert stats["coalesced"] == 3 and stats["sent"] == 2
+
+
+def test_oldest_statuses_are_dropped_past_max_pending():
+    async def main():
+        recorder = Recorder()
+        queue = OutboundQueue(recorder.emit, max_rate=1000, max_pending=3)
+        recorder.gate.clear()
+        queue.put("status", {"report_delta": {"index": -1, "delta": ""}})
+        await asyncio.sleep(0.01)
+        # Different report sections can't be merged, only dropped
+        for index in range(4):
+            queue.put("status", {"report_delta": {"index": index, "delta": str(index)}})
+        queue.put("result", {"report": "done"})
+        recorder.gate.set()
+        await queue.flush(timeout=1)
+        await queue.close()
+        return recorder.events, queue.stats()
+
+    events, stats = asyncio.run(main())
+    assert [event for event, _ in events] == ["status", "status", "status", "result"]
+    assert [data["report_delta"]["index"] for event, data in events if event == "status"] == [-1, 2, 3]
+    assert stats["dropped"] == 2
+
+
+def test_statuses_are_rate_limited():
+    async def main():
+        recorder = Recorder()
+        queue = OutboundQueue(recorder.emit, max_rate=20)
+        queue.put("status", {"report_delta": {"index": 0, "delta": "a"}})
+        await asyncio.sleep(0.01)
+        queue.put("status", {"report_delta": {"index": 1, "delta": "b"}})
+        queue.put("done", None)  # Not a status, no wait after it
+        await queue.flush(timeout=1)
+        await queue.close()
+        return recorder
+
+    recorder = asyncio.run(main())
+    assert [event for event, _ in recorder.events] == ["status", "status", "done"]
+    assert recorder.times[1] - recorder.times[0] >= 0.045  # 1 / max_rate
@@ -0,0 +1,80 @@
+import pytest
+
+from frontier import Coverage, Frontier
+from research_node import ResearchNode
+
+
+def explored(query: str, *pages) -> ResearchNode:
+    node = ResearchNode(query)
+    node.data = [{"url": url, "title": title, "text": f"{title} body"} for url, title in pages]
+    return node
+
+
+def pop_queries(frontier: Frontier) -> list:
+    return [frontier.pop()[0].query for _ in range(len(frontier))]
+
+
+def test_novelty_drops_with_coverage():
+    coverage = Coverage()
+    assert coverage.novelty("battery recycling") == 1
+    assert coverage.novelty("the and of") == 0  # Only stopwords
+
+    coverage.observe(explored("battery recycling", ("https://a", "Battery recycling plants"), ("https://b", "Recycling battery cells")))
+    assert coverage.novelty("battery recycling") == pytest.approx(0)
+    assert 0 < coverage.novelty("battery recycling costs") < 1
+    assert coverage.novelty("solar panel efficiency") == 1
+
+
+def test_observe_measures_serp_overlap():
+    coverage = Coverage()
+    assert coverage.observe(explored("a", ("https://a", "A"), ("https://b", "B"))) == 0
+    assert coverage.observe(explored("b", ("https://b", "B"), ("https://c", "C"))) == 0.5
+    assert coverage.stats()["unique_sources"] == 3
+    assert coverage.stats()["serp_overlap"] == 0.25
+
+
+def test_pop_takes_the_highest_gain_first():
+    frontier = Frontier(Coverage(), depth_penalty=0.15)
+    frontier.push(ResearchNode("deep question"), depth=3)  # 1 - 0.3
+    frontier.push(ResearchNode("overlapping question"), depth=1, overlap=0.8)  # 1 - 0.4
+    frontier.push(ResearchNode("first question"), depth=1)  # 1
+    frontier.push(ResearchNode("second question"), depth=1)  # 1, newer
+    frontier.push(ResearchNode("child question"), depth=2)  # 1 - 0.15
+
+    assert pop_queries(frontier) == ["second question", "first question", "child question", "deep question", "overlapping question"]
+
+
+def test_stale_candidates_are_rescored():
+    coverage = Coverage()
+    frontier = Frontier(coverage, depth_penalty=0)
+    frontier.push(ResearchNode("solar panel efficiency"), depth=1)
+    frontier.push(ResearchNode("battery recycling"), depth=1)  # Same gain, newer, on top
+
+    # Another branch covered battery recycling meanwhile
+    coverage.observe(explored("battery recycling", ("https://a", "Battery recycling plants"), ("https://b", "Recycling battery cells")))
+    node, _, gain = frontier.pop()
+    assert node.query == "solar panel efficiency" and gain == 1
+    node, _, gain = frontier.pop()
+    assert node.query == "battery recycling" and gain == pytest.approx(0)
+
+
+def test_max_nodes_caps_the_expansions():
+    coverage = Coverage()
+    frontier = Frontier(coverage, max_nodes=2)
+    for query in ("a question", "b question", "c question"):
+        frontier.push(ResearchNode(query), depth=1)
+
+    frontier.pop()
+    assert len(frontier) == 2 and not frontier.exhausted()
+    frontier.pop()
+    assert frontier.exhausted() and len(frontier) == 0
+    frontier.close()
+    assert coverage.dropped == 1
+
+
+def test_no_cap_by_default():
+    frontier = Frontier(Coverage())
+    for i in range(20):
+        frontier.push(ResearchNode(f"question {i}"), depth=1)
+    assert len(pop_queries(frontier)) == 20
+    assert not frontier.exhausted()
@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+from job_store import DONE, FAILED, QUEUED, RUNNING, JobStore, SQLiteJobStore, claim_order
+
+KIND = "research"
+
+
+def submit_all(store: SQLiteJobStore, jobs):
+    async def submit():
+        for job_id, user_id, priority in jobs:
+            await store.submit(job_id, KIND, {"topic": job_id}, user_id, priority)
+            await asyncio.sleep(0.002)  # Distinct creation times
+
+    asyncio.run(submit())
+
+
+def claim_all(store: SQLiteJobStore) -> list:
+    async def claim():
+        claimed = []
+        while (job := await store.claim("worker", KIND)) is not None:
+            claimed.append(job["id"])
+        return claimed
+
+    return asyncio.run(claim())
+
+
+def test_claim_takes_turns_between_users(tmp_path):
+    store = SQLiteJobStore(str(tmp_path / "jobs.db"))
+    submit_all(store, [("a1", "alice", 1), ("a2", "alice", 1), ("a3", "alice", 1), ("b1", "bob", 1), ("c1", "carol", 1), ("b2", "bob", 1)])
+    assert claim_all(store) == ["a1", "b1", "c1", "a2", "b2", "a3"]
+
+
+def test_claim_serves_priority_first(tmp_path):
+    store = SQLiteJobStore(str(tmp_path / "jobs.db"))
+    submit_all(store, [("a1", "alice", 1), ("b1", "bob", 2), ("a2", "alice", 0)])
+    assert claim_all(store) == ["a2", "a1", "b1"]
+
+
+def test_position_matches_claim_order(tmp_path):
+    store = SQLiteJobStore(str(tmp_path / "jobs.db"))
+    submit_all(store, [("a0", "alice", 1)])
+    assert claim_all(store) == ["a0"]  # alice already has a running job
+    jobs = [("a1", "alice", 1), ("a2", "alice", 1), ("b1", "bob", 1), ("b2", "bob", 1), ("c1", "carol", 0)]
+    submit_all(store, jobs)
+
+    async def positions():
+        return {job_id: await store.position(job_id) for job_id, _, _ in jobs}
+
+    queued = asyncio.run(positions())
+    assert sorted(queued, key=queued.get) == claim_all(store) == ["c1", "b1", "a1", "b2", "a2"]
+    assert asyncio.run(store.position("a1")) is None
+
+
+def test_claim_order_counts_running_jobs():
+    queued = [("a1", "alice", 1, 1.0), ("b1", "bob", 1, 2.0), ("a2", "alice", 1, 3.0)]
+    assert claim_order(queued, {}) == ["a1", "b1", "a2"]
+    assert claim_order(queued, {"alice": 2}) == ["b1", "a1", "a2"]
+
+
+def test_events_keep_their_order_across_batches(tmp_path):
+    store = SQLiteJobStore(str(tmp_path / "jobs.db"))
+
+    async def main():
+        await store.submit("job", KIND, {}, "alice")
+        assert await store.append_event("job", "progress", {"progress": 1}) == 1
+        assert await store.append_events("job", [("report_delta", {"delta": "a"}), ("result", {"ok": True})]) == 3
+        assert await store.append_events("job", []) == 0
+        assert await store.append_event("job", "done", None) == 4
+        return await store.events("job"), await store.events("job", after=2)
+
+    events, tail = asyncio.run(main())
+    assert [(seq, event) for seq, event, _ in events] == [(1, "progress"), (2, "report_delta"), (3, "result"), (4, "done")]
+    assert events[1][2] == {"delta": "a"}
+    assert [seq for seq, _, _ in tail] == [3, 4]
+
+
+def test_finished_jobs_leave_the_queue(tmp_path):
+    store = SQLiteJobStore(str(tmp_path / "jobs.db"))
+
+    async def main():
+        await store.submit("job", KIND, {}, "alice")
+        queued = (await store.get("job"))["status"]
+        await store.claim("worker", KIND)
+        running = (await store.get("job"))["status"]
+        await store.finish("job", DONE, result={"report": "x"})
+        return queued, running, await store.get("job", with_result=True)
+
+    queued, running, job = asyncio.run(main())
+    assert (queued, running, job["status"]) == (QUEUED, RUNNING, DONE)
+    assert job["result"] == {"report": "x"}
+
+
+def test_find_active_sees_queued_and_running_jobs_of_a_run(tmp_path):
+    store = SQLiteJobStore(str(tmp_path / "jobs.db"))
+
+    async def main():
+        await store.submit("job 1", KIND, {"topic": "x", "job_id": "run"}, "alice")
+        await store.submit("other", KIND, {"topic": "y", "job_id": "other run"}, "alice")
+        queued = await store.find_active("run")
+        await store.claim("worker", KIND)
+        running = await store.find_active("run", stale_after=60)
+        stale = await store.find_active("run", stale_after=-1)  # Heartbeat older than the limit, the worker is gone
+        await store.finish("job 1", FAILED, error="worker restarted")
+        # A resume is a new job of the same run
+        finished = await store.find_active("run")
+        await store.submit("job 2", KIND, {"resume": "run", "job_id": "run"}, "alice")
+        return queued, running, stale, finished, await store.find_active("run"), await store.find_active("missing")
+
+    assert asyncio.run(main()) == ("job 1", "job 1", None, None, "job 2", None)
+
+
+def test_incomplete_store_cannot_be_created():
+    class NoEvents(JobStore):
+        async def submit(self, job_id, kind, params, user_id, priority=1):
+            pass
+
+    with pytest.raises(TypeError):
+        NoEvents()
@@ -0,0 +1,112 @@
+import asyncio
+
+from link_index import LinkIndex
+from query_registry import query_terms
+from research_node import ResearchNode
+
+
+def link(href: str, text: str = "") -> dict:
+    return {"href": href, "text": text}
+
+
+def page(url: str, links: list, text: str = "", hop=None) -> dict:
+    return {"url": url, "title": url, "text": text or url, "links": links, "hop": hop}
+
+
+class FakeScraper:
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.crawled = []
+
+    async def crawl(self, urls, num_sites, query=""):
+        self.crawled.append(list(urls))
+        return [{"url": url, "title": url, "text": f"page {url}"} for url in urls[:num_sites] if url not in self.failing]
+
+
+def indexed(*pages, **kwargs) -> LinkIndex:
+    index = LinkIndex(**kwargs)
+    node = ResearchNode("topic")
+    node.data = list(pages)
+    index.add(node)
+    return index
+
+
+def test_links_are_indexed_once_and_scraped_pages_are_skipped():
+    index = indexed(
+        page("https://a.com", [link("https://b.com/pricing#plans", "Pricing plans"), link("https://b.com/pricing/", "Pricing")]),
+        page("https://b.com", [link("https://a.com/", "Home")]),
+    )
+    assert set(index.links) == {"https://b.com/pricing"}  # Fragment and trailing slash don't make another link
+    assert "https://a.com" in index.seen
+
+
+def test_anchor_text_counts_more_than_the_context():
+    text = "Our report https://x.com/report has it all. Older battery recycling costs: https://x.com/other"
+    index = indexed(
+        page("https://x.com", [link("https://x.com/report", "Battery recycling costs"), link("https://x.com/other", "More")], text),
+        window=40,
+    )
+    query = query_terms("battery recycling costs")
+    report, other = index.links["https://x.com/report"], index.links["https://x.com/other"]
+    assert index.score(query, report) == 1.0
+    assert 0 < index.score(query, other) < index.score(query, report)
+
+
+def test_pick_needs_enough_relevant_links():
+    index = indexed(
+        page(
+            "https://x.com",
+            [link("https://x.com/1", "solar panel efficiency"), link("https://x.com/2", "solar panel prices"), link("https://x.com/3", "contact us")],
+        ),
+        min_score=0.5,
+    )
+    assert index.pick("solar panel efficiency", 3, at_least=3) == []
+    picked = index.pick("solar panel efficiency", 3, at_least=2)
+    assert [item["url"] for item in picked] == ["https://x.com/1", "https://x.com/2"]
+    assert index.pick("solar panel efficiency", 3) == []  # Picked links are not offered again
+
+
+def test_links_past_max_hops_are_not_indexed():
+    index = indexed(
+        page("https://search.com", [link("https://one.com", "solar panels")]),
+        page("https://one.com/page", [link("https://two.com", "solar panels")], hop=1),
+        max_hops=1,
+    )
+    assert set(index.links) == {"https://one.com"}
+    assert index.links["https://one.com"]["hop"] == 1
+
+
+def test_follow_tags_pages_with_their_hop():
+    index = indexed(
+        page("https://search.com", [link("https://one.com/a", "solar panel efficiency"), link("https://one.com/b", "solar panel efficiency data")]),
+        min_score=0.5,
+    )
+    scraper = FakeScraper()
+    pages = asyncio.run(index.follow(scraper, "solar panel efficiency", 2))
+    assert sorted(p["url"] for p in pages) == ["https://one.com/a", "https://one.com/b"]
+    assert all(p["hop"] == 1 for p in pages)
+    assert index.stats() == {"links": 0, "crawls": 1, "fallbacks": 0}
+
+
+def test_follow_falls_back_to_a_search():
+    index = indexed(page("https://search.com", [link("https://one.com/a", "solar panel efficiency")]), min_score=0.5)
+    scraper = FakeScraper()
+    # 1 relevant link for 4 sites, fewer than half: search instead, nothing crawled
+    assert asyncio.run(index.follow(scraper, "solar panel efficiency", 4)) == []
+    assert scraper.crawled == []
+
+    failing = FakeScraper(failing={"https://one.com/a"})
+    assert asyncio.run(index.follow(failing, "solar panel efficiency", 2)) == []
+    assert index.stats()["fallbacks"] == 2
+
+
+def test_from_tree_rebuilds_the_index_of_a_resumed_run():
+    master = ResearchNode("topic")
+    child = master.add_child("solar panels")
+    child.data = [page("https://search.com", [link("https://one.com/a", "solar panel efficiency"), link("https://done.com", "solar")])]
+    child.add_child("followed").data = [page("https://done.com", [], hop=1)]
+
+    index = LinkIndex.from_tree(master, {"crawls": 3, "fallbacks": 1})
+    assert set(index.links) == {"https://one.com/a"}
+    assert (index.crawls, index.fallbacks) == (3, 1)
+    assert LinkIndex.from_tree(master).stats()["crawls"] == 0
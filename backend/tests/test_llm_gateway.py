@@ -0,0 +1,216 @@
+import asyncio
+
+import pytest
+
+from llm_gateway import PRIORITY_BRANCH, PRIORITY_PLAN, PRIORITY_REPORT, PRIORITY_SUMMARY, LLMGateway, status_code
+
+
+class ProviderError(Exception):
+    def __init__(self, code: int):
+        super().__init__(f"provider returned {code}")
+        self.code = code
+
+
+def make_gateway(**kwargs) -> LLMGateway:
+    # No rate limits and no backoff sleeps, only the concurrency limit applies
+    kwargs = {"requests_per_min": 1e9, "tokens_per_min": 1e12, "backoff_base": 0, **kwargs}
+    return LLMGateway(**kwargs)
+
+
+def test_overload_halves_the_limit_once_per_cooldown():
+    gateway = make_gateway(max_concurrency=8, decrease_cooldown=60)
+    attempts = []
+
+    async def call():
+        attempts.append(len(attempts))
+        if len(attempts) <= 2:
+            raise ProviderError(429)
+        return "ok"
+
+    async def main():
+        trace = {}
+        assert await gateway.submit(call, trace=trace) == "ok"
+        return trace
+
+    trace = asyncio.run(main())
+    assert len(attempts) == 3
+    assert trace["retries"] == 2
+    # Two 429s within the cooldown count as one decrease, then the success adds 1 / limit
+    assert gateway.concurrency_limit == pytest.approx(4 + 1 / 4)
+    assert gateway.in_flight == 0
+
+
+def test_limit_stays_between_min_and_max():
+    gateway = make_gateway(max_concurrency=4, min_concurrency=1, decrease_cooldown=0)
+    for _ in range(10):
+        gateway._on_overload()
+    assert gateway.concurrency_limit == 1
+    for _ in range(100):
+        gateway._on_success()
+    assert gateway.concurrency_limit == 4
+
+
+def test_non_retryable_errors_are_not_retried():
+    gateway = make_gateway(decrease_cooldown=0)
+    attempts = []
+
+    async def call():
+        attempts.append(1)
+        raise ProviderError(400)
+
+    with pytest.raises(ProviderError):
+        asyncio.run(gateway.submit(call))
+    assert len(attempts) == 1
+    assert gateway.concurrency_limit == gateway.max_concurrency
+    assert gateway.in_flight == 0
+
+
+def test_waiting_calls_are_served_by_priority_then_fifo():
+    gateway = make_gateway(max_concurrency=1)
+    served = []
+
+    async def main():
+        release = asyncio.Event()
+
+        async def hold():
+            await release.wait()
+
+        holder = asyncio.create_task(gateway.submit(hold))
+        await asyncio.sleep(0)
+        assert gateway.in_flight == 1
+
+        def record(name):
+            async def call():
+                served.append(name)
+
+            return call
+
+        waiting = [
+            ("branch", PRIORITY_BRANCH),
+            ("summary 1", PRIORITY_SUMMARY),
+            ("report", PRIORITY_REPORT),
+            ("summary 2", PRIORITY_SUMMARY),
+            ("plan", PRIORITY_PLAN),
+        ]
+        tasks = []
+        for name, priority in waiting:
+            tasks.append(asyncio.create_task(gateway.submit(record(name), priority=priority)))
+            await asyncio.sleep(0)
+        assert gateway.stats()["queued"] == len(waiting)
+
+        release.set()
+        await asyncio.gather(holder, *tasks)
+
+    asyncio.run(main())
+    assert served == ["report", "plan", "summary 1", "summary 2", "branch"]
+    assert gateway.in_flight == 0
+
+
+def test_slot_granted_to_a_cancelled_caller_is_released():
+    gateway = make_gateway(max_concurrency=1)
+
+    async def main():
+        await gateway._acquire(PRIORITY_SUMMARY, 0)
+        waiter = asyncio.create_task(gateway._acquire(PRIORITY_SUMMARY, 0))
+        await asyncio.sleep(0)
+        assert gateway.stats()["queued"] == 1
+
+        # The slot goes to the waiter, which is cancelled before it gets to run
+        gateway._release()
+        assert gateway.in_flight == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert gateway.in_flight == 0
+
+        async def call():
+            return "ok"
+
+        return await asyncio.wait_for(gateway.submit(call), timeout=1)
+
+    assert asyncio.run(main()) == "ok"
+    assert gateway.in_flight == 0
+
+
+def test_call_cancelled_while_queued_never_takes_a_slot():
+    gateway = make_gateway(max_concurrency=1)
+    ran = []
+
+    async def main():
+        await gateway._acquire(PRIORITY_SUMMARY, 0)
+
+        async def call():
+            ran.append(1)
+
+        queued = asyncio.create_task(gateway.submit(call))
+        await asyncio.sleep(0)
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        gateway._release()
+
+    asyncio.run(main())
+    assert ran == []
+    assert gateway.in_flight == 0
+    assert gateway.stats()["queued"] == 0
+
+
+class StatusError(Exception):
+    def __init__(self, status: str):
+        super().__init__(f"request failed: {status}")
+        self.status = status
+
+
+def wrapped(cause: BaseException) -> Exception:
+    try:
+        raise cause
+    except BaseException as e:
+        try:
+            raise RuntimeError("LLM call failed") from e
+        except RuntimeError as outer:
+            return outer
+
+
+@pytest.mark.parametrize(
+    "error, expected",
+    [
+        (ProviderError(503), 503),
+        (StatusError("RESOURCE_EXHAUSTED"), 429),
+        (Exception("429 RESOURCE_EXHAUSTED. Quota exceeded"), 429),
+        (Exception('{"error": {"code": 503, "message": "The model is overloaded"}}'), 503),
+        (Exception("HTTP status=502 from upstream"), 502),
+        (wrapped(ProviderError(429)), 429),
+    ],
+)
+def test_status_code_of_provider_errors(error, expected):
+    assert status_code(error) == expected
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        "Prompt has 4290 tokens, the limit is 4096",
+        "Input of 429 tokens is too short",
+        "Request 7f500a3c rejected: invalid schema",
+        "Could not fetch https://example.com/page/503/comments",
+        "Response was 1500 characters, expected JSON",
+        "Internal representation is invalid",
+    ],
+)
+def test_numbers_in_messages_are_not_statuses(message):
+    assert status_code(Exception(message)) is None
+    assert status_code(wrapped(ValueError(message))) is None
+
+
+def test_errors_without_a_status_are_not_retried():
+    gateway = make_gateway(decrease_cooldown=0)
+    attempts = []
+
+    async def call():
+        attempts.append(1)
+        raise ValueError("Output has 503 tokens, schema expects at most 500")
+
+    with pytest.raises(ValueError):
+        asyncio.run(gateway.submit(call))
+    assert len(attempts) == 1
+    assert gateway.concurrency_limit == gateway.max_concurrency
@@ -0,0 +1,119 @@
+import asyncio
+
+from prefetch import Prefetcher
+
+
+class Browser:
+    """fetch() for the prefetcher, each page waits for `gate` and records its url"""
+
+    def __init__(self):
+        self.started = []
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def fetch(self, urls):
+        self.started.extend(urls)
+        await self.gate.wait()
+        return [{"url": url, "text": f"page {url}"} for url in urls]
+
+
+async def settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+def test_prefetched_pages_are_hits_and_the_rest_misses():
+    async def main():
+        browser = Browser()
+        prefetcher = Prefetcher(browser.fetch, max_cached=8)
+        prefetcher.schedule(["https://a", "https://b"])
+        await settle()
+        browser.gate.clear()
+        prefetcher.schedule(["https://c"])
+        await settle()  # c is in flight
+        pages = prefetcher.take(["https://a", "https://c", "https://never-scheduled"])
+        browser.gate.set()
+        await settle()
+        cached = list(prefetcher.cache)
+        await prefetcher.close()
+        return pages, cached, prefetcher.stats()
+
+    pages, cached, stats = asyncio.run(main())
+    assert list(pages) == ["https://a"]
+    assert cached == ["https://b"]  # c came back after it was asked for, not kept
+    assert (stats["hits"], stats["fetched"]) == (1, 3)
+    assert stats["hit_rate"] == 0.5  # a hit, c missed, the unscheduled url doesn't count
+    assert stats["wasted"] == 2  # b was never asked for, c arrived after it was
+
+
+def test_foreground_scrape_preempts_the_page_in_flight():
+    async def main():
+        browser = Browser()
+        browser.gate.clear()
+        prefetcher = Prefetcher(browser.fetch, max_cached=8)
+        prefetcher.schedule(["https://a", "https://b"])
+        await settle()
+        assert browser.started == ["https://a"]
+
+        async with prefetcher.foreground():
+            await settle()
+            assert browser.started == ["https://a"]  # Nothing new starts during a foreground scrape
+            assert list(prefetcher.queue) == ["https://a", "https://b"]  # Back at the front
+        browser.gate.set()
+        await settle()
+        pages = prefetcher.take(["https://a", "https://b"])
+        await prefetcher.close()
+        return browser.started, pages, prefetcher.stats()
+
+    started, pages, stats = asyncio.run(main())
+    assert started == ["https://a", "https://a", "https://b"]
+    assert set(pages) == {"https://a", "https://b"}
+    assert (stats["preempted"], stats["hits"], stats["wasted"]) == (1, 2, 0)
+
+
+def test_page_asked_for_during_preemption_is_not_fetched_again():
+    async def main():
+        browser = Browser()
+        browser.gate.clear()
+        prefetcher = Prefetcher(browser.fetch, max_cached=8)
+        prefetcher.schedule(["https://a"])
+        await settle()
+        async with prefetcher.foreground():
+            assert prefetcher.take(["https://a"]) == {}  # The foreground scrape fetches it itself
+        browser.gate.set()
+        await settle()
+        queued = list(prefetcher.queue)
+        await prefetcher.close()
+        return browser.started, queued, prefetcher.misses
+
+    started, queued, misses = asyncio.run(main())
+    assert started == ["https://a"]
+    assert queued == [] and misses == 1
+
+
+def test_cache_keeps_the_newest_pages():
+    async def main():
+        browser = Browser()
+        prefetcher = Prefetcher(browser.fetch, max_cached=2)
+        for url in ("https://a", "https://b", "https://c"):
+            prefetcher.schedule([url])
+            await settle()
+        pages = prefetcher.take(["https://a", "https://b", "https://c"])
+        await prefetcher.close()
+        return pages, prefetcher.stats()
+
+    pages, stats = asyncio.run(main())
+    assert set(pages) == {"https://b", "https://c"}
+    assert (stats["wasted"], stats["hits"]) == (1, 2)
+
+
+def test_no_cache_no_prefetching():
+    async def main():
+        browser = Browser()
+        prefetcher = Prefetcher(browser.fetch, max_cached=0)
+        prefetcher.schedule(["https://a"])
+        await settle()
+        await prefetcher.close()
+        return browser.started
+
+    assert asyncio.run(main()) == []
@@ -0,0 +1,61 @@
+import pytest
+
+from query_registry import QueryRegistry, query_terms, similarity
+from research_node import ResearchNode
+
+
+def score(a: str, b: str) -> float:
+    return similarity(query_terms(a), query_terms(b))
+
+
+@pytest.mark.parametrize(
+    "a, b",
+    [
+        ("tesla model 3 pricing 2025", "Tesla Model 3 price 2025"),
+        ("database optimisation techniques", "database optimization techniques"),
+        ("history of the roman empire", "roman empire history"),
+    ],
+)
+def test_rewordings_are_duplicates(a, b):
+    assert score(a, b) >= 0.8
+
+
+@pytest.mark.parametrize(
+    "a, b",
+    [
+        ("tesla model 3", "tesla model y"),
+        ("battery recycling", "solar panel efficiency"),
+        ("python asyncio", "python threading"),
+    ],
+)
+def test_different_questions_are_not(a, b):
+    assert score(a, b) < 0.8
+
+
+def test_short_terms_need_an_exact_match():
+    assert score("gpu ram", "cpu ram") == pytest.approx(0.5)
+
+
+def test_registry_matches_the_closest_query_from_the_threshold():
+    master = ResearchNode("electric cars")
+    pricing = master.add_child("tesla model 3 pricing")
+    master.add_child("tesla model 3 range")
+    registry = QueryRegistry.from_tree(master)
+
+    assert registry.match("tesla model 3 price") is pricing
+    assert registry.match("tesla model 3 safety rating") is None
+    assert registry.match("electric cars") is None  # The master topic is not a search query
+
+    registry.skip("tesla model 3 price", pricing)
+    assert registry.stats()["skipped"] == 1
+    assert registry.stats()["duplicates"] == [{"query": "tesla model 3 price", "duplicate_of": "tesla model 3 pricing"}]
+
+
+def test_threshold_is_configurable():
+    master = ResearchNode("electric cars")
+    model_3 = master.add_child("tesla model 3")
+    registry = QueryRegistry.from_tree(master)
+    registry.threshold = 0.6
+    assert registry.match("tesla model y") is model_3
+    registry.threshold = 0
+    assert registry.match("tesla model 3") is None
@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+from scheduler import ResearchScheduler, SchedulerFull
+
+
+def grant_order(scheduler: ResearchScheduler, tickets: dict) -> list:
+    """Names of `tickets` in the order they start, releasing each as soon as it runs"""
+    order = []
+    while len(order) < len(tickets):
+        started = [name for name, ticket in tickets.items() if ticket.granted.done() and name not in order]
+        assert len(started) == 1
+        order.append(started[0])
+        scheduler.release(tickets[started[0]])
+    return order
+
+
+def test_users_take_turns():
+    async def main():
+        scheduler = ResearchScheduler(max_concurrency=1, max_queued=10, max_per_user=3)
+        first = scheduler.submit("alice")
+        tickets = {name: scheduler.submit(name.split()[0]) for name in ("alice 2", "alice 3", "bob 1", "carol 1", "bob 2")}
+        assert [t.position for t in tickets.values()] == [3, 5, 1, 2, 4]
+
+        scheduler.release(first)
+        return grant_order(scheduler, tickets)
+
+    assert asyncio.run(main()) == ["bob 1", "carol 1", "alice 2", "bob 2", "alice 3"]
+
+
+def test_priority_comes_before_fairness():
+    async def main():
+        scheduler = ResearchScheduler(max_concurrency=1, max_queued=10, max_per_user=3)
+        first = scheduler.submit("alice")
+        tickets = {"bob": scheduler.submit("bob", priority=1), "alice": scheduler.submit("alice", priority=0)}
+        scheduler.release(first)
+        return grant_order(scheduler, tickets)
+
+    assert asyncio.run(main()) == ["alice", "bob"]
+
+
+def test_admission_limits():
+    async def main():
+        scheduler = ResearchScheduler(max_concurrency=1, max_queued=3, max_per_user=2)
+        scheduler.submit("alice")
+        scheduler.submit("alice")
+        scheduler.submit("alice")
+        with pytest.raises(SchedulerFull) as user_limit:
+            scheduler.submit("alice")
+        scheduler.submit("bob")
+        with pytest.raises(SchedulerFull) as queue_full:
+            scheduler.submit("carol")
+        return user_limit.value.reason, queue_full.value.reason, scheduler.stats()
+
+    user_limit, queue_full, stats = asyncio.run(main())
+    assert (user_limit, queue_full) == ("user_limit", "queue_full")
+    assert stats["running"] == 1 and stats["queued"] == 3
+
+
+def test_cancelled_waiting_run_leaves_the_queue():
+    async def main():
+        scheduler = ResearchScheduler(max_concurrency=1, max_queued=10, max_per_user=3)
+        first = scheduler.submit("alice")
+        cancelled = scheduler.submit("bob")
+        waiting = scheduler.submit("carol")
+        scheduler.release(cancelled)
+        assert cancelled.granted.cancelled()
+        assert waiting.position == 1
+        scheduler.release(first)
+        return waiting.granted.done(), scheduler.stats()
+
+    granted, stats = asyncio.run(main())
+    assert granted
+    assert stats["queued"] == 0
@@ -0,0 +1,157 @@
+"""
+Research worker, runs queued jobs from the shared job store (KNET_JOB_STORE) in its own process.
+
+    KNET_JOB_STORE=sqlite:///jobs.db python worker.py --slots 2
+
+Start as many workers as the box allows, the API processes (app.py with the same KNET_JOB_STORE)
+only enqueue jobs and relay their events to the right client.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import time
+
+from dotenv import load_dotenv
+
+from artifact_store import get_artifact_store
+from budget import RunBudget
+from cancellation import cancel_and_wait
+from event_queue import OutboundQueue
+from job_store import CANCELLED, DONE, FAILED, JobStore, get_job_store
+from knet import KNet
+from scraper import CrawlForAIScraper
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+KIND = "knet"
+
+
+class Worker:
+    def __init__(self, store: JobStore, worker_id: str, slots: int = 1, poll_interval: float = 0.5, stale_after: float = 60, retention: float = 86400):
+        self.store = store
+        self.worker_id = worker_id
+        self.slots = slots
+        self.poll_interval = poll_interval  # Seconds between queue polls and control checks
+        self.stale_after = stale_after  # Running jobs without a heartbeat for this long are failed
+        self.retention = retention  # Finished jobs and their events are kept this long
+
+    async def run(self):
+        logger.info(f"Worker {self.worker_id} started with {self.slots} slot(s)")
+        await asyncio.gather(*(self.slot(i) for i in range(self.slots)), self.janitor())
+
+    async def slot(self, index: int):
+        # One browser and KNet per slot, reused across jobs
+        scraper = CrawlForAIScraper()
+        await scraper.start()
+        knet = KNet(scraper)
+        try:
+            while True:
+                job = await self.store.claim(f"{self.worker_id}/{index}", KIND)
+                if job is None:
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                await self.run_job(knet, job)
+        finally:
+            await scraper.close()
+
+    async def run_job(self, knet: KNet, job: dict):
+        job_id, params = job["id"], job["params"]
+        logger.info(f"Running job {job_id}.\nTopic '{params['topic']}'")
+
+        # Coalesces statuses before they hit the store, same as it would before the socket
+        queue = OutboundQueue(lambda event, data: self.store.append_event(job_id, event, data))
+
+        async def progress_callback(status: dict):
+            queue.put("status", status)
+
+        task = asyncio.create_task(
+            knet.conduct_research(
+                params["topic"],
+                progress_callback,
+                params["max_depth"],
+                params["num_sites_per_query"],
+                params.get("fused_planner"),
+                job_id=job_id,
+                budget=RunBudget.from_params(params.get("budget")),
+            )
+        )
+        watcher = asyncio.create_task(self.watch(job_id, knet, task))
+        try:
+            await asyncio.wait([task, watcher], return_when=asyncio.FIRST_COMPLETED)
+            if task.cancelling():
+                # Aborted (see watch). Bounded: a run stuck in the browser gets it closed under it, the next scrape starts a new one
+                started = time.monotonic()
+                if await cancel_and_wait(task, force=knet.scraper.close):
+                    logger.info(f"Job {job_id} stopped {time.monotonic() - started:.2f}s after the abort was seen")
+                else:
+                    logger.error(f"Job {job_id} still running {time.monotonic() - started:.2f}s after being cancelled")
+            await asyncio.wait([task])
+        except asyncio.CancelledError:
+            # Worker is shutting down
+            task.cancel()
+            await self.store.finish(job_id, FAILED, error="Research worker shut down")
+            raise
+        finally:
+            watcher.cancel()
+
+        await queue.flush()
+        await queue.close()
+        if task.cancelled():
+            await self.store.finish(job_id, CANCELLED)
+        elif task.exception() is not None:
+            logger.error(f"Job {job_id} failed: {str(task.exception())}")
+            await self.store.finish(job_id, FAILED, error=str(task.exception()))
+        else:
+            result = task.result()
+            await self.store.finish(job_id, DONE if result else CANCELLED, result=result or None)
+        logger.info(f"Job {job_id} finished")
+
+    async def watch(self, job_id: str, knet: KNet, task: asyncio.Task):
+        # Heartbeat, plus abort and snapshot requests from the API process
+        snapshot = 0
+        while not task.done():
+            await asyncio.sleep(self.poll_interval)
+            await self.store.heartbeat(job_id)
+            controls = await self.store.controls(job_id)
+            if controls["cancel"]:
+                logger.info(f"Job {job_id} cancelled")
+                task.cancel()
+                return
+            if controls["snapshot"] != snapshot:
+                snapshot = controls["snapshot"]
+                if knet.progress:
+                    await knet.progress.snapshot()
+
+    async def janitor(self):
+        while True:
+            failed = await self.store.fail_stale(self.stale_after)
+            purged = await self.store.purge(self.retention)
+            await get_artifact_store().cleanup()
+            if failed or purged:
+                logger.info(f"Failed {failed} stale job(s), purged {purged} finished job(s)")
+            await asyncio.sleep(60)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="KnowledgeNet research worker")
+    parser.add_argument("--slots", type=int, default=int(os.getenv("KNET_WORKER_SLOTS", 1)), help="Research runs executing at once in this process")
+    args = parser.parse_args()
+
+    store = get_job_store()
+    if store is None:
+        raise SystemExit("KNET_JOB_STORE is not set, e.g. KNET_JOB_STORE=sqlite:///jobs.db")
+
+    worker = Worker(
+        store,
+        f"{socket.gethostname()}:{os.getpid()}",
+        slots=args.slots,
+        stale_after=float(os.getenv("KNET_JOB_STALE_AFTER", 60)),
+        retention=float(os.getenv("KNET_JOB_RETENTION", 86400)),
+    )
+    asyncio.run(worker.run())
@@ -356,6 +356,11 @@ const Message = ({ message, isLoading, lastProgressMessage, setLastProgressMessa
                     <div className="h-2 w-2 rounded-full bg-primary-foreground mr-0.5 animate-pulse"></div>
                   </div>
                 </div>
+                {message.report_preview && (
+                  <ReactMarkdown remarkPlugins={[remarkGfm]} components={MarkdownComponents}>
+                    {message.report_preview}
+                  </ReactMarkdown>
+                )}
               </div>
             ) : (
               <>
@@ -0,0 +1,25 @@
+// Compressed frames sent by the backend for large events, see backend/compression.py
+export interface CompressedFrame {
+  codec: "deflate" | "zstd";
+  encoding: "json" | "msgpack";
+  data: ArrayBuffer | Uint8Array | string; // base64 string over SSE
+}
+
+// Codecs this client can decode, sent with start_research
+export const SUPPORTED_CODECS = typeof DecompressionStream !== "undefined" ? ["deflate"] : [];
+
+const isCompressedFrame = (payload: unknown): payload is CompressedFrame =>
+  typeof payload === "object" && payload !== null && "codec" in payload && "data" in payload;
+
+const toBytes = (data: CompressedFrame["data"]): Uint8Array =>
+  typeof data === "string" ? Uint8Array.from(atob(data), (c) => c.charCodeAt(0)) : new Uint8Array(data);
+
+// Returns the payload as is, or inflated and parsed when it came as a compressed frame
+export const decodePayload = async <T>(payload: T | CompressedFrame): Promise<T> => {
+  if (!isCompressedFrame(payload)) return payload as T;
+  if (payload.codec !== "deflate" || payload.encoding !== "json") {
+    throw new Error(`Unsupported payload ${payload.codec}/${payload.encoding}`);
+  }
+  const stream = new Blob([toBytes(payload.data)]).stream().pipeThrough(new DecompressionStream("deflate"));
+  return JSON.parse(await new Response(stream).text()) as T;
+};
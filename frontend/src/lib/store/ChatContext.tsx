@@ -1,9 +1,10 @@
 "use client";
 
-import { ChatData, ChatState, Conversation, Message, ResearchOptions, ResearchResults, ResearchTree, StatusUpdate } from "@/lib/types";
+import { ChatData, ChatState, Conversation, Message, ReportDelta, ResearchOptions, ResearchResults, ResearchTree, StatusUpdate, TreeDelta } from "@/lib/types";
 import { ReactNode, createContext, useCallback, useContext, useEffect, useRef, useState } from "react";
 import { v4 as uuidv4 } from "uuid";
 import { disconnectSocket, getSocket, initializeSocket } from "@/lib/socket";
+import { CompressedFrame, SUPPORTED_CODECS, decodePayload } from "@/lib/compression";
 
 // Utility functions for local storage
 const saveToStorage = (data: ChatData) => {
@@ -12,6 +13,41 @@ const saveToStorage = (data: ChatData) => {
   }
 };
 
+// Append a streamed report chunk to the in-progress preview
+const applyReportDelta = (message: Message | undefined, delta?: ReportDelta): Pick<Message, "report_preview" | "report_section"> => {
+  if (!delta) return { report_preview: message?.report_preview, report_section: message?.report_section };
+  if (delta.index === -1) return { report_preview: `# ${delta.heading}\n\n`, report_section: -1 };
+
+  let preview = message?.report_preview ?? "";
+  if (delta.index !== message?.report_section) preview += `\n\n## ${delta.heading}\n\n`;
+  return { report_preview: preview + delta.delta, report_section: delta.index };
+};
+
+// Apply research_tree_delta ops on the last known tree, undefined if the versions do not line up
+const applyTreeDelta = (tree: ResearchTree | undefined, version: number | undefined, delta: TreeDelta): ResearchTree | undefined => {
+  if (!tree || version !== delta.base) return undefined;
+
+  const root: ResearchTree = structuredClone(tree);
+  const index = new Map<string, ResearchTree>();
+  const collect = (node: ResearchTree) => {
+    if (node.id) index.set(node.id, node);
+    node.children.forEach(collect);
+  };
+  collect(root);
+
+  for (const op of delta.ops) {
+    if (op.op === "node") {
+      const child: ResearchTree = { id: op.id, query: op.query, depth: op.depth, sources: {}, children: [] };
+      index.get(op.parent)?.children.push(child);
+      index.set(op.id, child);
+    } else if (op.op === "sources") {
+      const node = index.get(op.id);
+      if (node) node.sources = { ...node.sources, ...op.sources };
+    }
+  }
+  return root;
+};
+
 const loadFromStorage = (): ChatData => {
   if (typeof window === "undefined") {
     return { conversations: [], currentConversationId: null };
@@ -145,15 +181,31 @@ export const ChatProvider = ({ children }: { children: ReactNode }) => {
         const lastProgressIndex = messages.findLastIndex((msg) => msg.role === "assistant" && msg.isProgress === true);
 
         if (lastProgressIndex !== -1) {
+          const previous = messages[lastProgressIndex];
+          let research_tree = data.research_tree ?? previous.research_tree;
+          let tree_version = data.tree_version ?? previous.tree_version;
+          if (data.research_tree_delta) {
+            research_tree = applyTreeDelta(previous.research_tree, previous.tree_version, data.research_tree_delta);
+            tree_version = data.research_tree_delta.version;
+            if (!research_tree) {
+              // Missed an update, keep the old tree until the snapshot arrives
+              research_tree = previous.research_tree;
+              tree_version = previous.tree_version;
+              socket.emit("tree_snapshot");
+            }
+          }
           // Update existing progress message with research_tree data
           messages[lastProgressIndex] = {
-            ...messages[lastProgressIndex],
+            ...previous,
             content: progressText,
             progress: progress,
             timestamp: new Date(),
-            research_tree: data.research_tree, // Update the research_tree in real-time
+            research_tree, // Update the research_tree in real-time
+            tree_version,
+            ...applyReportDelta(previous, data.report_delta),
           };
         } else {
+          if (data.research_tree_delta) socket.emit("tree_snapshot"); // Deltas without a base tree
           // Add new progress message with research_tree
           messages.push({
             id: uuidv4(),
@@ -163,6 +215,8 @@ export const ChatProvider = ({ children }: { children: ReactNode }) => {
             progress: progress,
             isProgress: true,
             research_tree: data.research_tree, // Include the research_tree
+            tree_version: data.tree_version,
+            ...applyReportDelta(undefined, data.report_delta),
             media: {}, // Initialize empty media object
           });
         }
@@ -175,7 +229,15 @@ export const ChatProvider = ({ children }: { children: ReactNode }) => {
       });
     });
 
-    socket.on("research_complete", (results: ResearchResults) => {
+    socket.on("research_complete", async (payload: ResearchResults | CompressedFrame) => {
+      let results: ResearchResults;
+      try {
+        results = await decodePayload(payload);
+      } catch (error) {
+        console.error("Failed to decode research results", error);
+        setChatState((prevState) => ({ ...prevState, isLoading: false, error: "Failed to decode research results" }));
+        return;
+      }
       setChatState((prevState) => {
         const messages = [...prevState.messages];
 
@@ -332,6 +394,7 @@ export const ChatProvider = ({ children }: { children: ReactNode }) => {
           topic: content,
           max_depth: researchOptions.max_depth,
           num_sites_per_query: researchOptions.num_sites_per_query,
+          compression: SUPPORTED_CODECS, // Large results come deflated when supported
         });
       } catch (error) {
         setChatState((prevState) => ({
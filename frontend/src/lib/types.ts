@@ -8,8 +8,11 @@ export interface Message {
     images?: string[];
   };
   research_tree?: ResearchTree;
+  tree_version?: number; // Version of research_tree, research_tree_delta events apply on top of it
   progress?: number;
   isProgress?: boolean;
+  report_preview?: string; // Report text streamed so far, shown while the research is in progress
+  report_section?: number; // Index of the section the preview is currently streaming
 }
 
 export interface ChatState {
@@ -39,10 +42,29 @@ export interface Conversation {
   active: boolean;
 }
 
+export interface ReportDelta {
+  index: number; // -1 carries the title and (re)starts the report
+  heading: string;
+  delta: string;
+}
+
+export type TreeOp =
+  | { op: "node"; id: string; parent: string; query: string; depth: number }
+  | { op: "sources"; id: string; sources: Record<string, string> }; // url -> title
+
+export interface TreeDelta {
+  base: number; // Version the ops apply to
+  version: number;
+  ops: TreeOp[];
+}
+
 export interface StatusUpdate {
   message: string;
   progress: number;
-  research_tree: ResearchTree;
+  research_tree?: ResearchTree; // Full outline, sent first and on snapshot requests
+  tree_version?: number;
+  research_tree_delta?: TreeDelta;
+  report_delta?: ReportDelta;
 }
 
 // Simplified research results based on actual server output
@@ -63,9 +85,10 @@ export interface ResearchResults {
 }
 
 export interface ResearchTree {
+  id?: string;
   query: string;
   depth: number;
-  sources: Record<string, string>; // it's like { "https://...": "Webpage text..." }
+  sources: Record<string, string>; // it's like { "https://...": "Webpage text..." }, url -> title while in progress
   children: ResearchTree[];
 }
 
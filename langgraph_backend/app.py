@@ -1,38 +1,54 @@
 import asyncio
 import copy
-import json
 import logging
 import os
+import time
+from contextlib import aclosing
 from datetime import datetime
-from typing import Annotated, Any, Dict, List, Literal, Optional, TypedDict
+from typing import Annotated, Any, AsyncIterator, Callable, Dict, List, Literal, Optional, TypedDict
 
 from dotenv import load_dotenv
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from langchain_google_genai import ChatGoogleGenerativeAI
+from fastapi.responses import JSONResponse, StreamingResponse
 from langgraph.config import get_stream_writer
 from langgraph.graph import END, StateGraph
 from langgraph.types import Command, StreamWriter
 from sse_starlette.sse import EventSourceResponse
 
+from accounting import RunAccounting
+from artifact_store import get_artifact_store
+from budget import RunBudget
+from cancellation import AbortStats, abort_timeout, cancel_and_wait
+from checkpoints import checkpointed, get_checkpointer
+from compression import frame, negotiate_codec
+from event_stream import StreamRegistry, parse_event_id
+from job_store import CANCELLED, DONE, FAILED, FINISHED, QUEUED, get_job_store
+from link_index import LinkIndex, crawl_mode
+from llm_gateway import PRIORITY_BRANCH, PRIORITY_PLAN, PRIORITY_REPORT, PRIORITY_SUMMARY, estimate_tokens, get_gateway
+from llm_provider import LLMResponse, get_provider
 from prompts import (
     CONTINUE_BRANCH_PROMPT,
+    NEXT_ACTION_PROMPT,
     REPORT_FILLIN_PROMPT,
     REPORT_OUTLINE_PROMPT,
     RESEARCH_PLAN_PROMPT,
     SEARCH_QUERY_PROMPT,
     SITE_SUMMARY_PROMPT,
 )
+from query_registry import QueryRegistry
+from research_cache import ResultCache, request_key
 from research_node import ResearchNode
 from schema import (
     ContinueBranch,
-    ReportFillin,
+    NextAction,
     ReportOutline,
     ResearchPlan,
     SearchQuery,
 )
 from scraper import CrawlForAIScraper
+from scheduler import SchedulerFull, get_scheduler
+from serialization import dumpb, dumps
 
 load_dotenv()
 
@@ -54,56 +70,183 @@ app.add_middleware(
 
 # Session management (in-memory for now)
 sessions: Dict[str, Dict[str, Any]] = {}
+# SSE events that carry the full report and tree
+COMPRESSED_EVENTS = {"result"}
+# Set (KNET_JOB_STORE): research runs in worker.py processes, this process only enqueues and relays events
+job_store = get_job_store()
+# Event ids and replay buffers of the runs streamed by this process, clients re-attach with Last-Event-ID
+streams = StreamRegistry()
+JOB_KIND = "langgraph"
+# Completed reports by request key, and the run streaming here for each key, identical requests share one run
+result_cache = ResultCache()
+flights: Dict[str, str] = {}
+# Time from /abort_research until the run stopped
+abort_stats = AbortStats()
 
 
 @app.get("/health")
 async def health_check():
-    return {"status": "ok"}
+    return {"status": "ok", "aborts": abort_stats.stats()}
+
+
+# --- LLM provider setup (Gemini by default, LLM_PROVIDER=stub for load tests) ---
+provider = get_provider()
+
+
+def current_vertical(state: "ResearchState") -> Optional[str]:
+    plan = state.get("research_plan") or []
+    return plan[state["idx_research_plan"]] if state.get("idx_research_plan", 0) < len(plan) else None
+
+
+async def generate(
+    prompt: str,
+    schema: Optional[type] = None,
+    temperature: Optional[float] = None,
+    priority: int = PRIORITY_SUMMARY,
+    state: Optional["ResearchState"] = None,
+    stage: str = "llm",
+    node: Optional[ResearchNode] = None,
+):
+    # Rate limited, prioritized and retried on 429/5xx by the shared gateway
+    trace = {"retries": 0, "queued": 0.0}
+    started = time.monotonic()
+    response: LLMResponse = await get_gateway().submit(
+        lambda: provider.generate(prompt, schema=schema, temperature=temperature),
+        priority=priority,
+        est_tokens=estimate_tokens(prompt),
+        count_tokens=lambda r: r.total_tokens,
+        trace=trace,
+    )
+    if state is not None:
+        state["accounting"].record_llm(
+            stage,
+            response.input_tokens,
+            response.output_tokens,
+            latency=time.monotonic() - started - trace["queued"],
+            retries=trace["retries"],
+            queued=trace["queued"],
+            vertical=current_vertical(state),
+            node_id=node.id if node else None,
+        )
+    return response.content
+
+
+async def stream_generate(
+    prompt: str, temperature: Optional[float] = None, priority: int = PRIORITY_REPORT, state: Optional["ResearchState"] = None, stage: str = "llm"
+) -> AsyncIterator[str]:
+    # Plain text generation yielded chunk by chunk, through the same gateway
+    trace = {"retries": 0, "queued": 0.0}
+    started = time.monotonic()
+    input_tokens, output_tokens = 0, 0
+    chunks = get_gateway().stream(
+        lambda: provider.stream(prompt, temperature=temperature), priority=priority, est_tokens=estimate_tokens(prompt), trace=trace
+    )
+    try:
+        async with aclosing(chunks):
+            async for chunk in chunks:
+                input_tokens += chunk.input_tokens
+                output_tokens += chunk.output_tokens
+                if chunk.content:
+                    yield chunk.content
+    finally:
+        if state is not None:
+            state["accounting"].record_llm(
+                stage,
+                input_tokens,
+                output_tokens,
+                latency=time.monotonic() - started - trace["queued"],
+                retries=trace["retries"],
+                queued=trace["queued"],
+                vertical=current_vertical(state),
+            )
 
 
-# --- LangChain LLM setup (Gemini, correct usage) ---
-llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash", google_api_key=os.getenv("GOOGLE_API_KEY"))
+async def strip_heading(chunks: AsyncIterator[str], heading: str) -> AsyncIterator[str]:
+    # Remove heading if LLM put it there regardless, only the start of the stream is held back
+    head, buffering = "", True
+    async with aclosing(chunks):  # Closing this closes the LLM stream too
+        async for chunk in chunks:
+            if not buffering:
+                yield chunk
+                continue
+            head += chunk
+            if len(head) > len(heading) + 16:
+                buffering = False
+                yield after_heading(head, heading)
+    if buffering and head:
+        yield after_heading(head, heading)
+
+
+def after_heading(text: str, heading: str) -> str:
+    idx_heading = text.find(heading)
+    return text[idx_heading + len(heading) :].lstrip("# \n") if idx_heading != -1 else text.lstrip()
+
+
+def format_findings(node: ResearchNode) -> str:
+    # src [1] : https://...
+    # content...
+    return "\n\n---\n\n".join([f"src [{i + 1}] : {d['url']}\n{d['text']}" for i, d in enumerate(node.pages(fields=("url", "text")))])
 
 
 class ResearchProgress:
     def __init__(self):  # Removed master_node from __init__
         self.progress = 0
+        self.tree_version: Optional[int] = None  # Last tree version sent on this stream, None -> snapshot next
 
     def send(self, writer: StreamWriter, progress: int, message: dict, ptype: str, master_node_for_send: ResearchNode = None):
         if ptype == "update":
             self.progress = int(min(100, self.progress + progress))  # max 100
-            writer(
-                {"event": "progress", "data": {"progress": self.progress, **message, "research_tree": master_node_for_send.build_tree_structure()}}
-            )
+            writer({"event": "progress", "data": {"progress": self.progress, **message, **self.tree_changes(master_node_for_send)}})
         elif ptype == "setter":
             self.progress = int(min(100, progress))  # max 100
-            writer(
-                {"event": "progress", "data": {"progress": self.progress, **message, "research_tree": master_node_for_send.build_tree_structure()}}
-            )
+            writer({"event": "progress", "data": {"progress": self.progress, **message, **self.tree_changes(master_node_for_send)}})
+        elif ptype == "report_delta":
+            # Partial report text, no tree snapshot so each event stays small
+            writer({"event": "report_delta", "data": {"progress": self.progress, **message}})
         elif ptype == "result":
             self.progress = 100
             writer({"event": "result", "data": message})
 
+    def tree_changes(self, master_node: ResearchNode) -> dict:
+        """Full outline on the first event, only the changes since the last sent version afterwards"""
+        log = master_node.log
+        if self.tree_version is None:
+            self.tree_version = log.version
+            return {"research_tree": master_node.build_tree_outline(), "tree_version": log.version}
+        if log.version == self.tree_version:
+            return {}
+        base, self.tree_version = self.tree_version, log.version
+        return {"research_tree_delta": {"base": base, "version": log.version, "ops": log.since(base)}}
+
 
 # --- State schema for LangGraph ---
 class ResearchState(TypedDict, total=False):
     scraper: CrawlForAIScraper
     progress: ResearchProgress
+    accounting: RunAccounting
+    budget: Optional[RunBudget]  # Deadline and/or token budget, None for an unbounded run
+    links: Optional[LinkIndex]  # Outbound links of the run's pages in crawl mode (KNET_CRAWL_MODE), else None
 
     # Paramters
+    job_id: str  # Key of the run's artifacts
     topic: str
     max_depth: int
     num_sites_per_query: int
+    fused_planner: bool
 
     # Global State
     master_node: ResearchNode
     current_node: ResearchNode
     research_plan: list[str]
     idx_research_plan: int
-    ctx_researcher: list[str]
+    ctx_researcher: list[str]  # ids of scraped nodes
     ctx_manager: list[str]
     raster_report: str
     token_count: int
+    pending_queries: list[str]  # Follow-up queries already chosen by the fused planner
+    skipped_queries: list[dict]  # Near-duplicate queries not searched, {"query", "duplicate_of"}
+    merged: bool  # The last query duplicated an explored node, current_node is that node
+    resume_from: str  # Entry node of a run resumed from its checkpoint
 
 
 async def research_plan_node(state: ResearchState) -> ResearchState:
@@ -111,75 +254,108 @@ async def research_plan_node(state: ResearchState) -> ResearchState:
 
     if len(state["research_plan"]) == 0:
         topic = state["topic"]
-        plan = llm.with_structured_output(ResearchPlan).invoke(RESEARCH_PLAN_PROMPT.format(topic=topic), config={"temperature": 1.5})
+        prompt = RESEARCH_PLAN_PROMPT.format(topic=topic)
+        plan = await generate(prompt, ResearchPlan, temperature=1.5, priority=PRIORITY_PLAN, state=state, stage="plan")
         if "steps" in plan:
             steps = plan["steps"]
 
-        logger.info(f"Research plan:\n{json.dumps(steps, indent=2)}")
+        logger.info(f"Research plan:\n{dumps(steps, indent=True)}")
+        if state.get("budget"):
+            state["budget"].verticals = len(steps)
         state["progress"].send(writer, 0, {"message": "Starting research..."}, ptype="setter", master_node_for_send=state["master_node"])
 
-        return {"research_plan": steps}
+        return {"research_plan": steps, "token_count": state["accounting"].total_tokens}
 
 
 async def scrape_node(state: ResearchState) -> ResearchState:
     # TODO: idx_research_plan index error here
-    query = (
-        llm.with_structured_output(SearchQuery)
-        .invoke(
-            SEARCH_QUERY_PROMPT.format(
-                vertical=state["research_plan"][state["idx_research_plan"]],
-                topic=state["topic"],
-                research_plan="\n".join([f"[done] {step}" for i, step in enumerate(state["research_plan"]) if i < state["idx_research_plan"]]),
-                past_queries="\n".join([f"[done] {query}" for query in state["current_node"].get_path_to_root()[1:]]),
-                ctx_manager="\n\n---\n\n".join(state["ctx_manager"]),
-                n=1,
-            ),
-            config={"temperature": 1.5},
+    pending_queries = state.get("pending_queries") or []
+    if pending_queries:
+        # Fused planner already picked the next query
+        query, pending_queries = pending_queries[0], pending_queries[1:]
+    else:
+        prompt = SEARCH_QUERY_PROMPT.format(
+            vertical=state["research_plan"][state["idx_research_plan"]],
+            topic=state["topic"],
+            research_plan="\n".join([f"[done] {step}" for i, step in enumerate(state["research_plan"]) if i < state["idx_research_plan"]]),
+            past_queries="\n".join([f"[done] {query}" for query in state["current_node"].get_path_to_root()[1:]]),
+            ctx_manager="\n\n---\n\n".join(state["ctx_manager"]),
+            n=1,
         )
-        .get("branches", [""])[0]
+        query = (
+            await generate(prompt, SearchQuery, temperature=1.5, priority=PRIORITY_BRANCH, state=state, stage="query", node=state["current_node"])
+        ).get("branches", [""])[0]
+
+    # A near-duplicate of a query already in the run ends the branch at the node that has its data
+    queries = QueryRegistry.from_tree(state["master_node"], state.get("skipped_queries"))
+    duplicate = queries.match(query)
+    if duplicate is not None:
+        queries.skip(query, duplicate)
+        logger.info(f"Skipping '{query}', near-duplicate of '{duplicate.query}'")
+        return {"current_node": duplicate, "merged": True, "skipped_queries": queries.skipped, "pending_queries": pending_queries}
+
+    # Filled before it is inserted, nodes of a persistent tree version are not changed in place
+    curr_node = ResearchNode(query, store=state["master_node"].store)
+    is_branch = state["current_node"].depth < state["max_depth"]
+
+    sites = state["num_sites_per_query"]
+    if state.get("budget"):
+        sites = state["budget"].sites(sites, state["accounting"].total_tokens, state["idx_research_plan"])
+    started = time.monotonic()
+    data, stage = [], "scrape"
+    # Crawl mode: a follow-up query first tries the links of the pages scraped so far
+    links: Optional[LinkIndex] = state.get("links")
+    if links is not None and is_branch and state["current_node"] is not state["master_node"]:
+        data, stage = await links.follow(state["scraper"], query, sites), "crawl"
+    if not data:
+        data, stage = await state["scraper"].search_and_scrape(query, sites), "scrape"
+    state["accounting"].record_scrape(
+        latency=time.monotonic() - started,
+        pages=len(data),
+        text_bytes=sum(len(d.get("text") or "") for d in data),
+        retries=state["scraper"].last_stats.get("retries", 0),
+        stage=stage,
+        vertical=current_vertical(state),
+        node_id=curr_node.id,
     )
+    curr_node.data = data
 
-    new_master = ResearchNode.deep_copy_tree(state["master_node"])
-    curr_node = ResearchNode(query)
+    # New tree version by path copying, O(depth): the previous master_node stays valid
     # Add a new vertical node
-    if state["current_node"].depth >= state["max_depth"]:
-        new_master.add_child(curr_node.query, node=curr_node)
+    if not is_branch:
+        new_master = state["master_node"].with_child(state["master_node"].id, curr_node)
     # Add a branch to the current node
     else:
-        old_curr_node = new_master.find_node(state["current_node"].id)
-        old_curr_node.add_child(curr_node.query, node=curr_node)
-
-    data = await state["scraper"].search_and_scrape(query, state["num_sites_per_query"])
-    curr_node.data = data
-    # Add data to context
-    # src [1] : https://...
-    # content...
-    upd_ctx_researcher = state["ctx_researcher"] + ["\n\n---\n\n".join([f"src [{i + 1}] : {d['url']}\n{d['text']}" for i, d in enumerate(data)])]
-    return {"ctx_researcher": upd_ctx_researcher, "master_node": new_master, "current_node": curr_node}
+        new_master = state["master_node"].with_child(state["current_node"].id, curr_node)
+    if links is not None:
+        links.add(curr_node)
+    # Add data to context by reference, page bodies are stored once in the content store
+    upd_ctx_researcher = state["ctx_researcher"] + [curr_node.id]
+    return {
+        "ctx_researcher": upd_ctx_researcher,
+        "master_node": new_master,
+        "current_node": curr_node,
+        "pending_queries": pending_queries,
+        "merged": False,
+        "token_count": state["accounting"].total_tokens,
+    }
 
 
 async def summarize_node(state: ResearchState) -> ResearchState:
     # Generate summary of key findings into the manager's context
     upd_ctx_manager = state["ctx_manager"]
-    if state["current_node"].data:
+    if state["current_node"].data and not state.get("merged"):  # A merged node was summarized when it was scraped
         for idx in range(0, len(state["current_node"].data), 3):
-            summary = llm.invoke(
-                SITE_SUMMARY_PROMPT.format(query=state["current_node"].query, findings=state["ctx_researcher"][-1]), config={"temperature": 0.2}
-            ).text()
+            prompt = SITE_SUMMARY_PROMPT.format(query=state["current_node"].query, findings=format_findings(state["current_node"]))
+            summary = await generate(prompt, temperature=0.2, priority=PRIORITY_SUMMARY, state=state, stage="summary", node=state["current_node"])
             upd_ctx_manager.append(summary)
-    return {"ctx_manager": upd_ctx_manager}
+    return {"ctx_manager": upd_ctx_manager, "token_count": state["accounting"].total_tokens}
 
 
 async def should_continue_node(state: ResearchState) -> Command[Literal["plan", "scrape", "gen_report"]]:
-    print(  # TODO: Remove this print statement
-        json.dumps(
-            {
-                "current_node": {"query": state["current_node"].query, "depth": state["current_node"].depth},
-                "max_depth": state["max_depth"],
-                "idx_research_plan": state["idx_research_plan"],
-            },
-            indent=2,
-        )
+    logger.debug(
+        f"should_continue: '{state['current_node'].query}' (depth {state['current_node'].depth}/{state['max_depth']}), "
+        f"step {state['idx_research_plan']}"
     )
     writer = get_stream_writer()
     target_progress_for_step = (state["idx_research_plan"] + 1) * (100.0 / (len(state["research_plan"]) if state["research_plan"] else 1))
@@ -191,6 +367,29 @@ async def should_continue_node(state: ResearchState) -> Command[Literal["plan",
         master_node_for_send=state["master_node"],
     )
 
+    # Budget: past the exploration share go to the report, past the vertical's share on to the next vertical
+    budget: Optional[RunBudget] = state.get("budget")
+    if budget and budget.explore_done(state["accounting"].total_tokens):
+        budget.skipped["verticals"] += len(state["research_plan"]) - state["idx_research_plan"] - 1
+        logger.info(f"Budget for exploration used up ({budget.stopped}), skipping to the report")
+        return Command(goto="gen_report")
+    if (
+        budget
+        and state["current_node"].depth < state["max_depth"]
+        and not budget.can_branch(state["accounting"].total_tokens, state["idx_research_plan"])
+    ):
+        if state["idx_research_plan"] >= len(state["research_plan"]) - 1:
+            return Command(goto="gen_report")
+        return Command(goto="plan", update={"idx_research_plan": state["idx_research_plan"] + 1, "current_node": state["master_node"]})
+
+    # The branch ended on a node explored earlier, the vertical is covered as far as it goes
+    if state.get("merged"):
+        if state["idx_research_plan"] >= len(state["research_plan"]) - 1:
+            return Command(goto="gen_report")
+        return Command(
+            goto="plan", update={"idx_research_plan": state["idx_research_plan"] + 1, "current_node": state["master_node"], "pending_queries": []}
+        )
+
     # If max depth is reached and we are at the last step of the research plan, generate report
     if state["current_node"].depth >= state["max_depth"] and state["idx_research_plan"] >= len(state["research_plan"]) - 1:
         logger.info(f"Branch decision '{state['current_node'].query}': False")
@@ -202,33 +401,86 @@ async def should_continue_node(state: ResearchState) -> Command[Literal["plan",
         return Command(goto="plan", update={"idx_research_plan": state["idx_research_plan"] + 1, "current_node": state["master_node"]})
 
     # If we have not reached max depth and not on last step of the research plan, continue with the next step
-    decision = llm.with_structured_output(ContinueBranch).invoke(
-        CONTINUE_BRANCH_PROMPT.format(
+    if state.get("fused_planner"):
+        prompt = NEXT_ACTION_PROMPT.format(
+            vertical=state["research_plan"][state["idx_research_plan"]],
+            topic=state["topic"],
             research_plan="\n".join([f"[done] {step}" for i, step in enumerate(state["research_plan"]) if i < state["idx_research_plan"]]),
             query=state["current_node"].query,
             past_queries="\n".join([f"[done] {query}" for query in state["current_node"].get_path_to_root()[1:]]),
             ctx_manager="\n\n---\n\n".join(state["ctx_manager"]),
+            n=1,
         )
+        action = await generate(
+            prompt, NextAction, temperature=1.5, priority=PRIORITY_BRANCH, state=state, stage="next_action", node=state["current_node"]
+        )
+        logger.info(f"Next action '{state['current_node'].query}': {action['decision']} {dumps(action.get('branches', []))}")
+        if not action["decision"]:
+            return next_vertical(state)
+        return Command(
+            goto="scrape",
+            update={"pending_queries": action.get("branches", [])[:1], "token_count": state["accounting"].total_tokens},
+        )
+
+    prompt = CONTINUE_BRANCH_PROMPT.format(
+        research_plan="\n".join([f"[done] {step}" for i, step in enumerate(state["research_plan"]) if i < state["idx_research_plan"]]),
+        query=state["current_node"].query,
+        past_queries="\n".join([f"[done] {query}" for query in state["current_node"].get_path_to_root()[1:]]),
+        ctx_manager="\n\n---\n\n".join(state["ctx_manager"]),
     )
+    decision = await generate(prompt, ContinueBranch, priority=PRIORITY_BRANCH, state=state, stage="decision", node=state["current_node"])
     logger.info(f"Branch decision '{state['current_node'].query}': {decision['decision']}")
-    return Command(goto="scrape", update={"idx_research_plan": state["idx_research_plan"] + 0 if decision["decision"] else 1})
+    if not decision["decision"]:
+        return next_vertical(state)
+    return Command(goto="scrape", update={"token_count": state["accounting"].total_tokens})
+
+
+def next_vertical(state: ResearchState) -> Command[Literal["plan", "gen_report"]]:
+    """Moves on to the next step of the research plan, or to the report after the last one"""
+    if state["idx_research_plan"] >= len(state["research_plan"]) - 1:
+        return Command(goto="gen_report", update={"token_count": state["accounting"].total_tokens})
+    return Command(
+        goto="plan",
+        update={
+            "idx_research_plan": state["idx_research_plan"] + 1,
+            "current_node": state["master_node"],
+            "pending_queries": [],
+            "token_count": state["accounting"].total_tokens,
+        },
+    )
 
 
 async def gen_report_node(state: ResearchState) -> ResearchState:
     writer = get_stream_writer()
+    budget: Optional[RunBudget] = state.get("budget")
+    if budget and budget.phase != "report":  # Already in it when resumed
+        budget.start_phase("report", state["accounting"].total_tokens)
     state["progress"].send(writer, 0, {"message": "Generating report..."}, ptype="setter", master_node_for_send=state["master_node"])
     findings = "\n\n------\n\n".join(state["ctx_manager"])
-    with open("ctx_manager.log.txt", "w", encoding="utf-8") as f:
-        f.write(findings)
+    artifacts = get_artifact_store()
+    await artifacts.put(state["job_id"], "findings", findings)
 
     # Generate report outline
-    outline = llm.with_structured_output(ReportOutline).invoke(REPORT_OUTLINE_PROMPT.format(topic=state["topic"], ctx_manager=findings))
-    logger.info(f"Report outline:\n{json.dumps(outline, indent=2)}")
+    prompt = REPORT_OUTLINE_PROMPT.format(topic=state["topic"], ctx_manager=findings)
+    started = time.monotonic()
+    outline = await generate(prompt, ReportOutline, priority=PRIORITY_REPORT, state=state, stage="outline")
+    logger.info(f"Report outline:\n{dumps(outline, indent=True)}")
+    if budget:
+        # A section costs about what the outline did (same findings in the prompt), plus its longer output
+        sections = budget.report_sections(
+            len(outline["headings"]), state["accounting"].total_tokens, estimate_tokens(findings) + 1000, time.monotonic() - started
+        )
+        outline["headings"] = outline["headings"][:sections]
     report = []
     raster_report = f"# {outline['title']}\n\n"
+    # index -1: title, (re)starts the streamed report
+    state["progress"].send(writer, 0, {"index": -1, "heading": outline["title"], "delta": ""}, ptype="report_delta")
 
     # Fill in report outline
     for i, heading in enumerate(outline["headings"]):
+        if budget and i and budget.exhausted(state["accounting"].total_tokens):
+            budget.skipped["sections"] += len(outline["headings"]) - i
+            break
         state["progress"].send(
             writer,
             100 / (len(outline["headings"]) + 1),
@@ -236,39 +488,36 @@ async def gen_report_node(state: ResearchState) -> ResearchState:
             ptype="update",
             master_node_for_send=state["master_node"],
         )
-        content = llm.with_structured_output(ReportFillin).invoke(
-            REPORT_FILLIN_PROMPT.format(
-                topic=state["topic"],
-                ctx_manager=findings,
-                report_progress=raster_report,
-                report_outline=["[done] " + outline["title"]] + [f"[done] {h}" for _, h in enumerate(outline["headings"]) if i < _],
-                slot=heading,
-            ),
-        )["content"]
-        # Remove heading if LLM put it there regardless
-        idx_heading = content.find(heading)
-        if idx_heading != -1:
-            content = content[idx_heading + len(heading) :].strip()
+        prompt = REPORT_FILLIN_PROMPT.format(
+            topic=state["topic"],
+            ctx_manager=findings,
+            report_progress=raster_report,
+            report_outline=["[done] " + outline["title"]] + [f"[done] {h}" for _, h in enumerate(outline["headings"]) if i < _],
+            slot=heading,
+        )
+        # Stream the section to the client as it is generated
+        content = ""
+        async with aclosing(strip_heading(stream_generate(prompt, priority=PRIORITY_REPORT, state=state, stage="report"), heading)) as deltas:
+            async for delta in deltas:
+                content += delta
+                state["progress"].send(writer, 0, {"index": i, "heading": heading, "delta": delta}, ptype="report_delta")
+        content = content.strip()
         report.append({"heading": heading, "content": content})
         raster_report += f"\n\n## {heading}\n\n{content}"
 
-    # Collate multimedia content
-    media_content = {"images": [], "videos": [], "links": []}
-    all_sources_data = state["master_node"].get_all_data()
-    for data in all_sources_data:
-        if data.get("images"):
-            media_content["images"].extend(data["images"])
-        if data.get("videos"):
-            media_content["videos"].extend(data["videos"])
-        if data.get("links"):
-            media_content["links"].extend([{"url": link["href"], "text": link["text"]} for link in data["links"]])
-    # Dedupe
-    media_content["images"] = list(set(media_content["images"]))
-    media_content["videos"] = list(set(media_content["videos"]))
-    media_content["links"] = list({json.dumps(d, sort_keys=True) for d in media_content["links"]})
-    media_content["links"] = [json.loads(d) for d in media_content["links"]]
+    # Collate multimedia content in a single read-only pass, deduped (in order) as it goes
+    images, videos, links = {}, {}, {}
+    total_sources = 0
+    for data in state["master_node"].iter_data(fields=("images", "videos", "links")):
+        total_sources += 1
+        images.update(dict.fromkeys(data["images"] or []))
+        videos.update(dict.fromkeys(data["videos"] or []))
+        for link in data["links"] or []:
+            links.setdefault((link["href"], link["text"]), None)
+    media_content = {"images": list(images), "videos": list(videos), "links": [{"url": url, "text": text} for url, text in links]}
 
     result = {
+        "job_id": state["job_id"],
         "topic": state["topic"],
         "timestamp": datetime.now().isoformat(),
         "content": raster_report,
@@ -276,13 +525,23 @@ async def gen_report_node(state: ResearchState) -> ResearchState:
         "research_tree": state["master_node"].build_tree_structure(),
         "metadata": {
             "total_queries": state["master_node"].total_children(),
-            "total_sources": len(all_sources_data),
+            "total_sources": total_sources,
             "max_depth_reached": state["master_node"].max_depth(),
-            "total_tokens": state["token_count"],
+            "total_tokens": state["accounting"].total_tokens,
+            "accounting": state["accounting"].summary(),
+            "planner": "fused" if state.get("fused_planner") else "split",
+            "budget": budget.summary(state["accounting"].total_tokens) if budget else None,
+            "dedup": QueryRegistry.from_tree(state["master_node"], state.get("skipped_queries")).stats(),
+            "crawl": state["links"].stats() if state.get("links") is not None else None,
+            "prefetch": state["scraper"].prefetcher.stats(),  # Since the browser started, it may have served earlier runs
         },
     }
-    with open("output.log.json", "w", encoding="utf-8") as f:
-        json.dump(result, f, indent=2)
+    if os.getenv("KNET_TRACE_DIR"):
+        trace_path = os.path.join(os.getenv("KNET_TRACE_DIR"), f"trace-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+        await asyncio.to_thread(state["accounting"].export_json, trace_path)
+
+    await artifacts.put(state["job_id"], "report", result)
+    await artifacts.put(state["job_id"], "tree", result["research_tree"])
     state["progress"].send(
         writer,
         100,
@@ -292,32 +551,68 @@ async def gen_report_node(state: ResearchState) -> ResearchState:
 
 
 # --- Main research logic using LangGraph ---
-async def start_research_workflow(topic: str, scraper: CrawlForAIScraper, max_depth: int, num_sites_per_query: int):
-    # Build the research graph
+NODES = ["plan", "scrape", "summarize", "should_continue", "gen_report"]
+# Job ids of the runs executing in this process, a run can't be resumed while it is still going
+active_runs: set[str] = set()
+
+
+def build_graph():
+    # Every node is checkpointed (KNET_CHECKPOINT_DB) before the graph moves on
+    checkpointer = get_checkpointer()
     graph = StateGraph(state_schema=ResearchState)
-    graph.add_node("plan", research_plan_node)
-    graph.add_node("scrape", scrape_node)
-    graph.add_node("summarize", summarize_node)
-    graph.add_node("should_continue", should_continue_node)
-    graph.add_node("gen_report", gen_report_node)
+    graph.add_node("plan", checkpointed(checkpointer, "plan", research_plan_node))
+    graph.add_node("scrape", checkpointed(checkpointer, "scrape", scrape_node))
+    graph.add_node("summarize", checkpointed(checkpointer, "summarize", summarize_node))
+    graph.add_node("should_continue", checkpointed(checkpointer, "should_continue", should_continue_node))
+    graph.add_node("gen_report", checkpointed(checkpointer, "gen_report", gen_report_node))
 
     graph.add_edge("plan", "scrape")
     graph.add_edge("scrape", "summarize")
     graph.add_edge("summarize", "should_continue")
     graph.add_edge("gen_report", END)
-    graph.set_entry_point("plan")
-    graph = graph.compile()
-    print(graph.get_graph().draw_mermaid())
-
+    # Fresh runs start with the plan, resumed runs at the node after their last checkpoint
+    graph.set_conditional_entry_point(lambda state: state.get("resume_from") or "plan", NODES)
+    return graph.compile()
+
+
+async def run_workflow(state: ResearchState):
+    graph = build_graph()
+
+    active_runs.add(state["job_id"])
+    try:
+        async for update in graph.astream(state, {"recursion_limit": 1000}, stream_mode="custom"):
+            yield update
+    finally:
+        active_runs.discard(state["job_id"])
+        if get_checkpointer() is not None:
+            get_checkpointer().forget(state["job_id"])
+        state["scraper"].prefetcher.clear()  # Candidates of this run, already cached pages may still serve the next one
+        state["master_node"].store.close()  # Drops the run's page bodies and spill file
+
+
+async def start_research_workflow(
+    topic: str,
+    scraper: CrawlForAIScraper,
+    max_depth: int,
+    num_sites_per_query: int,
+    fused_planner: bool = False,
+    job_id: Optional[str] = None,
+    budget: Optional[RunBudget] = None,
+):
     master_node = ResearchNode()
     initial_current_node = master_node
 
     state: ResearchState = {
         "scraper": scraper,
         "progress": ResearchProgress(),
+        "accounting": RunAccounting(),
+        "budget": budget,
+        "links": LinkIndex() if crawl_mode() else None,
+        "job_id": job_id or os.urandom(16).hex(),
         "topic": topic,
         "max_depth": max_depth,
         "num_sites_per_query": num_sites_per_query,
+        "fused_planner": fused_planner,
         "master_node": master_node,
         "current_node": initial_current_node,
         "research_plan": [],
@@ -326,8 +621,30 @@ async def start_research_workflow(topic: str, scraper: CrawlForAIScraper, max_de
         "ctx_manager": [],
         "raster_report": "",
         "token_count": 0,
+        "pending_queries": [],
+        "skipped_queries": [],
+        "merged": False,
     }
-    async for update in graph.astream(state, {"recursion_limit": 1000}, stream_mode="custom"):
+    async for update in run_workflow(state):
+        yield update
+
+
+async def resume_research_workflow(job_id: str, scraper: CrawlForAIScraper):
+    """Continues a run from its last checkpoint, nothing done before it is scraped or summarized again"""
+    checkpointer = get_checkpointer()
+    checkpoint = await checkpointer.load(job_id) if checkpointer else None
+    if checkpoint is None:
+        raise KeyError(f"No checkpoint for run {job_id}")
+    if checkpoint["next"] == END:
+        # Finished already, replay the stored report
+        yield {"event": "result", "data": await get_artifact_store().get_json(job_id, "report")}
+        return
+
+    logger.info(f"Resuming run {job_id} at '{checkpoint['next']}' after {checkpoint['step']} checkpointed node(s)")
+    progress = ResearchProgress()
+    progress.progress = checkpoint["progress"]
+    state: ResearchState = {**checkpoint["state"], "scraper": scraper, "progress": progress, "resume_from": checkpoint["next"]}
+    async for update in run_workflow(state):
         yield update
 
 
@@ -337,31 +654,269 @@ async def start_research(request: Request):
     topic = data.get("topic", "").strip()
     max_depth = int(data.get("max_depth", 1))
     num_sites_per_query = int(data.get("num_sites_per_query", 5))
+    # A/B switch between the fused "next action" call and continue_branch + search_query
+    fused_planner = bool(data.get("fused_planner", os.getenv("KNET_FUSED_PLANNER", "false").lower() in ("1", "true")))
+    # Optional budget: seconds of research and/or LLM tokens, the run adapts its breadth and depth to finish within it
+    budget = {"deadline": data.get("deadline"), "max_tokens": data.get("max_tokens")} if data.get("deadline") or data.get("max_tokens") else None
+    job_id = os.urandom(16).hex()
+
+    params = {
+        "topic": topic,
+        "max_depth": max_depth,
+        "num_sites_per_query": num_sites_per_query,
+        "fused_planner": fused_planner,
+        "budget": budget,
+        "job_id": job_id,
+    }
+    return await stream_research(
+        request,
+        data,
+        params,
+        lambda scraper: start_research_workflow(
+            topic, scraper, max_depth, num_sites_per_query, fused_planner, job_id, budget=RunBudget.from_params(budget)
+        ),
+        key=request_key(topic, max_depth, num_sites_per_query, fused_planner, budget),
+    )
+
+
+@app.post("/resume_research")
+async def resume_research(request: Request):
+    """Continues an interrupted run (worker restart, dropped client) from its last completed node"""
+    data = await request.json()
+    job_id = data.get("job_id", "")
+    checkpointer = get_checkpointer()
+    if checkpointer is None or await checkpointer.info(job_id) is None:
+        return JSONResponse({"error": f"No checkpoint for run {job_id}"}, status_code=404)
+    if job_id in active_runs:
+        return JSONResponse({"error": f"Run {job_id} is still in progress"}, status_code=409)
+    # With a job store the run executes in a worker process, its job is what says it is still going
+    if job_store is not None and await job_store.find_active(job_id, stale_after=float(os.getenv("KNET_JOB_STALE_AFTER", 60))) is not None:
+        return JSONResponse({"error": f"Run {job_id} is still in progress"}, status_code=409)
+
+    return await stream_research(request, data, {"resume": job_id, "job_id": job_id}, lambda scraper: resume_research_workflow(job_id, scraper))
+
+
+async def stream_research(
+    request: Request, data: dict, params: dict, workflow: Callable[[CrawlForAIScraper], AsyncIterator[dict]], key: Optional[str] = None
+):
+    """
+    Admits a run and streams its events as SSE, in this process or through the job store.
+    The first event is "run" with the job id that /resume_research and /artifacts take.
+    A request with Last-Event-ID re-attaches to its run instead and gets only the events after that id.
+    With a request `key`, an identical run still going here is joined and a recently completed one is served from the
+    result cache, unless the client sends "force_refresh".
+    """
+    run_id, after = parse_event_id(request.headers.get("last-event-id"))
+    if run_id:
+        return attach(run_id, after)
+
     session_id = data.get("session_id") or os.urandom(8).hex()
 
-    if session_id not in sessions:
-        scraper = CrawlForAIScraper()
-        await scraper.start()
-        sessions[session_id] = {"scraper": scraper}
-    else:
-        scraper = sessions[session_id]["scraper"]
+    # Admission control before any browser is started
+    scheduler = get_scheduler()
+    priority = max(1, int(data.get("priority", 1)))  # Clients may only lower their own priority, 0 is reserved
+    user_id = (request.headers.get("x-forwarded-for") or (request.client.host if request.client else None) or session_id).split(",")[0].strip()
+    # Optional compression of the large result event, client lists the codecs it can decode, e.g. ["zstd", "deflate"]
+    codec = negotiate_codec(data.get("compression"))
+
+    if key is not None and not data.get("force_refresh"):
+        running = streams.get(flights.get(key))
+        if running is not None and not running.done:
+            logger.info(f"Session {session_id} joined the identical run {running.run_id}")
+            running.sessions.add(session_id)
+            sessions.setdefault(session_id, {})["run_id"] = running.run_id  # Its /abort_research only leaves the run
+            return EventSourceResponse(running.subscribe())
+        cached = await result_cache.get(key)
+        if cached is not None:
+            logger.info(f"Serving research for {session_id} from the result cache (run {cached.get('job_id')})")
+            return EventSourceResponse(cached_events(session_id, cached, codec))
+
+    if job_store is not None:
+        return await start_research_job(session_id, user_id, priority, params, codec, key)
+
+    try:
+        ticket = scheduler.submit(user_id, priority)
+    except SchedulerFull as e:
+        logger.warning(f"Rejected research for {session_id}: {str(e)}")
+        return JSONResponse({"error": str(e), "code": e.reason}, status_code=503, headers={"Retry-After": "30"})
 
     async def event_generator():
-        async for event in start_research_workflow(topic, scraper, max_depth, num_sites_per_query):
-            yield event
+        try:
+            yield {"event": "run", "data": dumps({"job_id": params["job_id"], "session_id": session_id})}
+            async for position in ticket.positions():
+                yield {"event": "queued", "data": dumps({"position": position, "session_id": session_id})}
+
+            session = sessions.setdefault(session_id, {})
+            if "scraper" not in session:
+                scraper = CrawlForAIScraper()
+                await scraper.start()
+                session["scraper"] = scraper
+            scraper = session["scraper"]
+
+            async for event in workflow(scraper):
+                if event["event"] == "result" and key is not None:
+                    result_cache.put(key, params["job_id"])
+                yield sse_event(session_id, event, codec)
+        finally:
+            scheduler.release(ticket)  # Also when the run was abandoned before it started
+            forget_flight(key, params["job_id"])
+
+    # The run outlives the connection, a dropped client can re-attach while it goes on
+    sessions.setdefault(session_id, {})["run_id"] = params["job_id"]  # /abort_research works while it is still queued
+    return EventSourceResponse(start_stream(params["job_id"], event_generator(), session_id, key).subscribe())
+
+
+def start_stream(run_id: str, producer: AsyncIterator[dict], session_id: str, key: Optional[str] = None):
+    stream = streams.start(run_id, producer)
+    stream.sessions.add(session_id)
+    if key is not None:
+        flights[key] = run_id
+    return stream
+
+
+def forget_flight(key: Optional[str], run_id: str):
+    if key is not None and flights.get(key) == run_id:
+        del flights[key]
+
+
+async def cached_events(session_id: str, report: dict, codec: Optional[str]):
+    yield {"event": "run", "data": dumps({"job_id": report.get("job_id"), "session_id": session_id, "cached": True})}
+    yield sse_event(session_id, {"event": "result", "data": report}, codec)
+
+
+def attach(run_id: str, after: int = 0):
+    stream = streams.get(run_id)
+    if stream is None:
+        return JSONResponse({"error": f"Run {run_id} is not streaming here, continue it with /resume_research"}, status_code=404)
+    logger.info(f"Client re-attached to run {run_id} after event {after}")
+    return EventSourceResponse(stream.subscribe(after))
+
+
+@app.get("/runs/{job_id}/events")
+async def run_events(job_id: str, request: Request):
+    """Re-attaches to a running (or just finished) run, Last-Event-ID or ?after=<seq> skips what the client already has"""
+    run_id, after = parse_event_id(request.headers.get("last-event-id"))
+    return attach(job_id, after if run_id == job_id else int(request.query_params.get("after", 0)))
+
+
+def sse_event(session_id: str, event: dict, codec: Optional[str]) -> dict:
+    # SSE data is text, serialize once with orjson instead of letting it be str()-ed
+    payload = dumpb(event["data"])
+    framed = frame(payload, codec, text=True) if event["event"] in COMPRESSED_EVENTS else None
+    if framed:
+        logger.info(f"'{event['event']}' for {session_id}: {len(payload)} -> {len(framed['data'])} bytes on the wire ({codec}, base64)")
+        return {"event": event["event"], "data": dumps(framed)}
+    return {"event": event["event"], "data": payload.decode("utf-8")}
+
+
+async def start_research_job(session_id: str, user_id: str, priority: int, params: dict, codec: Optional[str], key: Optional[str] = None):
+    """Enqueues a run in the job store and streams its events from there, a worker.py process runs it"""
+    # Admission control across every API process, the store is the shared queue
+    if await job_store.count(QUEUED) >= int(os.getenv("KNET_MAX_QUEUED_RUNS", 10)):
+        return JSONResponse({"error": "Server is at capacity, try again later", "code": "queue_full"}, status_code=503, headers={"Retry-After": "30"})
+    max_per_user = int(os.getenv("KNET_MAX_QUEUED_PER_USER", 2))
+    if await job_store.count(QUEUED, user_id) >= max_per_user:
+        return JSONResponse(
+            {"error": f"You already have {max_per_user} research runs waiting", "code": "user_limit"}, status_code=503, headers={"Retry-After": "30"}
+        )
+
+    job_id = params["job_id"] if "resume" not in params else os.urandom(16).hex()  # A resumed run keeps its id, its job is a new one
+    await job_store.submit(job_id, JOB_KIND, params, user_id, priority)
+    sessions[session_id] = {"job_id": job_id, "run_id": params["job_id"]}
+    logger.info(f"Queued job {job_id} for session {session_id}")
 
-    return EventSourceResponse(event_generator())
+    async def event_generator():
+        yield {"event": "run", "data": dumps({"job_id": params["job_id"], "session_id": session_id})}
+        poll_interval = float(os.getenv("KNET_JOB_POLL_INTERVAL", 0.25))
+        after, last_position = 0, None
+        try:
+            while True:
+                # Status before events, so every event written before the job finished is read
+                job = await job_store.get(job_id)
+                position = await job_store.position(job_id)
+                if position is not None and position != last_position:
+                    last_position = position
+                    yield {"event": "queued", "data": dumps({"position": position, "session_id": session_id})}
+                events = await job_store.events(job_id, after, limit=500)
+                for after, event, data in events:
+                    yield sse_event(session_id, {"event": event, "data": data}, codec)
+                if (job is None or job["status"] in FINISHED) and len(events) < 500:
+                    break
+                await asyncio.sleep(poll_interval)
+        except asyncio.CancelledError:
+            # No client re-attached, don't keep a worker busy for nobody
+            await job_store.request_cancel(job_id)
+            raise
+        finally:
+            forget_flight(key, params["job_id"])
+
+        if job is not None and job["status"] == DONE and key is not None:
+            result_cache.put(key, params["job_id"])
+        if job is None or job["status"] == CANCELLED:
+            yield {"event": "aborted", "data": dumps({"session_id": session_id})}
+        elif job["status"] == FAILED:
+            yield {"event": "error", "data": dumps({"message": job.get("error") or "Research failed"})}
+        sessions.pop(session_id, None)
+
+    return EventSourceResponse(start_stream(params["job_id"], event_generator(), session_id, key).subscribe())
+
+
+@app.get("/artifacts/{job_id}/{name}")
+async def get_artifact(job_id: str, name: str, request: Request):
+    """
+    Streams a run's report, findings or tree.
+    Sent as stored (Content-Encoding) when the client accepts the codec, decompressed on the fly otherwise.
+    """
+    artifacts = get_artifact_store()
+    media_type = "text/plain; charset=utf-8" if name == "findings" else "application/json"
+    try:
+        codec, chunks = await artifacts.stream_raw(job_id, name)
+        if codec in request.headers.get("accept-encoding", ""):
+            return StreamingResponse(chunks, media_type=media_type, headers={"Content-Encoding": codec})
+        await chunks.aclose()
+        return StreamingResponse(artifacts.stream(job_id, name), media_type=media_type)
+    except (FileNotFoundError, ValueError):
+        return JSONResponse({"error": f"No artifact '{name}' for job {job_id}"}, status_code=404)
 
 
 @app.post("/abort_research")
 async def abort_research(request: Request):
+    """
+    Stops the session's run: cancels the graph (pending LLM calls and open pages with it) and waits until it stopped,
+    at most KNET_ABORT_TIMEOUT seconds before its browser is closed under it. Responds with the time it took.
+    A run other sessions joined goes on for them, the session only leaves it.
+    """
     data = await request.json()
     session_id = data.get("session_id")
-    if session_id in sessions:
-        scraper = sessions[session_id]["scraper"]
-        await scraper.close()
-        del sessions[session_id]
-    return {"status": "aborted"}
+    session = sessions.pop(session_id, None) or {}
+    stream = streams.get(session.get("run_id"))
+    if stream is not None and not stream.done and not stream.leave(session_id):
+        logger.info(f"Session {session_id} left run {stream.run_id}, {len(stream.sessions)} other session(s) still follow it")
+        if "scraper" in session:
+            # May be the browser the run is using, closed once the run is over
+            scraper = session["scraper"]
+            stream.task.add_done_callback(lambda _: asyncio.ensure_future(scraper.close()))
+        return {"status": "aborted", "stopped": False, "sessions": len(stream.sessions)}
+
+    started = time.monotonic()
+    stopped = None
+    if "job_id" not in session and job_store is not None and stream is not None:
+        session["job_id"] = await job_store.find_active(stream.run_id)  # A joined session's entry has no job
+    if session.get("job_id"):
+        await job_store.request_cancel(session["job_id"])
+        if stream is not None:
+            # The relay ends once the worker stopped the job
+            stopped = bool((await asyncio.wait([stream.task], timeout=2 * abort_timeout()))[0])
+    elif stream is not None and not stream.task.done():
+        stopped = await cancel_and_wait(stream.task, force=session["scraper"].close if "scraper" in session else None)
+    if "scraper" in session:
+        await session["scraper"].close()
+
+    if stopped is None:
+        return {"status": "aborted"}
+    elapsed = abort_stats.record(started, stopped)
+    logger.info(f"Run {session['run_id']} {'stopped' if stopped else 'still running'} {elapsed:.2f}s after the abort")
+    return {"status": "aborted", "stopped": stopped, "abort_ms": round(elapsed * 1000)}
 
 
 if __name__ == "__main__":
@@ -1,15 +1,17 @@
-import json
 import logging
 import os
+import uuid
 from datetime import datetime
 from typing import Annotated, Any, Dict, List, Literal, Optional, TypedDict
 
 from dotenv import load_dotenv
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 
 from agent_tools import invoke_agent
+from event_stream import StreamRegistry, parse_event_id
+from serialization import dumps
 
 load_dotenv()
 
@@ -31,6 +33,8 @@ app.add_middleware(
 
 # Session management (in-memory for now)
 sessions: Dict[str, Dict[str, Any]] = {}
+# Event ids and replay buffers of running chats, clients re-attach with Last-Event-ID
+streams = StreamRegistry()
 
 
 @app.get("/health")
@@ -45,11 +49,25 @@ async def chat(request: Request):
     thread_id = data.get("thread_id")
     create_report = data.get("create_report", False)
 
+    # Reconnect: re-attach to the running chat and replay only what was missed
+    run_id, after = parse_event_id(request.headers.get("last-event-id"))
+    stream = streams.get(run_id)
+    if run_id and stream is None:
+        return JSONResponse({"error": f"Chat {run_id} is no longer streaming"}, status_code=404)
+
+    if stream is None:
+
+        async def agent_events():
+            async for event in invoke_agent(message, thread_id, create_report):
+                yield {"data": dumps(event)}
+
+        stream = streams.start(uuid.uuid4().hex, agent_events())
+
     async def event_generator():
-        async for event in invoke_agent(message, thread_id, create_report):
+        async for event in stream.subscribe(after):
             # Format the event as SSE (Server-Sent Events)
-            event_data = json.dumps(event)
-            yield f"data: {event_data}\n\n"
+            lines = f"id: {event['id']}\n" + (f"event: {event['event']}\n" if "event" in event else "")
+            yield f"{lines}data: {event['data']}\n\n"
 
     return StreamingResponse(
         event_generator(),
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+import zlib
+from typing import Any, AsyncIterator, List, Optional, Tuple
+
+from compression import DEFLATE, ZSTD, compress, zstandard
+from serialization import dumpb, loads
+
+# File extension of each codec, also tells the codec of an artifact on read
+EXTENSIONS = {ZSTD: ".zst", DEFLATE: ".zz"}
+_SAFE = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9_.-]*$")  # No separators, no leading dot
+
+
+class ArtifactStore:
+    """
+    Compressed per job artifacts (report, findings, tree): <root>/<job_id>/<name>.zst
+    - Every file operation runs in a thread, a large report never blocks the event loop
+    - Writes go to a temp file first and are renamed into place, readers never see half an artifact
+    - Jobs older than `retention` seconds are removed, checked at most every `cleanup_interval` seconds on put()
+    """
+
+    def __init__(self, root: Optional[str] = None, retention: Optional[float] = None, cleanup_interval: float = 3600):
+        self.logger = logging.getLogger(__name__)
+        self.root = root or os.getenv("KNET_ARTIFACT_DIR", "artifacts")
+        self.retention = retention if retention is not None else float(os.getenv("KNET_ARTIFACT_RETENTION", 7 * 86400))
+        self.codec = ZSTD if zstandard else DEFLATE
+        self.cleanup_interval = cleanup_interval
+        self._last_cleanup = 0.0
+        os.makedirs(self.root, exist_ok=True)
+
+    def _dir(self, job_id: str) -> str:
+        if not _SAFE.match(job_id):
+            raise ValueError(f"Invalid job id '{job_id}'")
+        return os.path.join(self.root, job_id)
+
+    def _find(self, job_id: str, name: str) -> Optional[Tuple[str, str]]:
+        """(path, codec) of an existing artifact"""
+        if not _SAFE.match(name):
+            raise ValueError(f"Invalid artifact name '{name}'")
+        for codec, ext in EXTENSIONS.items():
+            path = os.path.join(self._dir(job_id), name + ext)
+            if os.path.exists(path):
+                return path, codec
+        return None
+
+    def _write(self, job_id: str, name: str, data: bytes) -> str:
+        if not _SAFE.match(name):
+            raise ValueError(f"Invalid artifact name '{name}'")
+        directory = self._dir(job_id)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, name + EXTENSIONS[self.codec])
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=f".{name}.")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(compress(data, self.codec))
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        return path
+
+    async def put(self, job_id: str, name: str, value: Any) -> str:
+        """Stores bytes, text, or anything serializable (as JSON), returns the artifact's path"""
+        if isinstance(value, str):
+            data = value.encode("utf-8")
+        elif isinstance(value, (bytes, bytearray, memoryview)):
+            data = bytes(value)
+        else:
+            data = dumpb(value)
+        path = await asyncio.to_thread(self._write, job_id, name, data)
+        if time.time() - self._last_cleanup > self.cleanup_interval:
+            self._last_cleanup = time.time()
+            await self.cleanup()
+        return path
+
+    async def stream(self, job_id: str, name: str, chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+        """Decompressed content in chunks, raises FileNotFoundError for a missing artifact"""
+        found = await asyncio.to_thread(self._find, job_id, name)
+        if found is None:
+            raise FileNotFoundError(f"No artifact '{name}' for job {job_id}")
+        path, codec = found
+        f = await asyncio.to_thread(open, path, "rb")
+        try:
+            if codec == ZSTD:
+                reader = zstandard.ZstdDecompressor().stream_reader(f)
+                while chunk := await asyncio.to_thread(reader.read, chunk_size):
+                    yield chunk
+            else:
+                decompressor = zlib.decompressobj()
+                while raw := await asyncio.to_thread(f.read, chunk_size):
+                    if chunk := decompressor.decompress(raw):
+                        yield chunk
+                if tail := decompressor.flush():
+                    yield tail
+        finally:
+            await asyncio.to_thread(f.close)
+
+    async def stream_raw(self, job_id: str, name: str, chunk_size: int = 64 * 1024) -> Tuple[str, AsyncIterator[bytes]]:
+        """(codec, compressed chunks) for clients that decode the codec themselves (HTTP Content-Encoding)"""
+        found = await asyncio.to_thread(self._find, job_id, name)
+        if found is None:
+            raise FileNotFoundError(f"No artifact '{name}' for job {job_id}")
+        path, codec = found
+
+        async def chunks():
+            f = await asyncio.to_thread(open, path, "rb")
+            try:
+                while chunk := await asyncio.to_thread(f.read, chunk_size):
+                    yield chunk
+            finally:
+                await asyncio.to_thread(f.close)
+
+        return codec, chunks()
+
+    async def get(self, job_id: str, name: str) -> bytes:
+        return b"".join([chunk async for chunk in self.stream(job_id, name)])
+
+    async def get_json(self, job_id: str, name: str) -> Any:
+        return loads(await self.get(job_id, name))
+
+    async def list(self, job_id: str) -> List[str]:
+        def names():
+            directory = self._dir(job_id)
+            if not os.path.isdir(directory):
+                return []
+            return sorted(os.path.splitext(entry)[0] for entry in os.listdir(directory) if not entry.startswith("."))
+
+        return await asyncio.to_thread(names)
+
+    async def cleanup(self, older_than: Optional[float] = None) -> int:
+        """Removes jobs whose artifacts were last written more than `older_than` (default `retention`) seconds ago"""
+        cutoff = time.time() - (older_than if older_than is not None else self.retention)
+
+        def remove() -> int:
+            removed = 0
+            for entry in os.scandir(self.root):
+                if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                    removed += 1
+            return removed
+
+        removed = await asyncio.to_thread(remove)
+        if removed:
+            self.logger.info(f"Removed artifacts of {removed} job(s) past retention")
+        return removed
+
+
+_store: Optional[ArtifactStore] = None
+
+
+def get_artifact_store() -> ArtifactStore:
+    """Shared artifact store for this process, configured from the environment (KNET_ARTIFACT_DIR, KNET_ARTIFACT_RETENTION)"""
+    global _store
+    if _store is None:
+        _store = ArtifactStore()
+    return _store
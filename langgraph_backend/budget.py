@@ -0,0 +1,148 @@
+import math
+import os
+import time
+from typing import Any, Dict, Optional
+
+
+class RunBudget:
+    """
+    Wall-clock (`deadline` seconds of research, queue time excluded) and/or token (`max_tokens`) budget of one run.
+    - Exploration may use up to 1 - `report_reserve` of it (KNET_BUDGET_REPORT_RESERVE), split evenly between the
+      verticals of the plan. The rest is kept for the report.
+    - Within a vertical, sites per query shrink once half its share is used and branching stops, past its share the
+      run moves on to the next vertical, past the exploration share it skips straight to the report.
+    - The report gets as many sections as the remaining budget pays for, at least one.
+    Usage is the larger of the time and token fractions, so either limit alone works.
+    """
+
+    def __init__(self, deadline: Optional[float] = None, max_tokens: Optional[int] = None, report_reserve: Optional[float] = None):
+        self.deadline = deadline
+        self.max_tokens = max_tokens
+        self.report_reserve = report_reserve if report_reserve is not None else float(os.getenv("KNET_BUDGET_REPORT_RESERVE", 0.25))
+        self.verticals = 1  # Set once the plan is known
+        self.elapsed_before = 0.0  # Spent before the run was resumed from a checkpoint
+        self.phases: Dict[str, Dict[str, float]] = {}  # Closed phases: name -> {"seconds", "tokens"}
+        self.phase = "explore"
+        self.phase_started = (0.0, 0)  # (elapsed, tokens) when the current phase started
+        self.skipped = {"verticals": 0, "queries": 0, "branches": 0, "sections": 0}
+        self.stopped: Optional[str] = None  # "deadline" | "tokens" when exploration ended early
+        self._t0 = time.monotonic()
+
+    @classmethod
+    def from_params(cls, params: Optional[Dict[str, Any]]) -> Optional["RunBudget"]:
+        """Budget from request parameters {"deadline": seconds, "max_tokens": n}, None when neither is set"""
+        params = params or {}
+        deadline = float(params["deadline"]) if params.get("deadline") else None
+        max_tokens = int(params["max_tokens"]) if params.get("max_tokens") else None
+        if deadline is None and max_tokens is None:
+            return None
+        return cls(deadline, max_tokens)
+
+    def elapsed(self) -> float:
+        return self.elapsed_before + time.monotonic() - self._t0
+
+    def used(self, tokens: int) -> float:
+        """Fraction of the budget used, by whichever limit is closer"""
+        fractions = [0.0]
+        if self.deadline:
+            fractions.append(self.elapsed() / self.deadline)
+        if self.max_tokens:
+            fractions.append(tokens / self.max_tokens)
+        return max(fractions)
+
+    def remaining(self, tokens: int) -> tuple[Optional[float], Optional[int]]:
+        """(seconds, tokens) left, None for a limit that isn't set"""
+        seconds = self.deadline - self.elapsed() if self.deadline else None
+        left = self.max_tokens - tokens if self.max_tokens else None
+        return seconds, left
+
+    def headroom(self, tokens: int, vertical: int) -> float:
+        """Part of vertical `vertical`'s share still unused, 1 before it started, <= 0 once spent"""
+        share = (1 - self.report_reserve) / max(1, self.verticals)
+        return (share * (vertical + 1) - self.used(tokens)) / share
+
+    def sites(self, base: int, tokens: int, vertical: int) -> int:
+        """Sites per query, all of them until half the vertical's share is used, then fewer down to one"""
+        return max(1, min(base, math.ceil(base * 2 * self.headroom(tokens, vertical))))
+
+    def can_branch(self, tokens: int, vertical: int) -> bool:
+        if self.headroom(tokens, vertical) > 0.5:
+            return True
+        self.skipped["branches"] += 1
+        return False
+
+    def vertical_done(self, tokens: int, vertical: int) -> bool:
+        return self.headroom(tokens, vertical) <= 0
+
+    def explore_done(self, tokens: int) -> bool:
+        """Exploration used its share, the run should go to the report now"""
+        if self.used(tokens) < 1 - self.report_reserve:
+            return False
+        if self.stopped is None:
+            deadline_used = self.elapsed() / self.deadline if self.deadline else 0
+            tokens_used = tokens / self.max_tokens if self.max_tokens else 0
+            self.stopped = "deadline" if deadline_used >= tokens_used else "tokens"
+        return True
+
+    def exhausted(self, tokens: int) -> bool:
+        return self.used(tokens) >= 1
+
+    def report_sections(self, headings: int, tokens: int, section_tokens: int, section_seconds: float) -> int:
+        """How many of `headings` sections fit in what is left, given the estimated cost of one"""
+        seconds_left, tokens_left = self.remaining(tokens)
+        fits = [headings]
+        if seconds_left is not None:
+            fits.append(int(seconds_left // max(section_seconds, 0.001)))
+        if tokens_left is not None:
+            fits.append(int(tokens_left // max(section_tokens, 1)))
+        sections = max(1, min(fits))
+        self.skipped["sections"] += headings - sections
+        return sections
+
+    def start_phase(self, name: str, tokens: int):
+        """Closes the current phase with what it spent"""
+        elapsed, spent = self.phase_started
+        self.phases[self.phase] = {"seconds": round(self.elapsed() - elapsed, 3), "tokens": tokens - spent}
+        self.phase, self.phase_started = name, (self.elapsed(), tokens)
+
+    def summary(self, tokens: int) -> Dict[str, Any]:
+        """How the budget was spent, for the report's metadata"""
+        elapsed, spent = self.phase_started
+        phases = {**self.phases, self.phase: {"seconds": round(self.elapsed() - elapsed, 3), "tokens": tokens - spent}}
+        return {
+            "deadline": self.deadline,
+            "max_tokens": self.max_tokens,
+            "elapsed": round(self.elapsed(), 3),
+            "tokens": tokens,
+            "used": round(self.used(tokens), 3),
+            "phases": phases,
+            "skipped": dict(self.skipped),
+            "stopped_early": self.stopped,
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "deadline": self.deadline,
+            "max_tokens": self.max_tokens,
+            "report_reserve": self.report_reserve,
+            "verticals": self.verticals,
+            "elapsed": self.elapsed(),
+            "phases": self.phases,
+            "phase": self.phase,
+            "phase_started": list(self.phase_started),
+            "skipped": self.skipped,
+            "stopped": self.stopped,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "RunBudget":
+        """Budget of a resumed run, the time it was not running for doesn't count"""
+        budget = cls(data["deadline"], data["max_tokens"], data["report_reserve"])
+        budget.verticals = data["verticals"]
+        budget.elapsed_before = data["elapsed"]
+        budget.phases = data["phases"]
+        budget.phase = data["phase"]
+        budget.phase_started = tuple(data["phase_started"])
+        budget.skipped = data["skipped"]
+        budget.stopped = data["stopped"]
+        return budget
@@ -0,0 +1,61 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def abort_timeout() -> float:
+    """Seconds an aborted run gets to unwind before its browser is closed under it (KNET_ABORT_TIMEOUT)"""
+    return float(os.getenv("KNET_ABORT_TIMEOUT", 10))
+
+
+async def cancel_and_wait(task: asyncio.Task, timeout: Optional[float] = None, force: Optional[Callable[[], Awaitable]] = None) -> bool:
+    """
+    Cancels `task` and waits up to `timeout` seconds for it to finish.
+    If it is still running then (e.g. stuck in a browser call), `force()` releases what it holds and it gets another `timeout`.
+    Returns whether the task finished.
+    """
+    timeout = timeout if timeout is not None else abort_timeout()
+    if not task.cancelling():  # A second cancel() would also interrupt the cleanup of the first one
+        task.cancel()
+    done, _ = await asyncio.wait([task], timeout=timeout)
+    if not done and force is not None:
+        logger.warning(f"Task did not stop {timeout}s after being cancelled, releasing its resources")
+        await force()
+        done, _ = await asyncio.wait([task], timeout=timeout)
+    return bool(done)
+
+
+class AbortStats:
+    """Time-to-abort of cancelled runs, from the abort request until the run stopped, last `max_samples` aborts"""
+
+    def __init__(self, max_samples: int = 256):
+        self.samples: Deque[float] = deque(maxlen=max_samples)
+        self.aborts = 0
+        self.timeouts = 0  # Runs that did not stop, even after their resources were released
+
+    def record(self, started: float, stopped: bool = True) -> float:
+        """Records an abort requested at `started` (time.monotonic()), returns its duration in seconds"""
+        elapsed = time.monotonic() - started
+        self.aborts += 1
+        if stopped:
+            self.samples.append(elapsed)
+        else:
+            self.timeouts += 1
+        return elapsed
+
+    def stats(self) -> dict:
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {"aborts": self.aborts, "timeouts": self.timeouts}
+        return {
+            "aborts": self.aborts,
+            "timeouts": self.timeouts,
+            "p50_ms": round(ordered[len(ordered) // 2] * 1000),
+            "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000),
+            "max_ms": round(ordered[-1] * 1000),
+        }
@@ -0,0 +1,240 @@
+import asyncio
+import functools
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from langgraph.graph import END
+from langgraph.types import Command
+
+from accounting import RunAccounting
+from budget import RunBudget
+from link_index import LinkIndex
+from research_node import ResearchNode
+from serialization import dumpb, loads
+
+# Next node after each node with a static edge, should_continue routes with Command(goto=...)
+NEXT_NODE = {"plan": "scrape", "scrape": "summarize", "summarize": "should_continue", "gen_report": END}
+
+# Runtime members rebuilt on resume, never checkpointed
+RUNTIME_KEYS = ("scraper", "progress", "accounting", "budget", "links", "master_node", "current_node")
+
+
+def encode_tree(master_node: ResearchNode) -> List[Dict[str, Any]]:
+    """Pre-order [{id, parent, query, depth, pages}], pages keep their "text_ref" into the content store"""
+    return [
+        {
+            "id": node.id,
+            "parent": node.parent.id if node.parent else None,
+            "query": node.query,
+            "depth": node.depth,
+            "pages": list(node.pages()),
+        }
+        for node in master_node.iter_nodes()
+    ]
+
+
+def decode_tree(tree: List[Dict[str, Any]], texts: Dict[str, str]) -> ResearchNode:
+    """Rebuilds a tree with the same node ids, page bodies come from `texts` (text_ref -> text)"""
+    root = ResearchNode(tree[0]["query"])
+    root.id = tree[0]["id"]
+    nodes = {root.id: root}
+    for entry in tree[1:]:
+        node = ResearchNode(entry["query"])
+        node.id = entry["id"]
+        nodes[entry["parent"]].add_child(entry["query"], node=node)
+        nodes[node.id] = node
+    for entry in tree:
+        if entry["pages"]:
+            nodes[entry["id"]].data = [
+                {**{key: value for key, value in page.items() if key not in ("text_ref", "text_bytes")}, "text": texts.get(page.get("text_ref"), "")}
+                for page in entry["pages"]
+            ]
+    return root
+
+
+class SQLiteCheckpointer:
+    """
+    Durable ResearchState after every graph node, keyed by the run's job id.
+    Only the latest checkpoint of a run is kept. Page bodies are stored once per run by their content hash,
+    so a checkpoint only writes the tree outline and the pages scraped since the previous one.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS checkpoints (
+        run_id TEXT PRIMARY KEY,
+        step INTEGER NOT NULL,
+        node TEXT NOT NULL,
+        next TEXT NOT NULL,
+        state BLOB NOT NULL,
+        updated REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS pages (
+        run_id TEXT NOT NULL,
+        ref TEXT NOT NULL,
+        text TEXT NOT NULL,
+        PRIMARY KEY (run_id, ref)
+    );
+    """
+
+    def __init__(self, path: str, retention: Optional[float] = None):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.retention = retention if retention is not None else float(os.getenv("KNET_CHECKPOINT_RETENTION", 7 * 86400))
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        self._saved_refs: Dict[str, Set[str]] = {}  # run -> page refs already in the pages table
+        self._last_purge = 0.0
+
+    async def _run(self, fn, *args):
+        return await asyncio.to_thread(self._locked, fn, *args)
+
+    def _locked(self, fn, *args):
+        with self._lock:
+            return fn(*args)
+
+    def _transaction(self, fn, *args):
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(*args)
+            self._conn.execute("COMMIT")
+            return result
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    async def save(self, node: str, next_node: str, state: Dict[str, Any]):
+        run_id = state["job_id"]
+        master_node: ResearchNode = state["master_node"]
+        saved = self._saved_refs.setdefault(run_id, set())
+        new_pages = []
+        for tree_node in master_node.iter_nodes():
+            for page in tree_node.pages():
+                ref = page.get("text_ref")
+                if ref and ref not in saved:
+                    new_pages.append((run_id, ref, tree_node.page_text(page)))
+                    saved.add(ref)
+
+        snapshot = {key: value for key, value in state.items() if key not in RUNTIME_KEYS}
+        snapshot["progress"] = state["progress"].progress
+        snapshot["accounting"] = {"run_id": state["accounting"].run_id, "started_at": state["accounting"].started_at, "records": state["accounting"].records}
+        snapshot["budget"] = state["budget"].to_dict() if state.get("budget") else None
+        snapshot["links"] = state["links"].stats() if state.get("links") is not None else None
+        snapshot["tree"] = encode_tree(master_node)
+        snapshot["current_node"] = state["current_node"].id
+        payload = dumpb(snapshot)
+
+        def write():
+            self._conn.executemany("INSERT OR IGNORE INTO pages (run_id, ref, text) VALUES (?, ?, ?)", new_pages)
+            self._conn.execute(
+                """
+                INSERT INTO checkpoints (run_id, step, node, next, state, updated) VALUES (?, 1, ?, ?, ?, ?)
+                ON CONFLICT (run_id) DO UPDATE SET step = step + 1, node = excluded.node, next = excluded.next,
+                    state = excluded.state, updated = excluded.updated
+                """,
+                (run_id, node, next_node, payload, time.time()),
+            )
+
+        try:
+            await self._run(self._transaction, write)
+        except BaseException:
+            saved.difference_update(ref for _, ref, _ in new_pages)  # Retry them with the next checkpoint
+            raise
+        if next_node == END:
+            self._saved_refs.pop(run_id, None)
+        if time.time() - self._last_purge > 3600:
+            self._last_purge = time.time()
+            await self.purge(self.retention)
+
+    async def load(self, run_id: str) -> Optional[Dict[str, Any]]:
+        """
+        {"node", "next", "step", "progress", "state"} of the latest checkpoint, None if the run has none.
+        "state" is a ResearchState without scraper and progress, which the caller provides.
+        """
+
+        def select():
+            row = self._conn.execute("SELECT step, node, next, state FROM checkpoints WHERE run_id = ?", (run_id,)).fetchone()
+            if row is None:
+                return None
+            return row, dict(self._conn.execute("SELECT ref, text FROM pages WHERE run_id = ?", (run_id,)).fetchall())
+
+        found = await self._run(select)
+        if found is None:
+            return None
+        (step, node, next_node, payload), texts = found
+        state = loads(payload)
+
+        saved_accounting = state.pop("accounting")
+        accounting = RunAccounting(saved_accounting["run_id"])
+        accounting.started_at = saved_accounting["started_at"]
+        accounting.records = saved_accounting["records"]
+        master_node = decode_tree(state.pop("tree"), texts)
+        current_node = master_node.find_node(state.pop("current_node")) or master_node
+        progress = state.pop("progress")
+        saved_budget = state.pop("budget", None)
+        budget = RunBudget.from_dict(saved_budget) if saved_budget else None
+        saved_links = state.pop("links", None)
+        links = LinkIndex.from_tree(master_node, saved_links) if saved_links is not None else None  # The index is rebuilt from the pages
+        state.update({"accounting": accounting, "budget": budget, "links": links, "master_node": master_node, "current_node": current_node})
+
+        self._saved_refs[run_id] = set(texts)
+        return {"node": node, "next": next_node, "step": step, "progress": progress, "state": state}
+
+    def forget(self, run_id: str):
+        """Drops what is cached in memory for a run that stopped, done or not, its checkpoint stays"""
+        self._saved_refs.pop(run_id, None)
+
+    async def info(self, run_id: str) -> Optional[Dict[str, Any]]:
+        """{"node", "next", "step", "updated"} of the latest checkpoint without loading the state"""
+        row = await self._run(lambda: self._conn.execute("SELECT node, next, step, updated FROM checkpoints WHERE run_id = ?", (run_id,)).fetchone())
+        return dict(zip(("node", "next", "step", "updated"), row)) if row else None
+
+    async def purge(self, older_than: float) -> int:
+        def purge():
+            cutoff = time.time() - older_than
+            self._conn.execute("DELETE FROM pages WHERE run_id IN (SELECT run_id FROM checkpoints WHERE updated < ?)", (cutoff,))
+            return self._conn.execute("DELETE FROM checkpoints WHERE updated < ?", (cutoff,)).rowcount
+
+        purged = await self._run(self._transaction, purge)
+        if purged:
+            self.logger.info(f"Purged {purged} checkpoint(s) past retention")
+        return purged
+
+
+def checkpointed(checkpointer: Optional[SQLiteCheckpointer], name: str, node_fn: Callable[[Dict[str, Any]], Awaitable[Any]]):
+    """
+    Wraps a graph node so the state after it (and the node to run next) is checkpointed before the graph moves on.
+    Keeps the node's signature and return annotation, LangGraph reads Command[...] destinations from it.
+    """
+    if checkpointer is None:
+        return node_fn
+
+    @functools.wraps(node_fn)
+    async def node(state):
+        result = await node_fn(state)
+        if isinstance(result, Command):
+            update, next_node = result.update or {}, result.goto
+        else:
+            update, next_node = result or {}, NEXT_NODE[name]
+        await checkpointer.save(name, next_node, {**state, **update})
+        return result
+
+    return node
+
+
+_checkpointer: Optional[SQLiteCheckpointer] = None
+
+
+def get_checkpointer() -> Optional[SQLiteCheckpointer]:
+    """Shared checkpointer writing to KNET_CHECKPOINT_DB, None (no checkpointing) unless it is set"""
+    global _checkpointer
+    path = os.getenv("KNET_CHECKPOINT_DB", "")
+    if _checkpointer is None and path:
+        _checkpointer = SQLiteCheckpointer(path)
+    return _checkpointer
@@ -0,0 +1,78 @@
+import hashlib
+import mmap
+import os
+import tempfile
+from typing import Dict, Optional, Tuple
+
+
+class ContentStore:
+    """
+    Per research run store of page bodies, each body is kept once and referenced by its content hash.
+    Bodies of `spill_threshold` bytes or more are appended to a temp file and read back through mmap,
+    so they don't stay on the Python heap. `spill_threshold=0` keeps everything in memory.
+    """
+
+    def __init__(self, spill_threshold: Optional[int] = None, spill_dir: Optional[str] = None):
+        self.spill_threshold = spill_threshold if spill_threshold is not None else int(os.getenv("CONTENT_SPILL_BYTES", 64 * 1024))
+        self.spill_dir = spill_dir or os.getenv("CONTENT_SPILL_DIR") or None
+        self._memory: Dict[str, str] = {}
+        self._spilled: Dict[str, Tuple[int, int]] = {}  # key -> (offset, length) in the spill file
+        self._file = None
+        self._mmap: Optional[mmap.mmap] = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return len(self._memory) + len(self._spilled)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._memory or key in self._spilled
+
+    def put(self, text: str) -> str:
+        raw = text.encode("utf-8")
+        key = hashlib.blake2b(raw, digest_size=16).hexdigest()
+        if key in self:
+            return key
+        if self.spill_threshold and len(raw) >= self.spill_threshold:
+            self._spill(key, raw)
+        else:
+            self._memory[key] = text
+        return key
+
+    def get(self, key: str) -> str:
+        if key in self._memory:
+            return self._memory[key]
+        offset, length = self._spilled[key]
+        if self._mmap is None:
+            self._mmap = mmap.mmap(self._file.fileno(), self._size, access=mmap.ACCESS_READ)
+        return self._mmap[offset : offset + length].decode("utf-8")
+
+    def stats(self) -> dict:
+        return {
+            "bodies": len(self),
+            "bytes_in_memory": sum(len(text) for text in self._memory.values()),
+            "bytes_spilled": self._size,
+        }
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()  # TemporaryFile is removed on close
+            self._file = None
+        self._memory.clear()
+        self._spilled.clear()
+        self._size = 0
+
+    def _spill(self, key: str, raw: bytes):
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(prefix="knet-content-", dir=self.spill_dir)
+        self._file.seek(self._size)
+        self._file.write(raw)
+        self._file.flush()
+        self._spilled[key] = (self._size, len(raw))
+        self._size += len(raw)
+        # Mapping no longer covers the whole file, remap lazily on the next read
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
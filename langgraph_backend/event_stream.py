@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import os
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Optional, Set, Tuple
+
+from serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+
+def parse_event_id(value: Optional[str]) -> Tuple[Optional[str], int]:
+    """Last-Event-ID "<run id>:<seq>" -> (run id, seq), (None, 0) if missing or malformed"""
+    run_id, _, seq = (value or "").strip().rpartition(":")
+    if not run_id or not seq.isdigit():
+        return None, 0
+    return run_id, int(seq)
+
+
+class RunStream:
+    """
+    SSE events of one run, decoupled from the connection that started it.
+    - Every event gets the id "<run id>:<seq>", seq is monotonic per run
+    - The last `max_events` events are kept, a client that reconnects with Last-Event-ID gets only what it missed
+    - Any number of clients can be attached. With none attached for `grace` seconds `on_abandon` is called (cancels the run)
+    - `sessions` are the sessions that asked for the run (the one that started it and the ones that joined it), see leave()
+    """
+
+    def __init__(self, run_id: str, max_events: Optional[int] = None, grace: Optional[float] = None, on_abandon: Optional[Callable[[], Any]] = None):
+        self.run_id = run_id
+        self.events: Deque[Tuple[int, Dict[str, Any]]] = deque(maxlen=max_events or int(os.getenv("KNET_REPLAY_EVENTS", 1000)))
+        self.seq = 0
+        self.done = False
+        self.subscribers = 0
+        self.sessions: Set[str] = set()
+        self.grace = grace if grace is not None else float(os.getenv("KNET_REATTACH_GRACE", 60))
+        self.on_abandon = on_abandon
+        self.task: Optional[asyncio.Task] = None  # Producer task, set by StreamRegistry.start
+        self._changed = asyncio.Event()
+        self._abandon_timer: Optional[asyncio.TimerHandle] = None
+        self._arm_abandon()  # Also covers a client that never reads the stream
+
+    def publish(self, event: Dict[str, Any]) -> int:
+        self.seq += 1
+        self.events.append((self.seq, {**event, "id": f"{self.run_id}:{self.seq}"}))
+        self._wake()
+        return self.seq
+
+    def close(self):
+        self.done = True
+        if self._abandon_timer is not None:
+            self._abandon_timer.cancel()
+        self._wake()
+
+    def leave(self, session_id: str) -> bool:
+        """Drops a session that gave up on the run (aborted), True once none is left and the run may be stopped"""
+        self.sessions.discard(session_id)
+        return not self.sessions
+
+    async def subscribe(self, after: int = 0) -> AsyncIterator[Dict[str, Any]]:
+        """Events with seq > `after`, then live ones until the run ends. Yields a "replay_gap" event if some already left the buffer."""
+        self.subscribers += 1
+        if self._abandon_timer is not None:
+            self._abandon_timer.cancel()
+        try:
+            while True:
+                changed = self._changed  # Taken before reading, a publish in between is not missed
+                while after < self.seq:
+                    first = self.events[0][0]
+                    if after + 1 < first:
+                        gap = {"missed_from": after + 1, "missed_to": first - 1}
+                        yield {"event": "replay_gap", "data": dumps(gap), "id": f"{self.run_id}:{first - 1}"}
+                        after = first - 1
+                    seq, event = self.events[after + 1 - first]
+                    yield event
+                    after = seq
+                if self.done:
+                    return
+                await changed.wait()
+        finally:
+            self.subscribers -= 1
+            self._arm_abandon()
+
+    def _wake(self):
+        # Wakes every waiting subscriber, later ones wait on a fresh event
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _arm_abandon(self):
+        if self.subscribers == 0 and not self.done and self.on_abandon is not None:
+            self._abandon_timer = asyncio.get_running_loop().call_later(self.grace, self._abandon)
+
+    def _abandon(self):
+        if self.subscribers == 0 and not self.done:
+            logger.info(f"No client re-attached to run {self.run_id} within {self.grace}s, stopping it")
+            self.on_abandon()
+
+
+class StreamRegistry:
+    """Running (and recently finished, for `linger` seconds) RunStreams of this process by run id"""
+
+    def __init__(self, linger: Optional[float] = None):
+        self.linger = linger if linger is not None else float(os.getenv("KNET_REPLAY_LINGER", 300))
+        self.streams: Dict[str, RunStream] = {}
+
+    def get(self, run_id: Optional[str]) -> Optional[RunStream]:
+        return self.streams.get(run_id) if run_id else None
+
+    def start(self, run_id: str, producer: AsyncIterator[Dict[str, Any]]) -> RunStream:
+        """Runs `producer` in the background and publishes what it yields, cancelled once abandoned"""
+        stream = RunStream(run_id, on_abandon=lambda: stream.task.cancel())
+        self.streams[run_id] = stream
+
+        async def pump():
+            try:
+                async for event in producer:
+                    stream.publish(event)
+            except asyncio.CancelledError:
+                stream.publish({"event": "aborted", "data": dumps({"run_id": run_id})})
+                raise  # Whoever cancelled or awaits the task sees it cancelled
+            except Exception as e:
+                logger.error(f"Run {run_id} failed: {str(e)}")
+                stream.publish({"event": "error", "data": dumps({"message": str(e)})})
+            finally:
+                stream.close()
+                asyncio.get_running_loop().call_later(self.linger, self._forget, stream)
+
+        stream.task = asyncio.create_task(pump())
+        return stream
+
+    def _forget(self, stream: RunStream):
+        # A resumed run may have replaced it under the same id meanwhile
+        if self.streams.get(stream.run_id) is stream:
+            del self.streams[stream.run_id]
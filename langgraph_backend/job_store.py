@@ -0,0 +1,352 @@
+import asyncio
+import heapq
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Tuple
+
+from serialization import dumpb, loads
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+def claim_order(queued: List[Tuple[str, str, int, float]], running: Dict[str, int]) -> List[str]:
+    """
+    Ids of `queued` [(id, user_id, priority, created)] in the order claim() takes them if no job finishes meanwhile:
+    priority first, then the client with the fewest running jobs, then oldest. Every claim adds a running job
+    to its client, so clients with several queued jobs take turns.
+    """
+    running = dict(running)
+    heap = [(priority, running.get(user_id, 0), created, job_id, user_id) for job_id, user_id, priority, created in queued]
+    heapq.heapify(heap)
+    order = []
+    while heap:
+        priority, count, created, job_id, user_id = heapq.heappop(heap)
+        if count != running.get(user_id, 0):  # The client got a job since this entry was pushed
+            heapq.heappush(heap, (priority, running[user_id], created, job_id, user_id))
+            continue
+        order.append(job_id)
+        running[user_id] = count + 1
+    return order
+
+
+class JobStore(ABC):
+    """
+    Job queue and result store between the API processes and the research workers.
+    API: submit(), events(), get(), request_cancel() / request_snapshot()
+    Worker: claim(), append_event() / append_events(), heartbeat(), controls(), finish()
+    Implementations must be safe to use from several processes at once.
+    """
+
+    @abstractmethod
+    async def submit(self, job_id: str, kind: str, params: Dict[str, Any], user_id: str, priority: int = 1):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def claim(self, worker_id: str, kind: str) -> Optional[Dict[str, Any]]:
+        """Atomically takes the next queued job of `kind`, None if there is none"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def append_event(self, job_id: str, event: str, data: Any) -> int:
+        raise NotImplementedError
+
+    async def append_events(self, job_id: str, events: List[Tuple[str, Any]]) -> int:
+        """Appends [(event, data)] in order, returns the last seq (0 if `events` is empty)"""
+        seq = 0
+        for event, data in events:
+            seq = await self.append_event(job_id, event, data)
+        return seq
+
+    @abstractmethod
+    async def events(self, job_id: str, after: int = 0, limit: int = 500) -> List[Tuple[int, str, Any]]:
+        """[(seq, event, data)] with seq > `after`"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def finish(self, job_id: str, status: str, result: Any = None, error: Optional[str] = None):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get(self, job_id: str, with_result: bool = False) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def position(self, job_id: str) -> Optional[int]:
+        """1-based place in the queue, None once the job left it"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def find_active(self, run_id: str, stale_after: Optional[float] = None) -> Optional[str]:
+        """
+        Id of a queued or running job of the run `run_id` (its params' "job_id"), None if there is none.
+        Running jobs without a heartbeat for `stale_after` seconds don't count, their worker is gone.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def count(self, status: str, user_id: Optional[str] = None) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def request_cancel(self, job_id: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def request_snapshot(self, job_id: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def controls(self, job_id: str) -> Dict[str, int]:
+        """{"cancel": 0 | 1, "snapshot": n}, polled by the worker running the job"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def heartbeat(self, job_id: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def fail_stale(self, timeout: float) -> int:
+        """Marks running jobs whose worker stopped heartbeating as failed, returns how many"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def purge(self, older_than: float) -> int:
+        """Deletes jobs (and their events) that finished more than `older_than` seconds ago, returns how many"""
+        raise NotImplementedError
+
+
+class SQLiteJobStore(JobStore):
+    """
+    Single file implementation for one box, no external services.
+    WAL mode lets the API and worker processes read while one of them writes.
+    Calls run in a thread so the event loop is never blocked on the database.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        params BLOB NOT NULL,
+        user_id TEXT NOT NULL,
+        priority INTEGER NOT NULL DEFAULT 1,
+        status TEXT NOT NULL,
+        worker TEXT,
+        created REAL NOT NULL,
+        started REAL,
+        finished REAL,
+        heartbeat REAL,
+        cancel INTEGER NOT NULL DEFAULT 0,
+        snapshot INTEGER NOT NULL DEFAULT 0,
+        result BLOB,
+        error TEXT
+    );
+    CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (kind, status, priority, created);
+    CREATE TABLE IF NOT EXISTS events (
+        job_id TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        event TEXT NOT NULL,
+        data BLOB,
+        PRIMARY KEY (job_id, seq)
+    );
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+
+    async def _run(self, fn, *args):
+        return await asyncio.to_thread(self._locked, fn, *args)
+
+    def _locked(self, fn, *args):
+        with self._lock:
+            return fn(*args)
+
+    def _transaction(self, fn, *args):
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers can't claim the same job
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(*args)
+            self._conn.execute("COMMIT")
+            return result
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    async def submit(self, job_id: str, kind: str, params: Dict[str, Any], user_id: str, priority: int = 1):
+        await self._run(
+            self._conn.execute,
+            "INSERT INTO jobs (id, kind, params, user_id, priority, status, created) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, dumpb(params), user_id, priority, QUEUED, time.time()),
+        )
+
+    async def claim(self, worker_id: str, kind: str) -> Optional[Dict[str, Any]]:
+        def claim():
+            # Priority first, then clients with the fewest running jobs, then oldest
+            row = self._conn.execute(
+                """
+                SELECT id, params, user_id, priority FROM jobs AS j
+                WHERE kind = ? AND status = ?
+                ORDER BY priority,
+                         (SELECT COUNT(*) FROM jobs AS r WHERE r.status = ? AND r.user_id = j.user_id),
+                         created
+                LIMIT 1
+                """,
+                (kind, QUEUED, RUNNING),
+            ).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, worker = ?, started = ?, heartbeat = ? WHERE id = ?", (RUNNING, worker_id, now, now, row[0])
+            )
+            return {"id": row[0], "params": loads(row[1]), "user_id": row[2], "priority": row[3]}
+
+        return await self._run(self._transaction, claim)
+
+    async def append_event(self, job_id: str, event: str, data: Any) -> int:
+        def append():
+            (seq,) = self._conn.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM events WHERE job_id = ?", (job_id,)).fetchone()
+            self._conn.execute("INSERT INTO events (job_id, seq, event, data) VALUES (?, ?, ?, ?)", (job_id, seq, event, dumpb(data)))
+            return seq
+
+        return await self._run(self._transaction, append)
+
+    async def append_events(self, job_id: str, events: List[Tuple[str, Any]]) -> int:
+        # One transaction for the whole batch
+        def append():
+            (seq,) = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM events WHERE job_id = ?", (job_id,)).fetchone()
+            rows = [(job_id, seq + i, event, dumpb(data)) for i, (event, data) in enumerate(events, 1)]
+            self._conn.executemany("INSERT INTO events (job_id, seq, event, data) VALUES (?, ?, ?, ?)", rows)
+            return seq + len(rows)
+
+        if not events:
+            return 0
+        return await self._run(self._transaction, append)
+
+    async def events(self, job_id: str, after: int = 0, limit: int = 500) -> List[Tuple[int, str, Any]]:
+        def select():
+            return self._conn.execute(
+                "SELECT seq, event, data FROM events WHERE job_id = ? AND seq > ? ORDER BY seq LIMIT ?", (job_id, after, limit)
+            ).fetchall()
+
+        return [(seq, event, loads(data)) for seq, event, data in await self._run(select)]
+
+    async def finish(self, job_id: str, status: str, result: Any = None, error: Optional[str] = None):
+        await self._run(
+            self._conn.execute,
+            "UPDATE jobs SET status = ?, finished = ?, result = ?, error = ? WHERE id = ?",
+            (status, time.time(), dumpb(result) if result is not None else None, error, job_id),
+        )
+
+    async def get(self, job_id: str, with_result: bool = False) -> Optional[Dict[str, Any]]:
+        def select():
+            return self._conn.execute(
+                f"SELECT id, status, user_id, worker, created, started, finished, error{', result' if with_result else ''} FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+
+        row = await self._run(select)
+        if row is None:
+            return None
+        job = dict(zip(("id", "status", "user_id", "worker", "created", "started", "finished", "error"), row[:8]))
+        if with_result:
+            job["result"] = loads(row[8]) if row[8] is not None else None
+        return job
+
+    async def position(self, job_id: str) -> Optional[int]:
+        # Same order as claim(), which re-ranks clients after every claim
+        def select():
+            row = self._conn.execute("SELECT kind, status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None or row[1] != QUEUED:
+                return None
+            queued = self._conn.execute("SELECT id, user_id, priority, created FROM jobs WHERE kind = ? AND status = ?", (row[0], QUEUED)).fetchall()
+            running = self._conn.execute("SELECT user_id, COUNT(*) FROM jobs WHERE status = ? GROUP BY user_id", (RUNNING,)).fetchall()
+            return claim_order(queued, dict(running)).index(job_id) + 1
+
+        return await self._run(select)
+
+    async def find_active(self, run_id: str, stale_after: Optional[float] = None) -> Optional[str]:
+        def select():
+            return self._conn.execute("SELECT id, status, heartbeat, params FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)).fetchall()
+
+        now = time.time()
+        for job_id, status, heartbeat, params in await self._run(select):  # Queued and running jobs are few, params aren't indexed
+            if status == RUNNING and stale_after is not None and (heartbeat or 0) < now - stale_after:
+                continue
+            if loads(params).get("job_id") == run_id:
+                return job_id
+        return None
+
+    async def count(self, status: str, user_id: Optional[str] = None) -> int:
+        def select():
+            if user_id is None:
+                return self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()
+            return self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ? AND user_id = ?", (status, user_id)).fetchone()
+
+        (n,) = await self._run(select)
+        return n
+
+    async def request_cancel(self, job_id: str):
+        # Queued jobs are cancelled right away, running ones when their worker polls controls()
+        def cancel():
+            self._conn.execute("UPDATE jobs SET cancel = 1 WHERE id = ?", (job_id,))
+            self._conn.execute("UPDATE jobs SET status = ?, finished = ? WHERE id = ? AND status = ?", (CANCELLED, time.time(), job_id, QUEUED))
+
+        await self._run(self._transaction, cancel)
+
+    async def request_snapshot(self, job_id: str):
+        await self._run(self._conn.execute, "UPDATE jobs SET snapshot = snapshot + 1 WHERE id = ?", (job_id,))
+
+    async def controls(self, job_id: str) -> Dict[str, int]:
+        row = await self._run(lambda: self._conn.execute("SELECT cancel, snapshot FROM jobs WHERE id = ?", (job_id,)).fetchone())
+        return {"cancel": row[0], "snapshot": row[1]} if row else {"cancel": 1, "snapshot": 0}
+
+    async def heartbeat(self, job_id: str):
+        await self._run(self._conn.execute, "UPDATE jobs SET heartbeat = ? WHERE id = ?", (time.time(), job_id))
+
+    async def fail_stale(self, timeout: float) -> int:
+        def fail():
+            now = time.time()
+            return self._conn.execute(
+                "UPDATE jobs SET status = ?, finished = ?, error = ? WHERE status = ? AND heartbeat < ?",
+                (FAILED, now, "Research worker stopped responding", RUNNING, now - timeout),
+            ).rowcount
+
+        return await self._run(fail)
+
+    async def purge(self, older_than: float) -> int:
+        def purge():
+            cutoff = time.time() - older_than
+            self._conn.execute("DELETE FROM events WHERE job_id IN (SELECT id FROM jobs WHERE finished < ?)", (cutoff,))
+            return self._conn.execute("DELETE FROM jobs WHERE finished < ?", (cutoff,)).rowcount
+
+        return await self._run(self._transaction, purge)
+
+
+_store: Optional[JobStore] = None
+
+
+def get_job_store() -> Optional[JobStore]:
+    """
+    Store selected by KNET_JOB_STORE, None keeps research in the API process.
+    sqlite:///path/to/jobs.db
+    """
+    global _store
+    url = os.getenv("KNET_JOB_STORE")
+    if _store is None and url:
+        if not url.startswith("sqlite:///"):
+            raise ValueError(f"Unsupported KNET_JOB_STORE '{url}'")
+        _store = SQLiteJobStore(url[len("sqlite:///") :])
+    return _store
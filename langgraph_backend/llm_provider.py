@@ -0,0 +1,171 @@
+import asyncio
+import hashlib
+import os
+import random
+import re
+from abc import ABC, abstractmethod
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Dict, List, Optional, get_args, get_origin, get_type_hints, is_typeddict
+
+from langchain_google_genai import ChatGoogleGenerativeAI
+
+from llm_gateway import estimate_tokens
+
+
+class LLMResponse:
+    def __init__(self, content: Dict[str, Any] | str, input_tokens: int = 0, output_tokens: int = 0):
+        self.content = content
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+
+    @property
+    def total_tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+
+class LLMProvider(ABC):
+    """Backend agnostic LLM interface used by the graph nodes"""
+
+    name = "base"
+
+    @abstractmethod
+    async def generate(self, prompt: str, schema: Optional[type] = None, temperature: Optional[float] = None) -> LLMResponse:
+        """Returns a dict shaped like the `schema` TypedDict when given, plain text otherwise"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def stream(self, prompt: str, temperature: Optional[float] = None) -> AsyncIterator[LLMResponse]:
+        """Plain text generation as it is produced, token counts on each chunk are increments"""
+        raise NotImplementedError
+
+
+class GeminiProvider(LLMProvider):
+    name = "gemini"
+
+    def __init__(self, model: str = "gemini-2.0-flash", api_key: Optional[str] = None):
+        self.model = model
+        self.api_key = api_key or os.getenv("GOOGLE_API_KEY")
+        self._llms: Dict[Optional[float], ChatGoogleGenerativeAI] = {}
+
+    def _llm(self, temperature: Optional[float]) -> ChatGoogleGenerativeAI:
+        # One client per temperature, RunnableConfig does not carry sampling params
+        if temperature not in self._llms:
+            kwargs = {} if temperature is None else {"temperature": temperature}
+            # Retries are owned by the shared gateway (backoff + AIMD), not by the client
+            self._llms[temperature] = ChatGoogleGenerativeAI(model=self.model, google_api_key=self.api_key, max_retries=1, **kwargs)
+        return self._llms[temperature]
+
+    async def generate(self, prompt: str, schema: Optional[type] = None, temperature: Optional[float] = None) -> LLMResponse:
+        llm = self._llm(temperature)
+        if schema:
+            output = await llm.with_structured_output(schema, include_raw=True).ainvoke(prompt)
+            if output.get("parsing_error"):
+                raise output["parsing_error"]
+            message, content = output["raw"], output["parsed"]
+        else:
+            message = await llm.ainvoke(prompt)
+            content = message.text()
+        usage = message.usage_metadata or {}
+        return LLMResponse(content, input_tokens=usage.get("input_tokens", 0), output_tokens=usage.get("output_tokens", 0))
+
+    async def stream(self, prompt: str, temperature: Optional[float] = None) -> AsyncIterator[LLMResponse]:
+        # usage_metadata on AIMessageChunks is already incremental
+        # Closed with this generator, an abandoned stream (aborted run) ends its HTTP response right away
+        async with aclosing(self._llm(temperature).astream(prompt)) as chunks:
+            async for chunk in chunks:
+                usage = chunk.usage_metadata or {}
+                yield LLMResponse(chunk.text(), input_tokens=usage.get("input_tokens", 0), output_tokens=usage.get("output_tokens", 0))
+
+
+class StubProvider(LLMProvider):
+    """
+    Deterministic local provider for load tests, no network and no quota.
+    Responses are valid for the requested TypedDict and depend only on (seed, prompt).
+    Latency and output token counts follow gaussians: (mean, stddev).
+    """
+
+    name = "stub"
+
+    def __init__(
+        self,
+        latency: tuple[float, float] = (1.0, 0.3),
+        output_tokens: tuple[float, float] = (400, 150),
+        continue_probability: float = 0.6,
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.output_tokens = output_tokens
+        self.continue_probability = continue_probability
+        self.seed = seed
+
+    async def generate(self, prompt: str, schema: Optional[type] = None, temperature: Optional[float] = None) -> LLMResponse:
+        rng = random.Random(hashlib.sha256(f"{self.seed}:{prompt}".encode()).digest())
+        n_tokens = max(1, int(rng.gauss(*self.output_tokens)))
+        await asyncio.sleep(max(0.0, rng.gauss(*self.latency)))
+
+        words = re.findall(r"[A-Za-z][A-Za-z0-9-]{2,}", prompt) or ["lorem", "ipsum", "dolor"]
+        content = self._fake(schema, rng, words, n_tokens) if schema else self._text(rng, words, n_tokens)
+        return LLMResponse(content, input_tokens=estimate_tokens(prompt), output_tokens=n_tokens)
+
+    async def stream(self, prompt: str, temperature: Optional[float] = None) -> AsyncIterator[LLMResponse]:
+        rng = random.Random(hashlib.sha256(f"{self.seed}:{prompt}".encode()).digest())
+        n_tokens = max(1, int(rng.gauss(*self.output_tokens)))
+        latency = max(0.0, rng.gauss(*self.latency))
+
+        words = re.findall(r"[A-Za-z][A-Za-z0-9-]{2,}", prompt) or ["lorem", "ipsum", "dolor"]
+        text = self._text(rng, words, n_tokens)
+        pieces = [text[i : i + 80] for i in range(0, len(text), 80)]
+        # First token after ~20% of the latency, the rest spread evenly
+        await asyncio.sleep(latency * 0.2)
+        for i, piece in enumerate(pieces):
+            if i:
+                await asyncio.sleep(latency * 0.8 / len(pieces))
+            yield LLMResponse(
+                piece,
+                input_tokens=estimate_tokens(prompt) if i == 0 else 0,
+                output_tokens=n_tokens // len(pieces) + (n_tokens % len(pieces) if i == 0 else 0),
+            )
+
+    def _fake(self, schema: Any, rng: random.Random, words: List[str], n_tokens: int) -> Any:
+        if is_typeddict(schema):
+            fields = get_type_hints(schema)
+            if len(fields) == 1 and next(iter(fields.values())) is str:
+                # Single text field (e.g. ReportFillin) carries the whole output
+                return {key: self._text(rng, words, n_tokens) for key in fields}
+            return {key: self._fake(field, rng, words, n_tokens) for key, field in fields.items()}
+        if get_origin(schema) in (list, List):
+            (item,) = get_args(schema) or (str,)
+            return [self._fake(item, rng, words, n_tokens) for _ in range(rng.randint(2, 5))]
+        if schema is bool:
+            return rng.random() < self.continue_probability
+        if schema is int:
+            return rng.randint(0, 100)
+        if schema is float:
+            return rng.random()
+        return " ".join(rng.choices(words, k=rng.randint(3, 6)))
+
+    def _text(self, rng: random.Random, words: List[str], n_tokens: int) -> str:
+        # ~0.75 words per token, split into paragraphs
+        body = rng.choices(words, k=max(1, int(n_tokens * 0.75)))
+        return "\n\n".join(" ".join(body[i : i + 60]) for i in range(0, len(body), 60))
+
+
+def _pair(value: Optional[str], default: tuple[float, float]) -> tuple[float, float]:
+    if not value:
+        return default
+    mean, _, stddev = value.partition(",")
+    return float(mean), float(stddev or 0)
+
+
+def get_provider() -> LLMProvider:
+    """Provider selected by LLM_PROVIDER (gemini | stub)"""
+    name = os.getenv("LLM_PROVIDER", "gemini").lower()
+    if name == "stub":
+        return StubProvider(
+            latency=_pair(os.getenv("LLM_STUB_LATENCY"), (1.0, 0.3)),
+            output_tokens=_pair(os.getenv("LLM_STUB_OUTPUT_TOKENS"), (400, 150)),
+            seed=int(os.getenv("LLM_STUB_SEED", 0)),
+        )
+    if name == "gemini":
+        return GeminiProvider(model=os.getenv("LLM_MODEL", "gemini-2.0-flash"))
+    raise ValueError(f"Unknown LLM_PROVIDER '{name}'")
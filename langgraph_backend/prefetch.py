@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import os
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Set
+
+
+class Prefetcher:
+    """
+    Uses the browser while it would sit idle (the LLM phases of a node) to fetch pages a run is likely to ask for next,
+    the top outbound links a crawl mode run may follow. Fetched pages wait in a small LRU cache.
+    Prefetching runs one page at a time and only while no foreground scrape is going, a foreground scrape
+    cancels the page in flight, which goes back to the front of the queue.
+    At most `max_cached` pages are kept (KNET_PREFETCH_CACHE), a page dropped before it was used counts as wasted.
+    """
+
+    def __init__(self, fetch: Callable[[List[str]], Awaitable[List[Dict[str, Any]]]], max_cached: Optional[int] = None):
+        self.logger = logging.getLogger(__name__)
+        self.fetch = fetch  # Scrapes urls, returns the pages that succeeded
+        self.max_cached = max_cached if max_cached is not None else int(os.getenv("KNET_PREFETCH_CACHE", 64))
+        self.cache: OrderedDict[str, Dict[str, Any]] = OrderedDict()  # url -> page
+        self.queue: Deque[str] = deque()
+        self.scheduled: Set[str] = set()  # Queued, in flight or cached, not asked for yet
+        self._foreground = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._fetching: Optional[asyncio.Task] = None
+        self.fetched = 0
+        self.hits = 0  # Scheduled pages asked for and served from the cache
+        self.misses = 0  # Scheduled pages asked for before they were fetched
+        self.wasted = 0
+        self.preempted = 0
+
+    def schedule(self, urls: Iterable[str]):
+        """Queues `urls` for the next idle time, the ones already cached or queued are skipped"""
+        if self.max_cached <= 0:
+            return
+        queued = set(self.queue)
+        for url in urls:
+            if url not in self.cache and url not in queued:
+                self.queue.append(url)
+                queued.add(url)
+                self.scheduled.add(url)
+        while len(self.queue) > self.max_cached:
+            self.scheduled.discard(self.queue.popleft())  # Oldest candidates are the least likely to be asked for now
+        if self.queue and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+
+    def take(self, urls: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Cached pages of `urls` by url, removed from the cache. The ones still queued are not prefetched anymore."""
+        pages = {}
+        for url in urls:
+            if url not in self.scheduled:
+                continue  # Never a prefetch candidate, neither a hit nor a miss
+            self.scheduled.discard(url)
+            page = self.cache.pop(url, None)
+            if page is None:
+                self.misses += 1
+                if url in self.queue:
+                    self.queue.remove(url)
+            else:
+                self.hits += 1
+                pages[url] = page
+        return pages
+
+    @asynccontextmanager
+    async def foreground(self):
+        """Scope of a foreground scrape, prefetching pauses and the page in flight is cancelled"""
+        self._foreground += 1
+        self._idle.clear()
+        if self._fetching is not None and not self._fetching.done():
+            self._fetching.cancel()
+            await asyncio.wait([self._fetching])
+        try:
+            yield
+        finally:
+            self._foreground -= 1
+            if self._foreground == 0:
+                self._idle.set()
+
+    async def _run(self):
+        while True:
+            if not self.queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            await self._idle.wait()
+            if not self.queue:
+                continue
+            url = self.queue.popleft()
+            self._fetching = asyncio.create_task(self.fetch([url]))
+            try:
+                pages = await asyncio.shield(self._fetching)
+            except asyncio.CancelledError:
+                if not self._fetching.cancelled():  # The prefetcher itself was stopped
+                    self._fetching.cancel()
+                    raise
+                self.preempted += 1
+                if url in self.scheduled:  # Unless the foreground scrape asked for it
+                    self.queue.appendleft(url)
+                continue
+            except Exception:
+                self.logger.warning(f"Prefetch of {url} failed", exc_info=True)
+                self.scheduled.discard(url)
+                continue
+            finally:
+                self._fetching = None
+            self.fetched += len(pages)
+            if url not in self.scheduled:  # Asked for while in flight, the foreground scrape already has it
+                self.wasted += len(pages)
+                continue
+            for page in pages:
+                self.cache[url] = page  # Keyed by the requested url, a redirect still hits
+                self.cache.move_to_end(url)
+            if not pages:
+                self.scheduled.discard(url)
+            while len(self.cache) > self.max_cached:
+                self.scheduled.discard(self.cache.popitem(last=False)[0])
+                self.wasted += 1
+
+    def clear(self):
+        """Drops the queue, e.g. when the run that scheduled it ends"""
+        self.scheduled.difference_update(self.queue)
+        self.queue.clear()
+
+    async def close(self):
+        self.clear()
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.wait([self._task])
+        self.wasted += len(self.cache)
+        self.cache.clear()
+        self.scheduled.clear()
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            "fetched": self.fetched,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / requests, 3) if requests else 0.0,
+            "wasted": self.wasted,
+            "preempted": self.preempted,
+            "cached": len(self.cache),
+            "queued": len(self.queue),
+        }
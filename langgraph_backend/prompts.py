@@ -97,6 +97,43 @@ Suggest {n} specific google search queries that:
 Return as JSON array of objects with properties:
 - query (string)""")
 
+NEXT_ACTION_PROMPT = dedent("""Given the current state of research on topic {vertical}, decide whether to continue exploring the current branch or not.
+If you continue, also create the next google search queries.
+<Original user query>
+{topic}
+</Original user query>
+
+<Global Research Plan>
+{research_plan}
+</Global Research Plan>
+
+Current Topic: {query}
+
+<Past Searched Queries>
+{past_queries}
+</Past Searched Queries>
+
+<Findings under current topic>
+{ctx_manager}
+</Findings under current topic>
+
+For the decision consider:
+- Information saturation
+- Information duplication
+- Coverage of current topic
+- Potential for new insights
+
+If the decision is true, suggest {n} specific google search queries that:
+- Covers what has not been covered yet
+- Builds upon these findings
+- Explores different aspects
+- Goes deeper into important details
+
+- Do not do quote searches
+- Queries should be generic and short
+- Do not presume any knowledge about the topic
+Return the decision (true/false) and the queries as branches (empty when the decision is false)""")
+
 REPORT_OUTLINE_PROMPT = dedent("""Generate a outline for a report based on the findings:
 <Original user query>
 {topic}
@@ -0,0 +1,92 @@
+import os
+import re
+import unicodedata
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from research_node import ResearchNode
+
+_WORD = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a about an and are as at be been between by for from how in into is its more most of on or over than that the their then "
+    "there these this those to versus vs was were what when where which who why with".split()
+)
+_SUFFIXES = ("ations", "ation", "ings", "ing", "ies", "es", "ed", "s", "e")
+
+
+def _stem(word: str) -> str:
+    # Crude, only has to map "pricing" and "price" (or "optimisation" and "optimise") to the same stem
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[: -len(suffix)] + ("y" if suffix == "ies" else "")
+    return word
+
+
+def query_terms(query: str) -> FrozenSet[str]:
+    words = _WORD.findall(unicodedata.normalize("NFKC", query).casefold())
+    return frozenset(_stem(word) for word in words if word not in _STOPWORDS)
+
+
+def _trigrams(word: str) -> FrozenSet[str]:
+    return frozenset(word[i : i + 3] for i in range(len(word) - 2))
+
+
+def _same_term(a: str, b: str) -> bool:
+    # Exact stems, or spelling variants of longer words ("optimis" / "optimiz")
+    if a == b:
+        return True
+    if len(a) < 5 or len(b) < 5:
+        return False
+    ta, tb = _trigrams(a), _trigrams(b)
+    return len(ta & tb) / len(ta | tb) >= 0.6
+
+
+def similarity(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    """Dice coefficient of two term sets where terms match by stem or close spelling, order and stopwords don't count"""
+    if not a or not b:
+        return 0.0
+    matched = sum(1 for term in a if term in b or any(_same_term(term, other) for other in b))
+    return min(1.0, 2 * matched / (len(a) + len(b)))
+
+
+class QueryRegistry:
+    """
+    Every search query of a run, to catch near-duplicates ("X pricing 2025" / "X price 2025") before they cost
+    a search, a scrape and a summary. Queries at least `threshold` similar (KNET_QUERY_DEDUP_THRESHOLD, 0 disables)
+    are duplicates. Skipped ones are recorded for the report's metadata.
+    """
+
+    def __init__(self, threshold: Optional[float] = None):
+        self.threshold = threshold if threshold is not None else float(os.getenv("KNET_QUERY_DEDUP_THRESHOLD", 0.8))
+        self._entries: List[Tuple[FrozenSet[str], ResearchNode]] = []
+        self.skipped: List[Dict[str, str]] = []  # {"query", "duplicate_of"}
+
+    @classmethod
+    def from_tree(cls, master_node: ResearchNode, skipped: Optional[List[Dict[str, str]]] = None) -> "QueryRegistry":
+        """Registry of every query already in a research tree"""
+        registry = cls()
+        for node in master_node.iter_nodes():
+            if node is not master_node:
+                registry.add(node)
+        registry.skipped = list(skipped or [])
+        return registry
+
+    def add(self, node: ResearchNode):
+        self._entries.append((query_terms(node.query), node))
+
+    def match(self, query: str) -> Optional[ResearchNode]:
+        """Most similar registered node if `query` is a near-duplicate of it"""
+        if self.threshold <= 0:
+            return None
+        terms = query_terms(query)
+        best, best_score = None, self.threshold
+        for other, node in self._entries:
+            score = similarity(terms, other)
+            if score >= best_score:
+                best, best_score = node, score
+        return best
+
+    def skip(self, query: str, duplicate: ResearchNode):
+        self.skipped.append({"query": query, "duplicate_of": duplicate.query})
+
+    def stats(self) -> dict:
+        return {"queries": len(self._entries), "skipped": len(self.skipped), "duplicates": self.skipped[-20:]}
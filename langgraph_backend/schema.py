@@ -13,6 +13,11 @@ class SearchQuery(TypedDict):
     branches: List[str]
 
 
+class NextAction(TypedDict):
+    decision: bool
+    branches: List[str]
+
+
 class ReportOutline(TypedDict):
     title: str
     headings: List[str]
@@ -1,7 +1,7 @@
 import asyncio
 import json
 import logging
-import time
+import os
 from typing import Any, Dict, List
 from urllib.parse import quote_plus
 
@@ -9,6 +9,10 @@ import requests
 from bs4 import BeautifulSoup
 from crawl4ai import AsyncWebCrawler, BrowserConfig, CacheMode, CrawlerRunConfig
 
+from link_index import crawl_mode
+from prefetch import Prefetcher
+from query_registry import query_terms
+
 
 class CrawlForAIScraper:
     def __init__(self) -> None:
@@ -24,14 +28,19 @@ class CrawlForAIScraper:
         )
         self.crawler = AsyncWebCrawler(config=self.base_browser)
         self._is_started = False
+        self.last_stats: Dict[str, Any] = {}  # Stats of the last search_and_scrape call, for run accounting
+        # Links a crawl mode run may follow next, fetched while the browser is idle (KNET_PREFETCH_LINKS per query)
+        self.prefetcher = Prefetcher(lambda urls: self._fetch_pages(urls, len(urls), concurrency=1))
+        self.prefetch_links = int(os.getenv("KNET_PREFETCH_LINKS", 2)) if crawl_mode() else 0  # Only crawl mode follows links
 
     async def start(self):
         if not self._is_started:
             await self.crawler.start()
-            time.sleep(1)
+            await asyncio.sleep(1)
             self._is_started = True
 
     async def close(self):
+        await self.prefetcher.close()
         if self._is_started:
             await self.crawler.close()
             self._is_started = False
@@ -40,25 +49,48 @@ class CrawlForAIScraper:
         await self.start()
         self.logger.info(f"Querying: {query}")
 
-        # Perform a search to get a list of webpages
-        search_results = await self._search(query)
+        async with self.prefetcher.foreground():
+            # Perform a search to get a list of webpages
+            search_results = await self._search(query)
 
-        # Scrape each webpage
-        scraped_data = []
-        self.logger.info(f"Scraping {num_sites} sites...")
-        data = await self._scrape_pages(search_results[: num_sites + 2], num_sites)
-        scraped_data.extend(data)
+            # Scrape each webpage
+            self.last_stats = {"retries": 0, "search_results": len(search_results)}
+            scraped_data = []
+            self.logger.info(f"Scraping {num_sites} sites...")
+            idx_next_page = num_sites + 2
+            data = await self._scrape_pages(search_results[:idx_next_page], num_sites)
+            scraped_data.extend(data)
 
-        # Scrape next pages when some failed
-        for _ in range(3):
-            if len(scraped_data) < num_sites:
-                idx_last_page = search_results.index(search_results[-1])
-                data = await self._scrape_pages(search_results[idx_last_page + 1 : num_sites + 2], num_sites)
-                scraped_data.extend(data)
+            # Scrape next pages when some failed
+            for _ in range(3):
+                if len(scraped_data) < num_sites and idx_next_page < len(search_results):
+                    self.last_stats["retries"] += 1
+                    missing = num_sites - len(scraped_data)
+                    data = await self._scrape_pages(search_results[idx_next_page : idx_next_page + missing], missing)
+                    scraped_data.extend(data)
+                    idx_next_page += missing
 
         self.logger.info(f"Completed scraping {len(scraped_data)} sites")
+        self._prefetch(query, scraped_data)
         return scraped_data
 
+    async def crawl(self, urls: List[str], num_sites: int, query: str = "") -> List[Dict[str, Any]]:
+        """Scrapes `urls` directly without a search, for links followed from already scraped pages"""
+        await self.start()
+        self.logger.info(f"Crawling {len(urls)} linked pages...")
+        self.last_stats = {"retries": 0, "search_results": 0}
+        async with self.prefetcher.foreground():
+            pages = list(await self._scrape_pages(urls, num_sites))
+        self._prefetch(query, pages)
+        return pages
+
+    def _prefetch(self, query: str, pages: List[Dict[str, Any]]):
+        """Queues the outbound links of `pages` whose anchor text shares most terms with `query`"""
+        terms = query_terms(query)
+        links = {link["href"]: len(terms & query_terms(link.get("text") or "")) for page in pages for link in page.get("links") or []}
+        top_links = sorted((url for url, score in links.items() if score), key=links.get, reverse=True)[: self.prefetch_links]
+        self.prefetcher.schedule(top_links)
+
     async def _search(self, query: str) -> List[str]:
         try:
             encoded_query = quote_plus(query)
@@ -143,7 +175,17 @@ class CrawlForAIScraper:
             self.logger.error(f"DuckDuckGo search error: {str(e)}")
             return []
 
-    async def _scrape_pages(self, urls: str, max_sites: int) -> Dict[str, Any]:
+    async def _scrape_pages(self, urls: List[str], max_sites: int) -> List[Dict[str, Any]]:
+        # Prefetched pages first, only the rest is fetched now
+        cached = self.prefetcher.take(urls)
+        if cached:
+            self.logger.info(f"{len(cached)} of {len(urls)} pages were prefetched")
+        pages, remaining = list(cached.values()), [url for url in urls if url not in cached]
+        if remaining and len(pages) < max_sites:
+            pages.extend(await self._fetch_pages(remaining, max_sites - len(pages)))
+        return pages[:max_sites]
+
+    async def _fetch_pages(self, urls: List[str], max_sites: int, concurrency: int = 4) -> Dict[str, Any]:
         await self.start()
 
         try:
@@ -153,7 +195,7 @@ class CrawlForAIScraper:
                 screenshot=False,
                 cache_mode=CacheMode.BYPASS,
                 scan_full_page=True,
-                semaphore_count=4,
+                semaphore_count=concurrency,
                 wait_for_images=True,
                 scroll_delay=0.1,
                 delay_before_return_html=2,
@@ -188,6 +230,7 @@ class CrawlForAIScraper:
                     all_videos = list(set(all_videos + media_videos))
 
                     data = {
+                        "title": (result.metadata or {}).get("title"),
                         "url": str(result.url),
                         "text": str(result.markdown),
                         "images": all_images,
@@ -198,6 +241,10 @@ class CrawlForAIScraper:
                     self.logger.info(f"  - {result.url[:80]}...")
             return scraped_sites[:max_sites]
 
+        except asyncio.CancelledError:
+            # Open pages are closed as the crawl tasks unwind, or with the browser in close()
+            self.logger.info(f"Scraping of {len(urls)} pages cancelled")
+            raise
         except Exception as e:
             self.logger.error(f"Scraping error while {urls}: {str(e)}")
             return {}
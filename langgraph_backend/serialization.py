@@ -0,0 +1,82 @@
+from typing import Any, Iterable, Optional
+
+import orjson
+
+try:
+    import msgpack
+except ImportError:  # Optional, clients fall back to JSON
+    msgpack = None
+
+# Non str dict keys show up in a few tool outputs, numpy arrays in the similarity metrics
+_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+JSON = "json"
+MSGPACK = "msgpack"
+ENCODINGS = (MSGPACK, JSON) if msgpack else (JSON,)
+
+
+def _default(obj: Any) -> Any:
+    # Types orjson doesn't serialize natively
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if hasattr(obj, "model_dump"):  # pydantic
+        return obj.model_dump()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumpb(obj: Any, indent: bool = False) -> bytes:
+    return orjson.dumps(obj, default=_default, option=_OPTIONS | (orjson.OPT_INDENT_2 if indent else 0))
+
+
+def dumps(obj: Any, indent: bool = False) -> str:
+    return dumpb(obj, indent).decode("utf-8")
+
+
+def loads(data: str | bytes | bytearray | memoryview) -> Any:
+    return orjson.loads(data)
+
+
+def dump(obj: Any, path: str, indent: bool = True):
+    with open(path, "wb") as f:
+        f.write(dumpb(obj, indent))
+
+
+def load(path: str) -> Any:
+    with open(path, "rb") as f:
+        return orjson.loads(f.read())
+
+
+class SocketJSON:
+    """Drop-in for the stdlib `json` module where a library takes one (python-socketio `json=`)"""
+
+    JSONDecodeError = orjson.JSONDecodeError
+
+    @staticmethod
+    def dumps(obj: Any, *args, **kwargs) -> str:
+        return dumps(obj)
+
+    @staticmethod
+    def loads(data: str | bytes, *args, **kwargs) -> Any:
+        return orjson.loads(data)
+
+
+def negotiate(accepted: Optional[str | Iterable[str]]) -> str:
+    """Pick the first encoding the client accepts that we support, JSON otherwise"""
+    if not accepted:
+        return JSON
+    if isinstance(accepted, str):
+        accepted = [part.strip() for part in accepted.split(",")]
+    for encoding in accepted:
+        if encoding in ENCODINGS:
+            return encoding
+    return JSON
+
+
+def encode(obj: Any, encoding: str = JSON) -> Any:
+    """
+    Payload for a client that negotiated `encoding`.
+    JSON payloads are returned as is, the transport serializes them (through SocketJSON for Socket.IO).
+    """
+    if encoding == MSGPACK and msgpack and obj is not None:
+        return msgpack.packb(obj, default=_default, use_bin_type=True)
+    return obj
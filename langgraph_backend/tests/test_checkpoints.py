@@ -0,0 +1,74 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("langgraph")
+
+from accounting import RunAccounting  # noqa: E402
+from checkpoints import SQLiteCheckpointer, decode_tree, encode_tree  # noqa: E402
+from research_node import ResearchNode  # noqa: E402
+
+
+def build() -> ResearchNode:
+    master = ResearchNode("topic")
+    a = master.add_child("a")
+    a.data = [{"url": "https://a", "title": "A", "text": "page a"}, {"url": "https://empty", "title": "", "text": ""}]
+    a.add_child("a1").data = [{"url": "https://a1", "title": "A1", "text": "page a1", "hop": 1}]
+    master.add_child("b")
+    return master
+
+
+def texts_of(master: ResearchNode) -> dict:
+    return {page["text_ref"]: node.page_text(page) for node in master.iter_nodes() for page in node.pages() if page.get("text_ref")}
+
+
+def test_tree_round_trip():
+    master = build()
+    restored = decode_tree(encode_tree(master), texts_of(master))
+
+    assert restored.build_tree_outline() == master.build_tree_outline()
+    assert restored.build_tree_structure() == master.build_tree_structure()
+    assert restored.get_all_data() == master.get_all_data()
+    assert (restored.total_children(), restored.source_count(), restored.max_depth(), restored.text_bytes()) == (
+        master.total_children(),
+        master.source_count(),
+        master.max_depth(),
+        master.text_bytes(),
+    )
+    a1 = master.children[0].children[0]
+    assert restored.find_node(a1.id).get_path_to_root() == ["topic", "a", "a1"]
+
+
+def test_checkpoint_save_and_load(tmp_path):
+    master = build()
+    current = master.children[0]
+    accounting = RunAccounting("run")
+    accounting.records.append({"stage": "plan", "tokens": 10})
+    state = {
+        "job_id": "run",
+        "topic": "topic",
+        "master_node": master,
+        "current_node": current,
+        "progress": SimpleNamespace(progress=40),
+        "accounting": accounting,
+        "budget": None,
+        "links": None,
+        "pending_queries": ["next query"],
+    }
+
+    async def main():
+        checkpointer = SQLiteCheckpointer(str(tmp_path / "checkpoints.db"))
+        await checkpointer.save("summarize", "should_continue", state)
+        await checkpointer.save("summarize", "should_continue", state)  # Pages are only written once
+        checkpointer.forget("run")
+        return await checkpointer.load("run"), await checkpointer.load("other run")
+
+    loaded, missing = asyncio.run(main())
+    assert missing is None
+    assert (loaded["node"], loaded["next"], loaded["step"], loaded["progress"]) == ("summarize", "should_continue", 2, 40)
+    restored = loaded["state"]
+    assert restored["master_node"].build_tree_structure() == master.build_tree_structure()
+    assert restored["current_node"].id == current.id
+    assert restored["pending_queries"] == ["next query"]
+    assert restored["accounting"].records == accounting.records
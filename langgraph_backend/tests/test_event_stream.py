@@ -0,0 +1,186 @@
+import asyncio
+
+from event_stream import RunStream, StreamRegistry, parse_event_id
+from serialization import loads
+
+
+async def collect(stream: RunStream, after: int = 0) -> list:
+    return [event async for event in stream.subscribe(after)]
+
+
+def seqs(events: list) -> list:
+    return [parse_event_id(event["id"])[1] for event in events]
+
+
+def test_parse_event_id():
+    assert parse_event_id("run:1:42") == ("run:1", 42)
+    assert parse_event_id(" run:7 ") == ("run", 7)
+    for value in (None, "", "run", "run:", ":3", "run:x", "run:-1"):
+        assert parse_event_id(value) == (None, 0)
+
+
+def test_reconnect_gets_only_what_it_missed():
+    async def main():
+        stream = RunStream("run", max_events=10)
+        for i in range(5):
+            stream.publish({"event": "status", "data": str(i)})
+        stream.close()
+        return await collect(stream), await collect(stream, after=3)
+
+    everything, missed = asyncio.run(main())
+    assert seqs(everything) == [1, 2, 3, 4, 5]
+    assert [event["id"] for event in missed] == ["run:4", "run:5"]
+    assert [event["data"] for event in missed] == ["3", "4"]
+
+
+def test_replay_gap_once_the_buffer_evicted_events():
+    async def main():
+        stream = RunStream("run", max_events=3)
+        for i in range(6):
+            stream.publish({"event": "status", "data": str(i)})
+        stream.close()
+        return await collect(stream, after=1)
+
+    events = asyncio.run(main())
+    assert events[0]["event"] == "replay_gap"
+    assert loads(events[0]["data"]) == {"missed_from": 2, "missed_to": 3}
+    assert events[0]["id"] == "run:3"  # A reconnect after the gap resumes behind it
+    assert seqs(events[1:]) == [4, 5, 6]
+
+
+def test_live_events_reach_every_subscriber():
+    async def main():
+        stream = RunStream("run")
+        first = asyncio.create_task(collect(stream))
+        second = asyncio.create_task(collect(stream))
+        await asyncio.sleep(0)
+        for i in range(3):
+            stream.publish({"event": "status", "data": str(i)})
+            await asyncio.sleep(0)
+        stream.close()
+        return await first, await second
+
+    first, second = asyncio.run(main())
+    assert seqs(first) == seqs(second) == [1, 2, 3]
+
+
+def test_abandoned_after_grace_without_a_subscriber():
+    async def main():
+        abandoned = []
+        stream = RunStream("run", grace=0.05, on_abandon=lambda: abandoned.append("run"))
+        await asyncio.sleep(0.02)
+        attached = abandoned == []
+        await asyncio.sleep(0.06)
+        return attached, abandoned
+
+    attached, abandoned = asyncio.run(main())
+    assert attached and abandoned == ["run"]
+
+
+def test_subscriber_that_reattaches_in_time_keeps_the_run():
+    async def main():
+        abandoned = []
+        stream = RunStream("run", grace=0.05, on_abandon=lambda: abandoned.append("run"))
+        reader = asyncio.create_task(collect(stream))
+        await asyncio.sleep(0.08)  # Longer than the grace while attached
+        reader.cancel()  # The client went away, the grace starts over
+        await asyncio.sleep(0.02)
+        while_reconnecting = list(abandoned)
+        reader = asyncio.create_task(collect(stream))
+        await asyncio.sleep(0.08)
+        stream.close()
+        await reader
+        await asyncio.sleep(0.06)  # Finished runs are not abandoned
+        return while_reconnecting, abandoned
+
+    while_reconnecting, abandoned = asyncio.run(main())
+    assert while_reconnecting == [] and abandoned == []
+
+
+def test_leave_is_true_once_no_session_is_left():
+    async def main():
+        stream = RunStream("run")
+        stream.sessions.update({"owner", "joined"})
+        return stream.leave("owner"), stream.leave("owner"), stream.leave("joined")
+
+    assert asyncio.run(main()) == (False, False, True)
+
+
+def test_finished_run_lingers_for_replay():
+    async def main():
+        registry = StreamRegistry(linger=0.05)
+
+        async def producer():
+            yield {"event": "status", "data": "1"}
+            yield {"event": "result", "data": "2"}
+
+        stream = registry.start("run", producer())
+        await stream.task
+        lingering = registry.get("run") is stream
+        replayed = await collect(stream)
+        await asyncio.sleep(0.08)
+        return lingering, replayed, registry.get("run")
+
+    lingering, replayed, forgotten = asyncio.run(main())
+    assert lingering and [event["event"] for event in replayed] == ["status", "result"]
+    assert forgotten is None
+
+
+def test_resumed_run_is_not_forgotten_with_the_old_one():
+    async def main():
+        registry = StreamRegistry(linger=0.02)
+        release = asyncio.Event()
+
+        async def producer():
+            await release.wait()
+            yield {"event": "result", "data": "done"}
+
+        release.set()
+        old = registry.start("run", producer())
+        await old.task
+        release.clear()
+        resumed = registry.start("run", producer())
+        await asyncio.sleep(0.04)  # The old stream's linger ran out while the resumed run is still going
+        release.set()
+        await resumed.task
+        return registry.get("run") is resumed
+
+    assert asyncio.run(main())
+
+
+def test_abandoned_run_is_cancelled_and_says_so(monkeypatch):
+    monkeypatch.setenv("KNET_REATTACH_GRACE", "0.02")
+
+    async def main():
+        registry = StreamRegistry(linger=1)
+
+        async def producer():
+            yield {"event": "status", "data": "started"}
+            await asyncio.sleep(10)
+            yield {"event": "result", "data": "never"}
+
+        stream = registry.start("run", producer())
+        await asyncio.sleep(0.05)
+        return stream, await collect(stream)
+
+    stream, events = asyncio.run(main())
+    assert stream.task.cancelled() and stream.done
+    assert [event["event"] for event in events] == ["status", "aborted"]
+    assert loads(events[-1]["data"]) == {"run_id": "run"}
+
+
+def test_failed_run_publishes_the_error():
+    async def main():
+        registry = StreamRegistry(linger=0)
+
+        async def producer():
+            yield {"event": "status", "data": "started"}
+            raise RuntimeError("model unavailable")
+
+        stream = registry.start("run", producer())
+        await stream.task
+        return await collect(stream)
+
+    events = asyncio.run(main())
+    assert [event["event"] for event in events] == ["status", "error"]
+    assert loads(events[-1]["data"]) == {"message": "model unavailable"}
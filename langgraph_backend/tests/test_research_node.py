@@ -0,0 +1,95 @@
+import pytest
+
+from research_node import ResearchNode
+
+
+def page(url: str, text: str = "body") -> dict:
+    return {"url": url, "title": url, "text": text}
+
+
+def outline(node: ResearchNode) -> dict:
+    return {
+        "query": node.query,
+        "sources": sorted(d["url"] for d in node.data),
+        "children": [outline(child) for child in node.children],
+        "aggregates": (node.total_children(), node.source_count(), node.max_depth()),
+    }
+
+
+def build() -> ResearchNode:
+    """v0: master -> a -> a1, master -> b, a1 has one page"""
+    master = ResearchNode("topic")
+    a = master.add_child("a")
+    a.add_child("a1").data = [page("https://a1")]
+    master.add_child("b")
+    return master
+
+
+def test_with_child_keeps_the_old_version():
+    v0 = build()
+    before = outline(v0)
+    a = v0.children[0]
+
+    v1 = v0.with_child(a.id, ResearchNode("a2"))
+    assert outline(v0) == before
+    assert [c.query for c in v1.find_node(a.id).children] == ["a1", "a2"]
+    assert v1.total_children() == v0.total_children() + 1
+    assert v1.max_depth() == 2
+
+
+def test_only_the_path_is_copied():
+    v0 = build()
+    a, b = v0.children
+    v1 = v0.with_child(a.id, ResearchNode("a2"))
+
+    assert v1 is not v0 and v1.id == v0.id
+    assert v1.find_node(a.id) is not a
+    assert v1.find_node(b.id) is b  # Off the path, shared
+    assert v1.find_node(a.children[0].id) is a.children[0]
+    assert v0.find_node(v1.find_node(a.id).children[1].id) is None
+
+
+def test_with_data_updates_the_new_version_only():
+    v0 = build()
+    b = v0.children[1]
+
+    v1 = v0.with_data(b.id, [page("https://b1"), page("https://b2")])
+    assert v0.source_count() == 1 and b.data == []
+    assert v1.source_count() == 3
+    assert v1.find_node(b.id).source_count() == 2
+    assert [d["url"] for d in v1.find_node(b.id).data] == ["https://b1", "https://b2"]
+
+
+def test_shared_nodes_refuse_data_in_place():
+    v0 = build()
+    a, b = v0.children
+    v0.with_child(a.id, ResearchNode("a2"))
+
+    with pytest.raises(ValueError):
+        b.data = [page("https://b1")]  # Shared with the new version
+    with pytest.raises(ValueError):
+        a.children[0].data = []  # Below a node of an old version
+    assert b.data == [] and v0.source_count() == 1
+
+
+def test_versions_chain():
+    v0 = build()
+    a = v0.children[0]
+    new = ResearchNode("a2")
+    versions = [v0, v0.with_child(a.id, new)]
+    versions.append(versions[-1].with_data(new.id, [page("https://a2")]))
+    versions.append(versions[-1].with_child(new.id, ResearchNode("a2x")))
+
+    assert [v.total_children() for v in versions] == [3, 4, 4, 5]
+    assert [v.source_count() for v in versions] == [1, 1, 2, 2]
+    assert [v.max_depth() for v in versions] == [2, 2, 2, 3]
+    assert versions[1].find_node(new.id).data == []
+    assert [d["url"] for d in versions[3].find_node(new.id).data] == ["https://a2"]
+
+
+def test_unknown_nodes_are_rejected():
+    v0 = build()
+    with pytest.raises(ValueError):
+        v0.with_child("missing", ResearchNode("x"))
+    with pytest.raises(ValueError):
+        v0.children[0].with_data(v0.children[1].id, [])  # Not under this root
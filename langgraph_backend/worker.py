@@ -0,0 +1,204 @@
+"""
+Research worker, runs queued jobs from the shared job store (KNET_JOB_STORE) in its own process.
+
+    KNET_JOB_STORE=sqlite:///jobs.db python worker.py --slots 2
+
+Start as many workers as the box allows, the API processes (app.py with the same KNET_JOB_STORE)
+only enqueue jobs and stream their events back to the right client.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import time
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from app import JOB_KIND, resume_research_workflow, start_research_workflow
+from artifact_store import get_artifact_store
+from budget import RunBudget
+from cancellation import cancel_and_wait
+from event_queue import merge_status
+from job_store import CANCELLED, DONE, FAILED, JobStore, get_job_store
+from scraper import CrawlForAIScraper
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+
+class EventRelay:
+    """
+    Events of one job on their way to the job store.
+    Consecutive `progress` / `report_delta` events are coalesced (event_queue.merge_status) and written in one transaction
+    at most every `interval` seconds (KNET_RELAY_INTERVAL), any other event is written right away with what is pending.
+    """
+
+    MERGEABLE = ("progress", "report_delta")
+
+    def __init__(self, store: JobStore, job_id: str, interval: Optional[float] = None):
+        self.store = store
+        self.job_id = job_id
+        self.interval = interval if interval is not None else float(os.getenv("KNET_RELAY_INTERVAL", 0.25))
+        self._pending: List[List[Any]] = []  # [event, data]
+        self._lock = asyncio.Lock()  # Batches are written in order
+        self._flushed = time.monotonic()
+        self.coalesced = 0
+        self.batches = 0
+
+    async def put(self, event: str, data: Any):
+        if event in self.MERGEABLE and self._pending and self._pending[-1][0] == event:
+            merged = self.merge(event, self._pending[-1][1], data)
+            if merged is not None:
+                self._pending[-1][1] = merged
+                self.coalesced += 1
+                data = None
+        if data is not None:
+            self._pending.append([event, data])
+        if event not in self.MERGEABLE or time.monotonic() - self._flushed >= self.interval:
+            await self.flush()
+
+    @staticmethod
+    def merge(event: str, old: Dict[str, Any], new: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        # A progress event is a status payload, a report_delta event is the "report_delta" part of one
+        if event == "report_delta":
+            merged = merge_status({"report_delta": old}, {"report_delta": new})
+            return merged["report_delta"] if merged is not None else None
+        return merge_status(old, new)
+
+    async def flush(self):
+        async with self._lock:
+            self._flushed = time.monotonic()
+            if not self._pending:
+                return
+            events, self._pending = self._pending, []
+            await self.store.append_events(self.job_id, [(event, data) for event, data in events])
+            self.batches += 1
+
+
+class Worker:
+    def __init__(self, store: JobStore, worker_id: str, slots: int = 1, poll_interval: float = 0.5, stale_after: float = 60, retention: float = 86400):
+        self.store = store
+        self.worker_id = worker_id
+        self.slots = slots
+        self.poll_interval = poll_interval  # Seconds between queue polls and control checks
+        self.stale_after = stale_after  # Running jobs without a heartbeat for this long are failed
+        self.retention = retention  # Finished jobs and their events are kept this long
+
+    async def run(self):
+        logger.info(f"Worker {self.worker_id} started with {self.slots} slot(s)")
+        await asyncio.gather(*(self.slot(i) for i in range(self.slots)), self.janitor())
+
+    async def slot(self, index: int):
+        # One browser per slot, reused across jobs
+        scraper = CrawlForAIScraper()
+        await scraper.start()
+        try:
+            while True:
+                job = await self.store.claim(f"{self.worker_id}/{index}", JOB_KIND)
+                if job is None:
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                await self.run_job(scraper, job)
+        finally:
+            await scraper.close()
+
+    async def run_job(self, scraper: CrawlForAIScraper, job: dict):
+        job_id, params = job["id"], job["params"]
+        logger.info(f"Running job {job_id}: {params.get('topic') or 'resume ' + params['resume']}")
+        relay = EventRelay(self.store, job_id)
+
+        async def stream() -> dict | None:
+            result = None
+            if "resume" in params:
+                events = resume_research_workflow(params["resume"], scraper)
+            else:
+                events = start_research_workflow(
+                    params["topic"],
+                    scraper,
+                    params["max_depth"],
+                    params["num_sites_per_query"],
+                    params["fused_planner"],
+                    job_id=params["job_id"],
+                    budget=RunBudget.from_params(params.get("budget")),
+                )
+            async for event in events:
+                await relay.put(event["event"], event["data"])
+                if event["event"] == "result":
+                    result = event["data"]
+            return result
+
+        task = asyncio.create_task(stream())
+        watcher = asyncio.create_task(self.watch(job_id, task, relay))
+        try:
+            await asyncio.wait([task, watcher], return_when=asyncio.FIRST_COMPLETED)
+            if task.cancelling():
+                # Aborted (see watch). Bounded: a run stuck in the browser gets it closed under it, the next scrape starts a new one
+                started = time.monotonic()
+                if await cancel_and_wait(task, force=scraper.close):
+                    logger.info(f"Job {job_id} stopped {time.monotonic() - started:.2f}s after the abort was seen")
+                else:
+                    logger.error(f"Job {job_id} still running {time.monotonic() - started:.2f}s after being cancelled")
+            await asyncio.wait([task])
+        except asyncio.CancelledError:
+            # Worker is shutting down
+            task.cancel()
+            await relay.flush()
+            await self.store.finish(job_id, FAILED, error="Research worker shut down")
+            raise
+        finally:
+            watcher.cancel()
+
+        await relay.flush()  # Whatever the run streamed before it stopped
+
+        if task.cancelled():
+            await self.store.finish(job_id, CANCELLED)
+        elif task.exception() is not None:
+            logger.error(f"Job {job_id} failed: {str(task.exception())}")
+            await self.store.finish(job_id, FAILED, error=str(task.exception()))
+        else:
+            await self.store.finish(job_id, DONE, result=task.result())
+        logger.info(f"Job {job_id} finished, {relay.batches} event batch(es), {relay.coalesced} event(s) coalesced")
+
+    async def watch(self, job_id: str, task: asyncio.Task, relay: EventRelay):
+        # Heartbeat, abort requests from the API process, and events pending while the run waits on the LLM
+        while not task.done():
+            await asyncio.sleep(self.poll_interval)
+            await relay.flush()
+            await self.store.heartbeat(job_id)
+            if (await self.store.controls(job_id))["cancel"]:
+                logger.info(f"Job {job_id} cancelled")
+                task.cancel()
+                return
+
+    async def janitor(self):
+        while True:
+            failed = await self.store.fail_stale(self.stale_after)
+            purged = await self.store.purge(self.retention)
+            await get_artifact_store().cleanup()
+            if failed or purged:
+                logger.info(f"Failed {failed} stale job(s), purged {purged} finished job(s)")
+            await asyncio.sleep(60)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="KnowledgeNet research worker")
+    parser.add_argument("--slots", type=int, default=int(os.getenv("KNET_WORKER_SLOTS", 1)), help="Research runs executing at once in this process")
+    args = parser.parse_args()
+
+    store = get_job_store()
+    if store is None:
+        raise SystemExit("KNET_JOB_STORE is not set, e.g. KNET_JOB_STORE=sqlite:///jobs.db")
+
+    worker = Worker(
+        store,
+        f"{socket.gethostname()}:{os.getpid()}",
+        slots=args.slots,
+        stale_after=float(os.getenv("KNET_JOB_STALE_AFTER", 60)),
+        retention=float(os.getenv("KNET_JOB_RETENTION", 86400)),
+    )
+    asyncio.run(worker.run())